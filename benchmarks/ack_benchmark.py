@@ -0,0 +1,78 @@
+""" Acknowledged command benchmark.
+
+Sends commands with `SerialHandler(acknowledge=True)` to a `RampSimulator` pseudo-terminal that
+loses a fraction of them (a noisy USB link), and measures:
+
+- round trip: time from the write of each command to its ack from the simulated firmware (p50/p95/p99)
+- retried: commands sent again because their ack did not arrive within the timeout
+  (only the idempotent ones, i.e. the speed settings)
+- lost: commands reported lost after the retries (the rotation toggles are never sent again)
+- delivered: commands the simulator received, out of the commands sent
+
+Half of the commands are speed settings (`rx20`/`ex150`, retried) and half are rotation toggles
+(`rs0`/`rs1`, not retried), sent at a fixed interval.
+
+Usage:
+    python benchmarks/ack_benchmark.py [--commands N] [--loss 0 0.01 0.05] [--latency MS]
+"""
+# Standard libraries
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "boccia-gui"))
+
+from PyQt5.QtCore import QCoreApplication
+
+# Custom libraries
+from commands import Commands
+from serial_handler import SerialHandler
+from ramp_simulator import RampSimulator
+
+COMMANDS = ["rx20", "rs1", "ex150", "rs0"]
+
+
+def run(app, commands:int, loss:float, latency:float, interval:float):
+    """ Send `commands` acknowledged commands through a link that loses `loss` of them, return the results """
+    simulator = RampSimulator(latency=latency, jitter=latency / 2, loss=loss, seed=1)
+    serial_handler = SerialHandler(simulator.start(), command_queue_size=commands + 1, acknowledge=True)
+    serial_handler.connect()
+    try:
+        for i in range(commands):
+            serial_handler.send_command(COMMANDS[i % len(COMMANDS)])
+            app.processEvents()
+            time.sleep(interval)
+
+        # Wait for the last acks, retries and timeouts
+        deadline = time.monotonic() + (Commands.ACK_VARIABLES["max_retries"] + 2) * Commands.ACK_VARIABLES["timeout"] + 1
+        while serial_handler.get_ack_stats()["pending"] and (time.monotonic() < deadline):
+            app.processEvents()
+            time.sleep(0.01)
+
+        stats = serial_handler.get_ack_stats()
+        stats["delivered"] = len(simulator.received_commands)
+        return stats
+    finally:
+        serial_handler.disconnect()
+        simulator.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commands", type=int, default=400, help="Number of commands sent for each loss rate")
+    parser.add_argument("--loss", type=float, nargs="+", default=[0, 0.01, 0.05], help="Fractions of the commands lost by the link")
+    parser.add_argument("--latency", type=float, default=5, help="Firmware latency [ms]")
+    parser.add_argument("--interval", type=float, default=5, help="Time between commands [ms]")
+    args = parser.parse_args()
+
+    app = QCoreApplication(sys.argv)
+    print(f"{args.commands} commands, firmware latency {args.latency:g} ms, ack timeout {1e3 * Commands.ACK_VARIABLES['timeout']:g} ms")
+    print(f"{'loss':<8}{'acked':>8}{'p50 [ms]':>10}{'p95 [ms]':>10}{'p99 [ms]':>10}{'retried':>9}{'lost':>7}{'delivered':>11}")
+    for loss in args.loss:
+        stats = run(app, args.commands, loss, args.latency / 1000, args.interval / 1000)
+        percentiles = "".join(f"{1e3 * stats[name]:>10.2f}" if stats[name] is not None else f"{'-':>10}" for name in ("p50", "p95", "p99"))
+        print(f"{loss:<8g}{stats['count']:>8}{percentiles}{stats['retried']:>9}{stats['lost']:>7}{stats['delivered']:>11}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+""" Times the Bluetooth discovery backends on recorded fixtures.
+
+PowerShell (Windows): each `<case>.txt` in `benchmarks/fixtures/powershell` is a recorded
+output of `PowerShellBackend.DISCOVERY_SCRIPT`, and `<case>.expected.json` lists the
+adapters and paired devices it should be parsed into.
+
+BlueZ (Linux): each `<case>.json` in `benchmarks/fixtures/bluez` has the files of a
+sysfs and bluetoothd storage tree, written to a temporary directory for the `BlueZBackend`
+to read, and the adapters and paired devices it should find. (The trees are kept in JSON
+because the BlueZ file names contain ':', which cannot be checked out on Windows.) The optional
+"bus" dict has the adapter addresses bluetoothd would answer on D-Bus, {hci device: address}.
+
+Runs on any platform, no PowerShell or Bluetooth adapter is needed. The expected results
+are checked by `tests/test_bt_devices.py` (`python -m pytest tests`).
+
+Usage:
+    python benchmarks/discovery_benchmark.py [--iterations N]
+"""
+# Standard libraries
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "boccia-gui"))
+
+# Custom libraries
+from bt_devices import PowerShellBackend, BlueZBackend
+
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, "fixtures")
+
+
+def load_powershell_fixtures():
+    """ Return {case: function that runs the backend} """
+    fixtures_dir = os.path.join(FIXTURES_DIR, "powershell")
+    fixtures = {}
+    for file_name in sorted(os.listdir(fixtures_dir)):
+        if not file_name.endswith(".txt"):
+            continue
+        case = file_name[:-len(".txt")]
+        with open(os.path.join(fixtures_dir, file_name), encoding="utf-8") as f:
+            output = f.read()
+        fixtures[f"powershell/{case}"] = lambda output=output: PowerShellBackend.parse_discovery_output(output)
+    return fixtures
+
+
+def load_bluez_fixtures(root:str):
+    """ Write the BlueZ trees under `root`, return {case: function that runs the backend} """
+    fixtures_dir = os.path.join(FIXTURES_DIR, "bluez")
+    fixtures = {}
+    for file_name in sorted(os.listdir(fixtures_dir)):
+        if not file_name.endswith(".json"):
+            continue
+        case = file_name[:-len(".json")]
+        with open(os.path.join(fixtures_dir, file_name), encoding="utf-8") as f:
+            fixture = json.load(f)
+
+        case_root = os.path.join(root, case)
+        for directory in fixture["directories"]:
+            os.makedirs(os.path.join(case_root, directory), exist_ok=True)
+        for path, content in fixture["files"].items():
+            path = os.path.join(case_root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+
+        bus = fixture.get("bus", {})
+        backend = BlueZBackend(os.path.join(case_root, "sys", "class", "bluetooth"), os.path.join(case_root, "var", "lib", "bluetooth"),
+                               lambda hci_device, bus=bus: bus.get(hci_device, ""))
+        fixtures[f"bluez/{case}"] = backend.discover
+    return fixtures
+
+
+def time_function(function, iterations:int):
+    """ Return the mean time to run `function`, in seconds """
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start_time) / iterations
+
+
+def time_process_spawn(iterations:int):
+    """ Return the mean time to start an empty process (the cost of a subprocess per lookup), in seconds """
+    return time_function(lambda: subprocess.run([sys.executable, "-c", "pass"]), iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000, help="Number of times each fixture is discovered")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        fixtures = load_powershell_fixtures()
+        fixtures.update(load_bluez_fixtures(root))
+
+        print(f"{'case':<34}{'mean [us]':>12}")
+        for case, discover in fixtures.items():
+            mean = time_function(discover, args.iterations)
+            print(f"{case:<34}{1e6 * mean:>12.2f}")
+
+    print(f"{'(reference) empty process spawn':<34}{1e6 * time_process_spawn(10):>12.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+""" Keypress-to-wire latency benchmark for the main device app.
+
+Drives `MainWindow` under Qt's offscreen platform, injects key events through the
+event queue (so they go through `KeyPressHandler.eventFilter`) and button clicks on
+the user and operator controls. The commands are timestamped when they come out of
+the serial port, on a `RampSimulator` pseudo-terminal.
+
+With `--trace` (or BOCCIA_TRACE=1), the latency of each stage of the pipeline is printed after
+each GUI load, see `boccia-gui/pipeline_tracing.py`.
+
+Usage:
+    python benchmarks/latency_benchmark.py [--iterations N] [--load {idle,repaint,both}] [--trace]
+"""
+# Standard libraries
+import os
+import sys
+import time
+import argparse
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "boccia-gui"))
+
+from PyQt5.QtCore import Qt, QEvent, QTimer
+from PyQt5.QtGui import QKeyEvent
+from PyQt5.QtWidgets import QApplication, QPushButton
+
+# Custom libraries
+from commands import Commands
+from main_window import MainWindow
+from ramp_simulator import RampSimulator
+from pipeline_tracing import tracer
+
+TIMEOUT = 2.0   # [sec] Max time to wait for a command to reach the port
+
+
+class LatencyBenchmark():
+    """ Injects GUI events into `MainWindow` and measures when the commands reach the wire """
+
+    def __init__(self, app, iterations:int = 200):
+        self.app = app
+        self.iterations = iterations
+
+        # Simulated ramp without latency, so only the controller side is measured
+        self.simulator = RampSimulator(latency=0, jitter=0)
+        port_name = self.simulator.start()
+
+        self.window = MainWindow(include_multiplayer_controls=False)
+        self.window.commands.drop_delay = 0     # Do not wait for the real drop time between drops
+        self.window.show()
+
+        self.window.serial_handler.port = port_name
+        self.window.serial_handler.connect()
+
+        # Synthetic repaint load, a zero-interval timer that repaints the whole window
+        self.load_timer = QTimer()
+        self.load_timer.setInterval(0)
+        self.load_timer.timeout.connect(self.window.repaint)
+
+    def close(self):
+        self.load_timer.stop()
+        self.window.close()
+        self.simulator.stop()
+
+    def set_load(self, load:bool):
+        if load:
+            self.load_timer.start()
+        else:
+            self.load_timer.stop()
+
+    # Event injection
+    def post_key(self, key, event_type = QEvent.KeyPress):
+        """ Post a key event to the window, it is filtered by `KeyPressHandler.eventFilter` """
+        self.app.postEvent(self.window, QKeyEvent(event_type, key, Qt.NoModifier))
+
+    def click_button(self, widget, text:str):
+        """ Queue a click on the button of `widget` with `text` """
+        button = next(b for b in widget.findChildren(QPushButton) if b.text() == text)
+        QTimer.singleShot(0, button.click)
+
+    # Measurement helpers
+    def wait_for_commands(self, count:int):
+        """ Process events until the simulator has received `count` commands, return their receive times """
+        deadline = time.monotonic() + TIMEOUT
+        while len(self.simulator.received_commands) < count:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Only {len(self.simulator.received_commands)} of {count} commands reached the port")
+            self.app.processEvents()
+        return [t for t, _ in self.simulator.received_commands[count - 1:count]]
+
+    def wait_for_drop_reset(self):
+        """ Process events until the drop delay is over and the controls are enabled again """
+        while self.window.commands.get_drop_delay_active():
+            self.app.processEvents()
+        self.app.processEvents()
+
+    def measure(self, inject_actions:list, after = None):
+        """ Run each of `inject_actions` (functions that send exactly one command) one at a time,
+        return the latency of each one and the overall throughput """
+        latencies = []
+        start_time = time.monotonic()
+
+        for _ in range(self.iterations):
+            for inject in inject_actions:
+                expected = len(self.simulator.received_commands) + 1
+                inject_time = time.monotonic()
+                inject()
+                received_time, = self.wait_for_commands(expected)
+                latencies.append(received_time - inject_time)
+
+                if after:
+                    after()
+
+        elapsed = time.monotonic() - start_time
+        return latencies, len(latencies) / elapsed
+
+    # Scenarios
+    def run_scenarios(self):
+        """ Return {scenario: (latencies, throughput)} """
+        user = self.window.user_controls_widget
+        operator = self.window.operator_controls_widget
+        scenarios = {
+            "hold key (A)": ([
+                lambda: self.post_key(Qt.Key_A),
+                lambda: self.post_key(Qt.Key_A, QEvent.KeyRelease),
+                ], None),
+            # Each command is started and stopped in the same iteration, so it is not left running for the next scenario
+            "toggle key (1)": ([
+                lambda: self.post_key(Qt.Key_1),
+                lambda: self.post_key(Qt.Key_1),
+                ], None),
+            "drop key (R)": ([lambda: self.post_key(Qt.Key_R)], self.wait_for_drop_reset),
+            "hold button (W)": ([
+                lambda: self.click_button(operator, "W ↑"),
+                lambda: self.click_button(operator, "W ↑"),
+                ], None),
+            "toggle button": ([
+                lambda: self.click_button(user, "Elevation up"),
+                lambda: self.click_button(user, "Elevation up"),
+                ], None),
+            "drop button": ([lambda: self.click_button(user, "Drop")], self.wait_for_drop_reset),
+            }
+
+        results = {}
+        for name, (actions, after) in scenarios.items():
+            results[name] = self.measure(actions, after)
+        return results
+
+
+def percentile(values:list, fraction:float):
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def print_results(load_name:str, results:dict):
+    print(f"\nGUI load: {load_name}")
+    print(f"{'scenario':<18}{'p50 [ms]':>10}{'p95 [ms]':>10}{'p99 [ms]':>10}{'max [ms]':>10}{'cmd/s':>10}")
+    for name, (latencies, throughput) in results.items():
+        p50, p95, p99 = (1000 * percentile(latencies, f) for f in (0.50, 0.95, 0.99))
+        print(f"{name:<18}{p50:>10.3f}{p95:>10.3f}{p99:>10.3f}{1000 * max(latencies):>10.3f}{throughput:>10.0f}")
+
+
+def main():
+    # The benchmarks are not recorded in today's session trace
+    Commands.TRACE_VARIABLES["enabled"] = False
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200, help="Number of repetitions of each scenario")
+    parser.add_argument("--load", choices=["idle", "repaint", "both"], default="both", help="GUI load to run the scenarios under")
+    parser.add_argument("--trace", action="store_true", help="Print the latency of each stage of the pipeline")
+    args = parser.parse_args()
+    tracer.enable(tracer.enabled or args.trace)
+
+    app = QApplication(sys.argv)
+    benchmark = LatencyBenchmark(app, args.iterations)
+
+    loads = ["idle", "repaint"] if args.load == "both" else [args.load]
+    try:
+        for load_name in loads:
+            benchmark.set_load(load_name == "repaint")
+            tracer.reset()
+            print_results(load_name, benchmark.run_scenarios())
+            if tracer.enabled:
+                print(f"\n{tracer.report()}")
+    finally:
+        tracer.enable(False)    # The stages were already printed, not again when the window closes
+        benchmark.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+""" Macro engine benchmark.
+
+Runs the "Full" calibration of `Commands.CALIBRATION_MACROS` with `MacroRunner` against a
+`RampSimulator` pseudo-terminal, and compares it with the same calibration sent as one chained
+command (`Commands.CALIBRATION_COMMANDS["Full"]`, "dd-70>rc>ec"), which the firmware runs back to
+back. The difference is what the macro engine adds between the steps (reading the line that ends
+a step and sending the next command).
+
+- chained: time from sending the chained command to the last "calibration complete" line
+- macro: time from starting the macro to its end
+- overhead: (macro - chained) / number of commands. It includes the firmware latency of each command
+  (5 ms in the simulator), which the chained command only pays once
+
+Usage:
+    python benchmarks/macro_benchmark.py [--runs N] [--drop-time SEC] [--calibration-time SEC]
+"""
+# Standard libraries
+import os
+import sys
+import time
+import argparse
+import statistics
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "boccia-gui"))
+
+from PyQt5.QtCore import QCoreApplication
+
+# Custom libraries
+from commands import Commands
+from serial_handler import SerialHandler
+from ramp_simulator import RampSimulator
+from macro_engine import MacroRunner
+
+MACRO = "Full"
+LAST_LINE = "Elevation calibration complete"
+TIMEOUT = 30.0  # [sec]
+
+
+def time_chained(serial_handler:SerialHandler):
+    """ Return the time the firmware takes to run the chained calibration [sec] """
+    done = threading.Event()
+    def listener(lines):
+        if LAST_LINE in lines:
+            done.set()
+
+    serial_handler.add_line_listener(listener)
+    try:
+        start_time = time.perf_counter()
+        serial_handler.send_command(Commands.CALIBRATION_COMMANDS[MACRO])
+        if not done.wait(TIMEOUT):
+            raise RuntimeError("The chained calibration did not finish")
+        return time.perf_counter() - start_time
+    finally:
+        serial_handler.remove_line_listener(listener)
+
+
+def time_macro(runner:MacroRunner):
+    """ Return the time the macro takes to run the calibration [sec] """
+    start_time = time.perf_counter()
+    runner.run(MACRO)
+    if not runner.wait(TIMEOUT):
+        raise RuntimeError("The macro did not finish")
+    elapsed = time.perf_counter() - start_time
+
+    if len(runner.step_times) != len(Commands.CALIBRATION_MACROS[MACRO]):
+        raise RuntimeError(f"The macro failed after {len(runner.step_times)} steps")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Number of calibrations of each kind")
+    parser.add_argument("--drop-time", type=float, default=0.2, help="Simulated drop time [sec]")
+    parser.add_argument("--calibration-time", type=float, default=0.1, help="Simulated time of each calibration [sec]")
+    args = parser.parse_args()
+
+    app = QCoreApplication(sys.argv)
+    simulator = RampSimulator(drop_time=args.drop_time, calibration_time=args.calibration_time, seed=1)
+    serial_handler = SerialHandler(simulator.start())
+    serial_handler.connect()
+    runner = MacroRunner(serial_handler)
+    try:
+        chained = [time_chained(serial_handler) for _ in range(args.runs)]
+        macro = [time_macro(runner) for _ in range(args.runs)]
+    finally:
+        serial_handler.disconnect()
+        simulator.stop()
+
+    commands = sum(step[0] == "send" for step in Commands.CALIBRATION_MACROS[MACRO])
+    print(f"\"{MACRO}\" calibration, {args.runs} runs, {commands} commands")
+    print(f"{'':<12}{'median [ms]':>12}{'min [ms]':>10}{'max [ms]':>10}")
+    for name, values in (("chained", chained), ("macro", macro)):
+        values = [1e3 * value for value in values]
+        print(f"{name:<12}{statistics.median(values):>12.1f}{min(values):>10.1f}{max(values):>10.1f}")
+    overhead = 1e3 * (statistics.median(macro) - statistics.median(chained)) / commands
+    print(f"\noverhead per command: {overhead:.2f} ms")
+
+if __name__ == '__main__':
+    main()
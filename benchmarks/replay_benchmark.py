@@ -0,0 +1,276 @@
+""" Session replay benchmark for the main device app.
+
+Replays a recorded match through `MainWindow` under Qt's offscreen platform, and checks that the
+commands written to the serial port (a `RampSimulator` pseudo-terminal) match the recording.
+
+The input events go through the same entry points as in a match:
+
+- key: `KeyPressHandler.toggle_key_pressed` (player 1 keys)
+- hold / release: `KeyPressHandler.hold_key_pressed` / `hold_key_released` (operator keys)
+- button: click on the user or operator button with the same text
+- device: `MainWindow.command_received_from_multiplayer_device`
+
+The replay runs on a virtual clock: the events happen at their recorded time divided by the speed
+(1x, 10x, ...) or back to back with "max", and the drop delay ends on the virtual clock after the
+15 s safety timeout, instead of a `QTimer` or the simulator reporting the drop complete (as in the
+recording). With "max", each event waits for the commands before it to be written, so the serial
+queue does not overflow and the throughput includes the writes.
+
+A timeline is either:
+
+- a JSON lines file, one event per line: {"time": [sec], "event": "key" | "hold" | "release" |
+  "button" | "device" | "sent", "command": ..., "player": ..., "text": ...}. The "sent" events are
+  the commands the recording sent to the ramp. See `benchmarks/fixtures/replay/match.jsonl`.
+- a session trace from `boccia-gui/session_trace.py` (`.trace`, requires NumPy), one of its sessions.
+
+Speed commands from the sliders are not replayed, so they are left out of the comparison.
+
+Usage:
+    python benchmarks/replay_benchmark.py [--timeline FILE] [--session N] [--speed {1,10,max} ...]
+"""
+# Standard libraries
+import os
+import sys
+import json
+import time
+import heapq
+import argparse
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "boccia-gui"))
+
+from PyQt5.QtWidgets import QApplication, QPushButton
+
+# Custom libraries
+from commands import Commands
+from main_window import MainWindow
+from ramp_simulator import RampSimulator
+import session_trace
+
+DEFAULT_TIMELINE = os.path.join(BENCHMARKS_DIR, "fixtures", "replay", "match.jsonl")
+TIMEOUT = 2.0   # [sec] Max time to wait for the last commands to reach the port
+
+# Commands sent by the keys, buttons and devices (i.e. the ones the replay can reproduce)
+CONTROL_COMMANDS = set(Commands.HOLD_COMMANDS.values()) | set(Commands.TOGGLE_COMMANDS.values()) \
+    | set(Commands.BUTTON_COMMANDS.values()) | set(Commands.OPERATOR_COMMANDS.values())
+
+# Timeline events of each session trace source
+TRACE_EVENTS = {
+    session_trace.KEY_RELEASE: "release",
+    session_trace.BUTTON: "button",
+    session_trace.DEVICE: "device",
+    session_trace.SENT: "sent",
+    }
+
+
+def load_timeline(path:str, session:int = 0):
+    """ Return the events of the timeline at `path`, sorted by time, with times relative to the first event """
+    if path.endswith(".trace"):
+        events = load_trace_timeline(path, session)
+    else:
+        with open(path, encoding="utf-8") as f:
+            events = [json.loads(line) for line in f if line.strip()]
+
+    events.sort(key=lambda event: event["time"])   # Stable, the events at the same time keep their order
+    start_time = events[0]["time"] if events else 0
+    for event in events:
+        event["time"] -= start_time
+    return events
+
+
+def load_trace_timeline(path:str, session:int):
+    """ Return the events of session number `session` of a session trace """
+    reader = session_trace.SessionTraceReader(path)
+    sessions = reader.sessions()
+    if not (0 <= session < len(sessions)):
+        raise ValueError(f"{path} has {len(sessions)} sessions, there is no session {session}")
+
+    first, last = sessions[session]["first"], sessions[session]["last"]
+    events = []
+    for record in reader.records[first:last + 1]:
+        source, player = int(record["source"]), int(record["player"])
+        text = reader.command_text(int(record["command"]))
+        if source == session_trace.KEY:
+            # Toggle keys belong to player 1, hold keys to the operator
+            event = {"event": "key", "command": text, "player": f"Player {player}"} if player else {"event": "hold", "command": text}
+        elif source == session_trace.BUTTON:
+            event = {"event": "button", "text": text}
+        elif source in TRACE_EVENTS:
+            event = {"event": TRACE_EVENTS[source], "command": text, "player": f"Player {player}"}
+        else:
+            continue
+        event["time"] = int(record["time"]) / 1e9
+        events.append(event)
+    return events
+
+
+class VirtualClock():
+    """ Clock of the replay, runs the callbacks scheduled on it when the replay reaches their time """
+
+    def __init__(self):
+        self.now = 0.0      # [sec] Virtual time
+        self._events = []   # Heap of (time, order, callback)
+        self._order = 0
+
+    def call_later(self, delay:float, callback):
+        """ Run `callback` `delay` seconds after the current virtual time """
+        self._order += 1
+        heapq.heappush(self._events, (self.now + delay, self._order, callback))
+
+    def next_time(self):
+        """ Return the time of the next callback, None if there is none """
+        return self._events[0][0] if self._events else None
+
+    def run_next(self):
+        """ Move the clock to the next callback and run it """
+        event_time, _, callback = heapq.heappop(self._events)
+        self.now = event_time
+        callback()
+
+
+class SessionReplay():
+    """ Replays a timeline through a `MainWindow` connected to the ramp simulator """
+
+    def __init__(self, app, timeline:list, speed:float = None):
+        """ `speed` is the replay speed (e.g. 10 for 10x), None to replay as fast as possible """
+        self.app = app
+        self.timeline = timeline
+        self.speed = speed
+        self.clock = VirtualClock()
+
+        self.simulator = RampSimulator(latency=0, jitter=0)
+        port_name = self.simulator.start()
+
+        self.window = MainWindow(include_multiplayer_controls=False)
+        self.window.commands.drop_delay_scheduler = lambda delay, callback: self.clock.call_later(delay / 1000, callback)
+        self.window.serial_handler.port = port_name
+        self.window.serial_handler.connect()
+
+        self.buttons = {button.text(): button for button in self.window.findChildren(QPushButton)}
+        self.lag = 0.0  # [sec] Max time the replay was behind the timeline (only with a speed)
+
+    def close(self):
+        self.window.close()
+        self.simulator.stop()
+
+    def run(self):
+        """ Replay the timeline, return the wall time it took [sec] """
+        start_time = time.perf_counter()
+        inputs = [event for event in self.timeline if event["event"] != "sent"]
+
+        for event in inputs:
+            # End the drop delays that are due before this event
+            while (self.clock.next_time() is not None) and (self.clock.next_time() <= event["time"]):
+                self._wait_for(self.clock.next_time(), start_time)
+                self.clock.run_next()
+                self.app.processEvents()
+
+            self._wait_for(event["time"], start_time)
+            self.clock.now = event["time"]
+            self.dispatch(event)
+            self.app.processEvents()
+
+        return time.perf_counter() - start_time
+
+    def dispatch(self, event:dict):
+        """ Send `event` to the entry point of the app that handles it """
+        handler = self.window.key_press_handler
+        kind = event["event"]
+        if kind == "key":
+            handler.toggle_key_pressed(event.get("player", "Player 1"), event["command"])
+        elif kind == "hold":
+            handler.hold_key_pressed(event["command"])
+        elif kind == "release":
+            handler.hold_key_released(event["command"])
+        elif kind == "button":
+            self.buttons[event["text"]].click()
+        elif kind == "device":
+            self.window.command_received_from_multiplayer_device(event["player"], event["command"])
+        else:
+            raise ValueError(f"Unknown event: {event}")
+
+    def sent_commands(self, count:int):
+        """ Process events until the port has received `count` commands (or the timeout), return the commands """
+        deadline = time.monotonic() + TIMEOUT
+        while (len(self.simulator.received_commands) < count) and (time.monotonic() < deadline):
+            self.app.processEvents()
+            time.sleep(0.001)
+        return [command for _, command in self.simulator.received_commands]
+
+    def _wait_for(self, event_time:float, start_time:float):
+        """ Wait until the wall time of `event_time` at the replay speed, keeping the GUI responsive """
+        if self.speed is None:
+            # As fast as possible, but not faster than the commands are written
+            # (short sleeps, the writer thread needs the GIL and the GUI thread has nothing else to do)
+            while self.window.serial_handler.get_pending_commands():
+                time.sleep(0.0005)
+            return
+
+        target_time = start_time + event_time / self.speed
+        while time.perf_counter() < target_time:
+            self.app.processEvents()
+            time.sleep(min(0.001, max(0, target_time - time.perf_counter())))
+        self.lag = max(self.lag, time.perf_counter() - target_time)
+
+
+def compare(expected:list, sent:list):
+    """ Return a description of the first difference between the command streams, None if they match """
+    for index, (expected_command, sent_command) in enumerate(zip(expected, sent)):
+        if expected_command != sent_command:
+            return f"command {index}: expected {expected_command!r}, sent {sent_command!r}"
+    if len(expected) != len(sent):
+        return f"expected {len(expected)} commands, sent {len(sent)}"
+    return None
+
+
+def parse_speed(value:str):
+    return None if value == "max" else float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--timeline", default=DEFAULT_TIMELINE, help="JSON lines timeline or session trace to replay")
+    parser.add_argument("--session", type=int, default=0, help="Session of the trace to replay")
+    parser.add_argument("--speed", nargs="+", default=["max"], help="Replay speeds, e.g. 1 10 max")
+    args = parser.parse_args()
+
+    # The replays are not recorded in today's session trace
+    Commands.TRACE_VARIABLES["enabled"] = False
+    # The drop delay ends on the virtual clock, not when the simulator (in real time) reports the drop complete
+    Commands.DROP_VARIABLES["wait_for_ramp"] = False
+
+    try:
+        timeline = load_timeline(args.timeline, args.session)
+    except (ImportError, ValueError) as e:
+        parser.error(str(e))
+    expected = [event["command"] for event in timeline if (event["event"] == "sent") and (event["command"] in CONTROL_COMMANDS)]
+    inputs = len(timeline) - sum(event["event"] == "sent" for event in timeline)
+    duration = timeline[-1]["time"] if timeline else 0
+
+    app = QApplication(sys.argv)
+    print(f"Timeline: {args.timeline} ({inputs} input events, {len(expected)} commands, {duration:.1f} s)")
+    print(f"{'speed':<8}{'wall [s]':>10}{'speedup':>10}{'events/s':>12}{'max lag [ms]':>14}{'dropped':>9}  result")
+
+    failed = 0
+    for speed_text in args.speed:
+        speed = parse_speed(speed_text)
+        replay = SessionReplay(app, timeline, speed)
+        try:
+            wall_time = replay.run()
+            sent = [command for command in replay.sent_commands(len(expected)) if command in CONTROL_COMMANDS]
+            difference = compare(expected, sent) if expected else None
+            dropped = replay.window.serial_handler.dropped_commands
+        finally:
+            replay.close()
+
+        failed += difference is not None
+        speed_name = "max" if speed is None else f"{speed:g}x"
+        result = "no reference" if not expected else (difference if difference else "match")
+        lag = f"{1e3 * replay.lag:.2f}" if speed else "-"
+        print(f"{speed_name:<8}{wall_time:>10.3f}{duration / wall_time:>10.0f}{inputs / wall_time:>12.0f}{lag:>14}{dropped:>9}  {result}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+""" Startup time benchmark for the main device app.
+
+Starts the app in a new Python process for each run (cold start, as on the tablets), under Qt's
+offscreen platform, and measures:
+
+- imports: time to import `MainWindow` and everything it imports
+- window: time to create `MainWindow(include_multiplayer_controls=True)`
+- first paint: time to show the window and process the first events
+- total: wall time from starting the process to the first paint
+- ready: wall time from starting the process to the end of the startup preflight (serial ports
+  found, see `boccia-gui/preflight.py`), with the time of each probe
+- multiplayer on: time to turn on multiplayer mode the first time (loads and creates the Bluetooth
+  server, which is deferred until then, and starts looking for the Bluetooth adapter in the background)
+
+Then prints the import time of each module of the app (`python -X importtime`), and of the other
+modules that take the longest to import, as the median of all the runs. The modules loaded when multiplayer
+mode is turned on (e.g. `bluetooth_server`) are listed too.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--runs N] [--top N]
+"""
+# Standard libraries
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "boccia-gui")
+
+# Runs in each new process, prints the timings as JSON on the last line of stdout
+STARTUP_SCRIPT = """
+import sys, time, json
+start_time = time.perf_counter()
+sys.path.insert(0, {app_dir!r})
+
+from commands import Commands
+Commands.TRACE_VARIABLES["enabled"] = False     # Do not record the runs in today's session trace
+from PyQt5.QtWidgets import QApplication
+from main_window import MainWindow
+imports_time = time.perf_counter()
+
+app = QApplication(sys.argv)
+window = MainWindow(include_multiplayer_controls=True)
+window_time = time.perf_counter()
+
+window.show()
+app.processEvents()
+paint_time = time.perf_counter()
+paint_wall_time = time.time()
+
+while not window.preflight.is_finished():
+    app.processEvents()
+    time.sleep(0.001)
+app.processEvents()     # Results of the last probe
+ready_time = time.perf_counter()
+ready_wall_time = time.time()
+
+window.multiplayer_controls_widget.multiplayer_mode_button.click()
+app.processEvents()
+multiplayer_time = time.perf_counter()
+
+print(json.dumps({{
+    "imports": imports_time - start_time,
+    "window": window_time - imports_time,
+    "first paint": paint_time - window_time,
+    "multiplayer on": multiplayer_time - ready_time,
+    "paint wall time": paint_wall_time,
+    "ready wall time": ready_wall_time,
+    "probes": window.preflight.durations,
+    }}))
+window.close()
+"""
+
+
+def run_startup():
+    """ Start the app in a new process, return (timings [sec], import times {module: (self, cumulative) [sec]}) """
+    environment = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    script = STARTUP_SCRIPT.format(app_dir=os.path.abspath(APP_DIR))
+
+    start_wall_time = time.time()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", script],
+                            capture_output=True, text=True, env=environment, check=True)
+
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    # From the start of the process, including the interpreter start
+    timings["total"] = timings.pop("paint wall time") - start_wall_time
+    timings["ready"] = timings.pop("ready wall time") - start_wall_time
+    return timings, parse_import_times(result.stderr)
+
+
+def parse_import_times(output:str):
+    """ Return {module: (self, cumulative) [sec]} from the output of `python -X importtime` """
+    import_times = {}
+    for line in output.splitlines():
+        # e.g. "import time:       515 |       2715 |     queue"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, cumulative_time, module = line[len("import time:"):].split("|")
+        import_times[module.strip()] = (int(self_time) / 1e6, int(cumulative_time) / 1e6)
+    return import_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Number of cold starts")
+    parser.add_argument("--top", type=int, default=10, help="Number of other modules shown in the import breakdown")
+    args = parser.parse_args()
+
+    runs = [run_startup() for _ in range(args.runs)]
+
+    print(f"{'stage':<18}{'median [ms]':>12}{'min [ms]':>10}{'max [ms]':>10}")
+    for stage in ("imports", "window", "first paint", "total", "ready", "multiplayer on"):
+        values = [1e3 * timings[stage] for timings, _ in runs]
+        print(f"{stage:<18}{statistics.median(values):>12.1f}{min(values):>10.1f}{max(values):>10.1f}")
+    for probe in runs[0][0]["probes"]:
+        values = [1e3 * timings["probes"][probe] for timings, _ in runs]
+        name = f"  {probe}"
+        print(f"{name:<18}{statistics.median(values):>12.1f}{min(values):>10.1f}{max(values):>10.1f}")
+
+    # Median import time of each module, over the runs that imported it
+    modules = {}
+    for _, import_times in runs:
+        for module, times in import_times.items():
+            modules.setdefault(module, []).append(times)
+    medians = {module: tuple(statistics.median(values) for values in zip(*times)) for module, times in modules.items()}
+
+    app_modules = {os.path.splitext(name)[0] for name in os.listdir(APP_DIR) if name.endswith(".py")}
+    other_modules = sorted((module for module in medians if module not in app_modules), key=lambda module: -medians[module][0])
+
+    print(f"\n{'module':<44}{'self [ms]':>10}{'cumulative [ms]':>17}")
+    for module in sorted(app_modules & set(medians), key=lambda module: -medians[module][1]):
+        print(f"{module:<44}{1e3 * medians[module][0]:>10.2f}{1e3 * medians[module][1]:>17.2f}")
+    print(f"{'(other modules, slowest first)':<44}")
+    for module in other_modules[:args.top]:
+        print(f"{module:<44}{1e3 * medians[module][0]:>10.2f}{1e3 * medians[module][1]:>17.2f}")
+
+if __name__ == '__main__':
+    main()
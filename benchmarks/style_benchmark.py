@@ -0,0 +1,123 @@
+""" Style transition benchmark for the main device app.
+
+Measures the cost of the GUI state changes that happen on every command, with `MainWindow`
+shown under Qt's offscreen platform:
+
+- user / operator controls: `_handle_control_state_change` of the user and operator controls, with a
+  `ControlState` running a toggle command started by a key (all buttons disabled), then idle (all enabled)
+- control state toggle: `ControlState.start_toggle`, then `stop_toggle` on the window's control state,
+  which notifies all its subscribers (the ramp is not connected, so no command is sent)
+- connect button: `_handle_connection_change` of the serial controls ("Connected", then "Disconnected")
+- per-button stylesheets: the same change on the user controls, done the way it was before
+  `Styles.APP_STYLESHEET`, with a new stylesheet for each button (for comparison)
+
+Each transition is timed twice: the call itself, and the call plus the event processing it causes
+(polish, layout and repaint).
+
+Usage:
+    python benchmarks/style_benchmark.py [--iterations N]
+"""
+# Standard libraries
+import os
+import sys
+import time
+import argparse
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "boccia-gui"))
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QApplication
+
+# Custom libraries
+from commands import Commands
+from styles import Styles
+from main_window import MainWindow
+from control_state import ControlState
+
+# Stylesheet of a disabled button before Styles.APP_STYLESHEET
+DISABLED_BUTTON = f"""
+    QPushButton {{
+        font-size: {16 * Styles.SCALE_FACTOR}px;
+        color: #a9a9a9;
+        padding: {5 * Styles.SCALE_FACTOR}px;
+        border-radius: {5 * Styles.SCALE_FACTOR}px;
+        border: {1 * Styles.SCALE_FACTOR}px solid #a9a9a9;
+        background-color: #3c3c3c;
+    }}
+"""
+
+
+def toggle_with_stylesheets(buttons:list, value:bool):
+    """ Enable or disable `buttons`, setting a new stylesheet on each of them """
+    for button in buttons:
+        button.setEnabled(value)
+        button.setStyleSheet(f"{Styles.HOVER_BUTTON}" if value else f"{DISABLED_BUTTON}")
+
+
+def time_transitions(app, transitions:list, iterations:int):
+    """ Run each of `transitions` `iterations` times, return the mean time of the calls only,
+    and of the calls plus the events they caused, per transition """
+    call_time = 0
+    total_time = 0
+    for _ in range(iterations):
+        for transition in transitions:
+            start_time = time.perf_counter()
+            transition()
+            call_end = time.perf_counter()
+            app.processEvents()
+            end_time = time.perf_counter()
+            call_time += call_end - start_time
+            total_time += end_time - start_time
+
+    count = iterations * len(transitions)
+    return call_time / count, total_time / count
+
+
+def main():
+    # The benchmarks are not recorded in today's session trace
+    Commands.TRACE_VARIABLES["enabled"] = False
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=500, help="Number of repetitions of each transition")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    window = MainWindow(include_multiplayer_controls=False)
+    window.show()
+    app.processEvents()
+
+    user = window.user_controls_widget
+    operator = window.operator_controls_widget
+    serial = window.serial_controls_widget
+    control_state = window.control_state
+
+    # States the controls are updated to: a toggle command started by a key, and no command running
+    busy = ControlState()
+    busy.start_toggle(Commands.TOGGLE_COMMANDS[Qt.Key_1], "Player 1", key=Qt.Key_1)
+    idle = ControlState()
+
+    scenarios = {
+        "user controls": [lambda: user._handle_control_state_change(busy), lambda: user._handle_control_state_change(idle)],
+        "operator controls": [lambda: operator._handle_control_state_change(busy), lambda: operator._handle_control_state_change(idle)],
+        "control state toggle": [
+            lambda: control_state.start_toggle(Commands.TOGGLE_COMMANDS[Qt.Key_1], "Player 1", key=Qt.Key_1),
+            lambda: control_state.stop_toggle("Player 1", key=Qt.Key_1),
+            ],
+        "connect button": [lambda: serial._handle_connection_change("Connected"), lambda: serial._handle_connection_change("Disconnected")],
+        "per-button stylesheets": [
+            lambda: toggle_with_stylesheets(user.command_buttons, False),
+            lambda: toggle_with_stylesheets(user.command_buttons, True),
+            ],
+        }
+
+    try:
+        print(f"{'transition':<24}{'call [us]':>12}{'with events [us]':>18}")
+        for name, transitions in scenarios.items():
+            call_time, total_time = time_transitions(app, transitions, args.iterations)
+            print(f"{name:<24}{1e6 * call_time:>12.1f}{1e6 * total_time:>18.1f}")
+    finally:
+        window.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+""" Session trace benchmark.
+
+Measures what `SessionTraceRecorder` adds to the send path, and how long the
+`SessionTraceReader` takes to open a full day of records and compute the player stats:
+
+- record: mean time of `SessionTraceRecorder.record()`
+- send_command: mean time of `SerialHandler.send_command()` without and with a trace, connected to
+  a `RampSimulator` pseudo-terminal
+- reader: time to open a synthetic day of records (memory map), and to compute the throws per hour
+  and reaction times of the players (requires NumPy)
+
+The traces are written to a temporary directory.
+
+Usage:
+    python benchmarks/trace_benchmark.py [--iterations N] [--records N]
+"""
+# Standard libraries
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "boccia-gui"))
+
+# Custom libraries
+import session_trace
+from session_trace import SessionTraceRecorder, SessionTraceReader, RECEIVED, DEVICE, SENT
+from serial_handler import SerialHandler
+from ramp_simulator import RampSimulator
+
+
+def time_function(function, iterations:int):
+    """ Return the mean time to run `function`, in seconds """
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start_time) / iterations
+
+
+def time_send_command(trace, iterations:int):
+    """ Return the mean time of `SerialHandler.send_command`, connected to the ramp simulator """
+    simulator = RampSimulator(latency=0, jitter=0)
+    serial_handler = SerialHandler(simulator.start(), command_queue_size=iterations + 1, trace=trace)
+    serial_handler.connect()
+    try:
+        # Speed commands, the simulator answers without moving the ramp
+        return time_function(lambda: serial_handler.send_command("rx20"), iterations)
+    finally:
+        serial_handler.disconnect()
+        simulator.stop()
+
+
+def write_day(path:str, records:int, players:int = 4):
+    """ Write a trace with `records` records of players dropping balls after the ramp is ready """
+    trace = SessionTraceRecorder(path)
+    for i in range(records // 4):
+        trace.record(RECEIVED, "Ready")
+        trace.record(DEVICE, "dd-70", f"Player {i % players + 1}")
+        trace.record(SENT, "dd-70")
+        trace.record(RECEIVED, "Drop complete")
+    trace.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000, help="Number of records and commands timed")
+    parser.add_argument("--records", type=int, default=1000000, help="Number of records of the synthetic day")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        trace = SessionTraceRecorder(os.path.join(directory, "send.trace"))
+        record_time = time_function(lambda: trace.record(SENT, "rx20"), args.iterations)
+        send_time = time_send_command(None, args.iterations)
+        traced_send_time = time_send_command(trace, args.iterations)
+        trace.close()
+
+        print(f"{'operation':<34}{'mean [us]':>12}")
+        print(f"{'record':<34}{1e6 * record_time:>12.2f}")
+        print(f"{'send_command (no trace)':<34}{1e6 * send_time:>12.2f}")
+        print(f"{'send_command (trace)':<34}{1e6 * traced_send_time:>12.2f}")
+
+        if session_trace.np is None:
+            print("\nNumPy is not installed, the reader is not timed")
+            return
+
+        path = os.path.join(directory, "day.trace")
+        write_day(path, args.records)
+
+        start_time = time.perf_counter()
+        reader = SessionTraceReader(path)
+        open_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        reader.throws_per_hour()
+        reader.reaction_times()
+        stats_time = time.perf_counter() - start_time
+
+        print(f"\n{'reader':<34}{'time [ms]':>12}")
+        print(f"{f'open ({len(reader)} records)':<34}{1e3 * open_time:>12.2f}")
+        print(f"{'throws per hour + reaction times':<34}{1e3 * stats_time:>12.2f}")
+
+if __name__ == '__main__':
+    main()
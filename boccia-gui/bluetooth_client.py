@@ -1,8 +1,13 @@
 # Import libraries
 from PyQt5.QtCore import QThread, pyqtSignal
+import time
+import random
 import socket
+import threading
+from collections import deque
 
-from bt_devices import BluetoothDevices
+from transports import get_transport
+from bluetooth_protocol import BluetoothProtocol, MessageParser, LinkMonitor
 from commands import Commands
 
 class BluetoothClient(QThread):
@@ -15,12 +20,17 @@ class BluetoothClient(QThread):
     # This signal is emitted when the client status changes (e.g. connected, disconnected, error)
     client_status_changed = pyqtSignal(str)
 
-    def __init__(self):
+    # Signal with the latency statistics of the link with the server (from LinkMonitor.get_stats())
+    link_stats_changed = pyqtSignal(dict)
+
+    def __init__(self, transport = None):
         """ Initializes BluetoothClient class.
         
         Parameters
         ----------
-        None
+        transport : Transport
+            Socket type used to connect to the server.
+            Defaults to the transport set in Commands.TRANSPORT_VARIABLES.
 
         Returns
         -------
@@ -28,8 +38,8 @@ class BluetoothClient(QThread):
 
         Attributes
         ----------
-        bluetooth_devices : BluetoothDevices
-            Instance of the BluetoothDevices class.
+        transport : Transport
+            Instance of the Transport class used to find and connect to the server.
         _running : bool
             Indicates whether the client is running.
         _paired_devices : list
@@ -38,18 +48,33 @@ class BluetoothClient(QThread):
             List of the names of paired Bluetooth devices.
             Used to populate the device selection dropdown in the GUI.
         server_address : str
-            The MAC address of the server device to connect to.
+            The address of the server device to connect to (e.g. its Bluetooth MAC address).
+        link_monitor : LinkMonitor
+            Round-trip time of the link with the server.
+        _send_lock : threading.Lock
+            Lock so commands from the GUI and pings from the client thread are not interleaved.
+        _connected : bool
+            Indicates whether the link with the server is up (i.e. commands can be sent).
+        _command_buffer : deque
+            Toggle commands (time, command) sent while the link was down, waiting for the client to reconnect.
+        _stop_event : threading.Event
+            Set by stop() to interrupt the wait between reconnection attempts.
         """
         super().__init__()
 
-        # Initialize BluetoothDevices instance
-        self.bluetooth_devices = BluetoothDevices()
+        # Initialize the transport (e.g. Bluetooth RFCOMM)
+        self.transport = transport if transport else get_transport()
 
         # Initialize attributes
         self._running = False
         self._paired_devices = None
         self.paired_device_names = []
         self.server_address = None
+        self.link_monitor = LinkMonitor()
+        self._send_lock = threading.Lock()
+        self._connected = False
+        self._command_buffer = deque(maxlen=Commands.BLUETOOTH_VARIABLES["reconnect_buffer_size"])
+        self._stop_event = threading.Event()
 
     def run(self):
         """ This method is called when a client thread is started.
@@ -71,6 +96,7 @@ class BluetoothClient(QThread):
         """
         # Set the _running flag to True
         self._running = True
+        self._stop_event.clear()
         # Call the method that runs the Bluetooth client
         self._run_bluetooth_client()
 
@@ -81,6 +107,9 @@ class BluetoothClient(QThread):
         Calls the method to connect to a server device.
         Calls the method to read information from the server.
 
+        If the link drops, reconnects to the same server address with exponential backoff,
+        until the connection is restored or the client is stopped.
+
         Initializes the Bluetooth client socket.
 
         Parameters
@@ -91,23 +120,54 @@ class BluetoothClient(QThread):
         -------
         None
         """
-        # Initialize the Bluetooth client
-        self.client = self._initialize_client()
-
-        # Emit signal and exit if client was not initialized
-        if not self.client:
-            self.client_status_changed.emit("Error") # Emit signal to indicate an error
-            # print("Failed to initialize Bluetooth client") # For debugging purposes
-            return
-        
-        # Connect and check if the connection was successful
-        connection = self._start_connection()
-        if not connection:
-            return
-
-        # Start reading data from the server
+        reconnect_attempt = 0 # 0 for the first connection
         try:
-            self._read_from_server()
+            while self._running:
+                # Wait before trying to reconnect, exit if the client is stopped meanwhile
+                if reconnect_attempt > 0:
+                    if self._stop_event.wait(self._get_reconnect_delay(reconnect_attempt)):
+                        break
+
+                # Initialize the Bluetooth client
+                self.client = self._initialize_client()
+
+                # Emit signal and exit if client was not initialized
+                if not self.client:
+                    self.client_status_changed.emit("Error") # Emit signal to indicate an error
+                    # print("Failed to initialize Bluetooth client") # For debugging purposes
+                    return
+                
+                # Connect and check if the connection was successful
+                # Only a failed first connection is reported as an error, reconnections keep trying
+                connection = self._start_connection(emit_error=(reconnect_attempt == 0))
+                if not connection:
+                    if reconnect_attempt == 0:
+                        return
+                    self._close_socket()
+
+                    # Give up if the max number of attempts is reached (0 means no limit)
+                    max_attempts = Commands.BLUETOOTH_VARIABLES["reconnect_max_attempts"]
+                    if max_attempts and (reconnect_attempt >= max_attempts):
+                        self.client_status_changed.emit("Error")
+                        break
+                    reconnect_attempt += 1
+                    continue
+
+                # Start reading data from the server
+                link_lost = self._read_from_server()
+
+                # Exit unless the link dropped while the client was running
+                if not (link_lost and self._running):
+                    break
+
+                # Otherwise try to reconnect
+                with self._send_lock:
+                    self._connected = False
+                self._close_socket()
+                self.client_status_changed.emit("Reconnecting")
+                # print("Link lost, reconnecting") # For debugging purposes
+                reconnect_attempt = 1
+
         except Exception as e:
             if self._running:
                 self.client_status_changed.emit("Error") # Emit signal to indicate an error
@@ -116,6 +176,40 @@ class BluetoothClient(QThread):
             # Call the stop method
             if self._running:
                 self.stop()
+            # Close the socket in case stop() was called while reconnecting
+            self._close_socket()
+
+    def _get_reconnect_delay(self, reconnect_attempt: int):
+        """ Returns the time to wait before a reconnection attempt.
+        The delay doubles with each attempt, up to a maximum, with random jitter
+        so several devices do not retry at the same time.
+
+        Parameters
+        ----------
+        reconnect_attempt : int
+            Number of the reconnection attempt (starting at 1).
+
+        Returns
+        -------
+        float
+            The delay [sec].
+        """
+        delay = min(
+            Commands.BLUETOOTH_VARIABLES["reconnect_initial_delay"] * 2 ** (reconnect_attempt - 1),
+            Commands.BLUETOOTH_VARIABLES["reconnect_max_delay"]
+            )
+        jitter = Commands.BLUETOOTH_VARIABLES["reconnect_jitter"]
+        return delay * random.uniform(1 - jitter, 1 + jitter)
+
+    def _close_socket(self):
+        """ Closes the client socket, ignoring errors. """
+        client = self.client
+        self.client = None
+        if client:
+            try:
+                client.close()
+            except Exception:
+                pass
 
     def get_paired_devices(self):
         """ Retrieves the list of paired Bluetooth devices from the BluetoothDevices class.
@@ -134,7 +228,8 @@ class BluetoothClient(QThread):
         self.paired_device_names = []
 
         # Retrieve the list of paired Bluetooth devices
-        self._paired_devices = self.bluetooth_devices.get_paired_bluetooth_devices()
+        # (With Bluetooth these are the paired devices, other transports return the configured server)
+        self._paired_devices = self.transport.get_server_devices()
 
         # Exit if no paired devices are found
         if not self._paired_devices:
@@ -165,8 +260,8 @@ class BluetoothClient(QThread):
         self.server_address = self._paired_devices[self.paired_device_names.index(device_name)][1]
     
     def _initialize_client(self):
-        """ Initializes the Bluetooth client socket.
-        Creates a Bluetooth client socket using the RFCOMM protocol.
+        """ Initializes the client socket.
+        Uses the transport to create the socket (e.g. a Bluetooth socket using the RFCOMM protocol).
 
         Parameters
         ----------
@@ -175,19 +270,20 @@ class BluetoothClient(QThread):
         Returns
         -------
         client : socket.socket
-            The Bluetooth client socket.
+            The client socket.
         """
-        client = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+        client = self.transport.create_client_socket()
         return client
 
-    def _start_connection(self):
-        """ Tries to connect the client to the Bluetooth server device.
+    def _start_connection(self, emit_error: bool = True):
+        """ Tries to connect the client to the server device.
         Uses the server_address attribute.
-        Uses the RFCOMM channel defined in the Commands class.
+        Uses the transport to get the socket address (e.g. the RFCOMM channel defined in the Commands class).
 
         Parameters
         ----------
-        None
+        emit_error : bool
+            Whether to emit an error signal if the connection fails.
 
         Returns
         -------
@@ -195,10 +291,13 @@ class BluetoothClient(QThread):
             True if the connection was successful, False otherwise.
         """
         try:
-            self.client.connect((self.server_address, Commands.BLUETOOTH_VARIABLES["RFCOMM_channel"]))
+            self.client.connect(self.transport.get_connect_address(self.server_address))
             return True
         except Exception as e:
-            self.client_status_changed.emit("Error") # Emit signal to indicate an error
+            if emit_error:
+                # The paired devices may have changed, look for them again when the dropdown is refreshed
+                self.transport.invalidate_devices()
+                self.client_status_changed.emit("Error") # Emit signal to indicate an error
             # print(f"Error connecting to main device: {e}") # For debugging purposes
             return False
         
@@ -207,6 +306,7 @@ class BluetoothClient(QThread):
 
         Reads the initial message from the server to verify connection.
         Continues to listen for commands until disconnected or an error occurs.
+        The link is considered lost if nothing is received from the server within the link timeout.
 
         Parameters
         ----------
@@ -214,50 +314,113 @@ class BluetoothClient(QThread):
 
         Returns
         -------
-        None
+        bool
+            True if the link was lost (i.e. the client should reconnect), False otherwise.
         """
+        # Parser for the messages from the server, a message can be split across packets
+        parser = MessageParser()
         try:
             # Check the initial message from the server to verify connection was successful
-            data = self.client.recv(Commands.BLUETOOTH_VARIABLES["bytes"])
-            if data:
-                # Decode the received data
-                message = data.decode(Commands.BLUETOOTH_VARIABLES["data_format"])
-
-                # Check if the message indicates max clients are connected
-                # (which means enough devices are connected to correspond to the selected number of players)
-                # If so, close the client
-                if message == Commands.BLUETOOTH_VARIABLES["max_clients_message"]:
+            # Do not wait forever if the server accepted the connection but does not answer
+            self.client.settimeout(Commands.BLUETOOTH_VARIABLES["link_timeout"])
+            messages = []
+            while not messages:
+                data = self.client.recv(Commands.BLUETOOTH_VARIABLES["bytes"])
+
+                # If no data is received, emit an error signal and close the client
+                if not data:
+                    self.client_status_changed.emit("Error")
+                    # print("Could not connect to server") # For debugging purposes
                     self.client.close() # Close the client socket
-                    return
-                # Or, check if connection was successful and emit signal
-                elif message == "Connected":
-                    self.client_status_changed.emit("Connected")
-            
-            # If no data is received, emit an error signal and close the client
-            elif not data:
-                self.client_status_changed.emit("Error")
-                # print("Could not connect to server") # For debugging purposes
+                    return False
+                messages = parser.feed(data)
+
+            # Check if the message indicates max clients are connected
+            # (which means enough devices are connected to correspond to the selected number of players)
+            # If so, close the client
+            message = messages.pop(0)
+            if message == Commands.BLUETOOTH_VARIABLES["max_clients_message"]:
                 self.client.close() # Close the client socket
-                return
+                return False
+            # Or, check if connection was successful and emit signal
+            elif message == "Connected":
+                self.client_status_changed.emit("Connected")
+                # Send the commands buffered while the link was down
+                self._set_connected()
             
+            # Start measuring the latency of the link
+            # The timeout wakes up the client thread to send pings when nothing is received
+            self.link_monitor = LinkMonitor()
+            self.client.settimeout(Commands.BLUETOOTH_VARIABLES["heartbeat_interval"])
+            next_heartbeat = time.monotonic()
+            last_receive_time = time.monotonic()
+
             # Start continously listening for commands
             while self._running:
-                # Receive data from server
-                    data = self.client.recv(Commands.BLUETOOTH_VARIABLES["bytes"])
-                    if not data:
-                        break # Stop if no data is received
-                    # Decode the received data
-                    command = data.decode(Commands.BLUETOOTH_VARIABLES["data_format"])
-
+                # Handle the messages received in the same packet as the previous ones
+                for command in messages:
                     # Stop if disconnect command is received from the server
                     if command == Commands.BLUETOOTH_VARIABLES["disconnect_command"]:
                         self.stop()
-                        return
+                        return False
+                    
+                    # Answer pings and record the pongs from the server
+                    kind, sequence = LinkMonitor.parse(command)
+                    if kind == Commands.BLUETOOTH_VARIABLES["ping_message"]:
+                        self.send_command(LinkMonitor.pong(sequence))
+                    elif kind == Commands.BLUETOOTH_VARIABLES["pong_message"]:
+                        if self.link_monitor.handle_pong(sequence) is not None:
+                            self.link_stats_changed.emit(self.link_monitor.get_stats())
+
+                # Ping the server periodically
+                if time.monotonic() >= next_heartbeat:
+                    self._send_heartbeat()
+                    next_heartbeat = time.monotonic() + Commands.BLUETOOTH_VARIABLES["heartbeat_interval"]
+
+                # Receive data from server
+                try:
+                    data = self.client.recv(Commands.BLUETOOTH_VARIABLES["bytes"])
+                except socket.timeout:
+                    messages = []
+                    # The server pings every heartbeat, so silence means the link is gone
+                    if time.monotonic() - last_receive_time > Commands.BLUETOOTH_VARIABLES["link_timeout"]:
+                        return True
+                    continue # Nothing received, check if it is time for the next ping
+                if not data:
+                    return True # The connection was closed without the disconnect command
+                last_receive_time = time.monotonic()
+                messages = parser.feed(data)
                     
         except Exception as e:
-            if self._running:
-                self.client_status_changed.emit("Error") # Emit signal to indicate an error
-                # print(f"Error receiving command: {e}") # For debugging purposes
+            # print(f"Error receiving command: {e}") # For debugging purposes
+            return True
+
+        return False
+
+    def _set_connected(self):
+        """ Marks the link as up and handles the commands buffered while it was down,
+        according to the policy defined in the Commands class:
+            - "replay": Sends the commands that are not older than the buffer TTL, in order.
+            - "discard": Drops all the buffered commands.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        with self._send_lock:
+            self._connected = True
+
+            # Drop the commands that are too old to be meaningful
+            oldest_time = time.monotonic() - Commands.BLUETOOTH_VARIABLES["reconnect_buffer_ttl"]
+            commands = [command for command_time, command in self._command_buffer if command_time >= oldest_time]
+            self._command_buffer.clear()
+
+            if commands and (Commands.BLUETOOTH_VARIABLES["reconnect_buffer_policy"] == "replay"):
+                self.client.sendall(BluetoothProtocol.encode_many(commands))
 
     def send_command(self, command_text: str):
         """ Sends commands to the Bluetooth server.
@@ -273,15 +436,75 @@ class BluetoothClient(QThread):
         -------
         None
         """
-        try:
-            # Encode the command text and send it to the server
-            self.client.send(command_text.encode(Commands.BLUETOOTH_VARIABLES["data_format"]))
+        self.send_commands([command_text])
+
+    def send_commands(self, commands: list):
+        """ Sends several commands to the Bluetooth server in a single packet.
+        The server handles all of them in the same order, in a single read.
+
+        Parameters
+        ----------
+        commands : list
+            List of the commands to send to the server.
         
-        # Catch any errors
-        except Exception as e:
-            if self._running:
-                self.client_status_changed.emit("Error") # Emit signal to indicate an error
-                # print(f"Error sending command: {e}") # For debugging purposes
+        Returns
+        -------
+        None
+        """
+        with self._send_lock:
+            # Buffer the toggle commands while the link is down, they are handled when the client reconnects
+            if not self._connected:
+                self._buffer_commands(commands)
+                return
+
+            try:
+                # Encode the commands and send them to the server
+                self.client.sendall(BluetoothProtocol.encode_many(commands))
+            
+            # Catch any errors
+            except Exception as e:
+                # The client thread detects the lost link and reconnects
+                if self._running:
+                    self._buffer_commands(commands)
+                    # print(f"Error sending command: {e}") # For debugging purposes
+
+    def _buffer_commands(self, commands: list):
+        """ Adds the toggle commands to the buffer used while the link is down.
+        Other messages (e.g. pings) are not buffered. The oldest commands are dropped when the buffer is full.
+
+        Parameters
+        ----------
+        commands : list
+            List of the commands that could not be sent.
+
+        Returns
+        -------
+        None
+        """
+        if not self._running:
+            return
+        
+        for command in commands:
+            if command in Commands.TOGGLE_COMMANDS.values():
+                self._command_buffer.append((time.monotonic(), command))
+
+    def _send_heartbeat(self):
+        """ Sends a ping to the server.
+        Emits the link statistics first if the previous pings were not answered yet,
+        so a link that stopped responding is shown as degraded.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        stats = self.link_monitor.get_stats()
+        if stats["oldest_pending"] > 0:
+            self.link_stats_changed.emit(stats)
+        self.send_command(self.link_monitor.ping())
 
     def stop(self):
         """ Stops the Bluetooth client thread.
@@ -289,6 +512,7 @@ class BluetoothClient(QThread):
         Emits a signal to indicate the client has disconnected.
         Sends the disconnect command to the server.
         Makes sure the client socket is closed.
+        Discards the commands buffered while reconnecting.
 
         Parameters
         ----------
@@ -303,6 +527,7 @@ class BluetoothClient(QThread):
             return
         
         self._running = False # Reset the _running flag to False
+        self._stop_event.set() # Interrupt the wait between reconnection attempts
 
         # Emit Disconnected signal
         self.client_status_changed.emit("Disconnected")
@@ -320,4 +545,6 @@ class BluetoothClient(QThread):
                 # print(f"Error closing client: {e}") # For debugging purposes
             self.client = None
 
-
+        with self._send_lock:
+            self._connected = False
+            self._command_buffer.clear()
@@ -0,0 +1,239 @@
+# Import libraries
+import time
+from collections import deque
+
+# Custom libraries
+from commands import Commands
+
+class BluetoothProtocol():
+    """ Message framing shared by the BluetoothClient and BluetoothServer classes.
+
+    Every message is encoded and terminated with the message delimiter defined in the Commands class,
+    so several messages can be sent in one packet and a message can be split across packets.
+    """
+
+    @staticmethod
+    def encode(message: str):
+        """ Encodes a single message, including its delimiter.
+
+        Parameters
+        ----------
+        message : str
+            The message to encode.
+
+        Returns
+        -------
+        bytes
+            The framed message.
+        """
+        return BluetoothProtocol.encode_many([message])
+
+    @staticmethod
+    def encode_many(messages: list):
+        """ Encodes several messages into a single packet.
+
+        Parameters
+        ----------
+        messages : list
+            List of the messages to encode, in the order they should be received.
+
+        Returns
+        -------
+        bytes
+            The framed messages.
+        """
+        delimiter = Commands.BLUETOOTH_VARIABLES["message_delimiter"]
+        packet = "".join(message + delimiter for message in messages)
+        return packet.encode(Commands.BLUETOOTH_VARIABLES["data_format"])
+
+
+class MessageParser():
+    """ Incremental parser for the messages received from one socket.
+    Keeps incomplete messages until the rest of the message is received.
+    """
+
+    def __init__(self):
+        """ Initializes the MessageParser class.
+
+        Attributes
+        ----------
+        _buffer : bytes
+            Data received after the last complete message.
+        """
+        self._buffer = b""
+
+    def feed(self, data: bytes):
+        """ Adds received data to the parser.
+
+        Parameters
+        ----------
+        data : bytes
+            The data received from the socket.
+
+        Returns
+        -------
+        list
+            List of the complete messages received so far (can be empty).
+        """
+        delimiter = Commands.BLUETOOTH_VARIABLES["message_delimiter"].encode(Commands.BLUETOOTH_VARIABLES["data_format"])
+
+        # The last item is an incomplete message (empty if the data ended with a delimiter)
+        *packets, self._buffer = (self._buffer + data).split(delimiter)
+
+        messages = []
+        for packet in packets:
+            message = packet.decode(Commands.BLUETOOTH_VARIABLES["data_format"], errors="replace").strip()
+            # Skip empty messages
+            if message:
+                messages.append(message)
+        return messages
+
+
+class LinkMonitor():
+    """ Measures the round-trip time (RTT) of a link with ping/pong messages.
+
+    One end sends "Ping:<sequence>" periodically, the other end answers with "Pong:<sequence>".
+    Keeps the last RTTs in a rolling window, and reports the link as degraded 
+    when the latency crosses the threshold defined in the Commands class.
+    """
+    # Upper limit of each histogram bucket [ms]
+    HISTOGRAM_BUCKETS = (10, 20, 50, 100, 200, 500, 1000, float("inf"))
+
+    def __init__(self):
+        """ Initializes the LinkMonitor class.
+
+        Attributes
+        ----------
+        _next_sequence : int
+            Sequence number of the next ping.
+        _pending_pings : dict
+            Pings waiting for a pong {sequence: send time}.
+        _rtts : deque
+            Last RTTs measured [sec].
+        lost_pings : int
+            Number of pings that were not answered before the link timeout.
+        """
+        self._next_sequence = 0
+        self._pending_pings = {}
+        self._rtts = deque(maxlen=Commands.BLUETOOTH_VARIABLES["rtt_window"])
+        self.lost_pings = 0
+
+    @staticmethod
+    def parse(message: str):
+        """ Checks if a message is a ping or a pong.
+
+        Parameters
+        ----------
+        message : str
+            The received message.
+
+        Returns
+        -------
+        tuple
+            (kind, sequence), with kind being the ping or pong message, or (None, None) for other messages.
+        """
+        kind, separator, sequence = message.partition(":")
+        if separator and sequence.isdigit() and kind in (Commands.BLUETOOTH_VARIABLES["ping_message"], Commands.BLUETOOTH_VARIABLES["pong_message"]):
+            return kind, int(sequence)
+        return None, None
+
+    @staticmethod
+    def pong(sequence: int):
+        """ Returns the pong message that answers the ping with `sequence`. """
+        return f"{Commands.BLUETOOTH_VARIABLES['pong_message']}:{sequence}"
+
+    def ping(self):
+        """ Creates the next ping message and starts timing it.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        str
+            The ping message to send.
+        """
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        self._pending_pings[sequence] = time.monotonic()
+        self._expire_pings()
+        return f"{Commands.BLUETOOTH_VARIABLES['ping_message']}:{sequence}"
+
+    def handle_pong(self, sequence: int):
+        """ Records the RTT of the ping answered by a pong.
+
+        Parameters
+        ----------
+        sequence : int
+            Sequence number of the pong.
+
+        Returns
+        -------
+        float
+            The RTT [sec], or None if the ping is unknown (e.g. it already expired).
+        """
+        send_time = self._pending_pings.pop(sequence, None)
+        if send_time is None:
+            return None
+        rtt = time.monotonic() - send_time
+        self._rtts.append(rtt)
+        return rtt
+
+    def _expire_pings(self):
+        """ Counts the pings older than the link timeout as lost. """
+        now = time.monotonic()
+        for sequence, send_time in list(self._pending_pings.items()):
+            if now - send_time > Commands.BLUETOOTH_VARIABLES["link_timeout"]:
+                del self._pending_pings[sequence]
+                self.lost_pings += 1
+
+    def get_stats(self):
+        """ Returns the latency statistics of the link.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict
+            last, p50, p95 and max RTT [ms] (None before the first pong),
+            oldest_pending: age of the oldest unanswered ping [ms],
+            lost: number of lost pings,
+            histogram: list of (bucket upper limit [ms], count),
+            degraded: True if the latency is over the threshold.
+        """
+        self._expire_pings()
+        rtts = sorted(1000 * rtt for rtt in self._rtts)
+        now = time.monotonic()
+        oldest_pending = 1000 * max((now - t for t in self._pending_pings.values()), default=0)
+
+        histogram = [[bucket, 0] for bucket in self.HISTOGRAM_BUCKETS]
+        for rtt in rtts:
+            next(item for item in histogram if rtt <= item[0])[1] += 1
+
+        last = 1000 * self._rtts[-1] if self._rtts else None
+        threshold = 1000 * Commands.BLUETOOTH_VARIABLES["degraded_latency"]
+        return {
+            "last": last,
+            "p50": rtts[len(rtts) // 2] if rtts else None,
+            "p95": rtts[min(int(0.95 * len(rtts)), len(rtts) - 1)] if rtts else None,
+            "max": rtts[-1] if rtts else None,
+            "oldest_pending": oldest_pending,
+            "lost": self.lost_pings,
+            "histogram": [tuple(item) for item in histogram],
+            # A ping that is still waiting for longer than the threshold also means the link is slow
+            "degraded": ((last or 0) > threshold) or (oldest_pending > threshold),
+            }
+
+    @staticmethod
+    def format_stats(stats: dict):
+        """ Returns a short text with the latency of the link, for the GUI. """
+        if stats["last"] is None:
+            text = "measuring..."
+        else:
+            text = f"{stats['last']:.0f} ms (p95 {stats['p95']:.0f} ms)"
+        if stats["degraded"]:
+            text += " - SLOW LINK"
+        return text
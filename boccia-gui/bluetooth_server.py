@@ -1,10 +1,40 @@
 # Import libraries
 from PyQt5.QtCore import QThread, pyqtSignal
+import time
 import socket
-import threading
+import selectors
 
-from bt_devices import BluetoothDevices
+from transports import get_transport
+from bluetooth_protocol import BluetoothProtocol, MessageParser, LinkMonitor
 from commands import Commands
+from session_trace import DEVICE
+from pipeline_tracing import tracer
+
+class ClientConnection():
+    """ State of a client connected to the BluetoothServer. """
+
+    def __init__(self, client, client_address, player_number: str):
+        """ Initializes the ClientConnection class.
+
+        Parameters
+        ----------
+        client : socket.socket
+            The client socket.
+        client_address : tuple
+            The address information of the client.
+        player_number : str
+            The player assigned to this client (e.g. "Player 2").
+
+        Returns
+        -------
+        None
+        """
+        self.client = client
+        self.client_address = client_address
+        self.player_number = player_number
+        self.parser = MessageParser() # Each client has its own parser, since a command can be split across packets
+        self.outgoing = bytearray() # Data waiting to be sent to the client
+        self.link_monitor = LinkMonitor() # Round-trip time of the link with this client
 
 class BluetoothServer(QThread):
     """ Class that handles Bluetooth server operations.
@@ -16,16 +46,28 @@ class BluetoothServer(QThread):
     # This signal is emitted when the server status changes (e.g. connected, disconnected, error)
     server_status_changed = pyqtSignal(str)
 
+    # Signal with the number of connected clients
+    # This signal is emitted when a client connects or disconnects (e.g. a player dropped and reconnected)
+    clients_changed = pyqtSignal(int)
+
     # Signal to indicate a command received from a client
     # Emits the player number (i.e. which client sent it) and the command
     command_received = pyqtSignal(str, str)
 
-    def __init__(self):
+    # Signal with the latency statistics of the link with a client
+    # Emits the player number and the statistics from LinkMonitor.get_stats()
+    link_stats_changed = pyqtSignal(str, dict)
+
+    def __init__(self, transport = None, trace = None):
         """ Initializes BluetoothServer class.
 
         Parameters
         ----------
-        None
+        transport : Transport
+            Socket type used to accept clients.
+            Defaults to the transport set in Commands.TRANSPORT_VARIABLES.
+        trace : SessionTraceRecorder
+            Records the commands received from the clients, None to not record them.
 
         Returns
         -------
@@ -33,27 +75,34 @@ class BluetoothServer(QThread):
 
         Attributes
         ----------
-        bluetooth_devices : BluetoothDevices
-            Instance of BluetoothDevices class.
+        transport : Transport
+            Instance of the Transport class used to create the server socket.
+        trace : SessionTraceRecorder
+            Records the commands received from the clients, or None.
         _running : bool
             Indicates whether the server is running.
-        _connected_clients : list
-            List of tuples (client, client_address) for the connected clients.
-        _player_count : int
-            Number of players.
+        _connected_clients : dict
+            Dictionary of the connected clients {client socket: ClientConnection}.
+            Only modified by the server thread.
         _num_clients : int
             Number of clients to connect to (corresponds to the number of players).
+        _selector : selectors.BaseSelector
+            Selector that waits for events on the server and all client sockets.
+        _wakeup_sockets : tuple
+            Pair of connected sockets, used to wake up the server thread from other threads.
         """
         super().__init__()
 
-        # Initialize BluetoothDevices instance
-        self.bluetooth_devices = BluetoothDevices()
+        # Initialize the transport (e.g. Bluetooth RFCOMM)
+        self.transport = transport if transport else get_transport()
+        self.trace = trace
 
         # Initialize attributes
         self._running = False
-        self._connected_clients = [] 
-        self._player_count = 1 # Start at 1 since Player 1 is the server (i.e. this device)
+        self._connected_clients = {}
         self._num_clients = 1 # Default to 1 (for a minimum of 1 device connected)
+        self._selector = None
+        self._wakeup_sockets = None
     
     def set_num_clients(self, num_players: int):
         """ Sets the number of clients to connect to.
@@ -97,9 +146,8 @@ class BluetoothServer(QThread):
         """ Runs the Bluetooth server.
 
         Calls the method to initialize the Bluetooth server.
-        Starts a thread to run separately to accept client connections.
-
-        Initializes the Bluetooth server socket.
+        Runs a single event loop that accepts connections, receives commands and sends messages
+        for all the clients, using non-blocking sockets.
         
         Parameters
         ----------
@@ -119,22 +167,54 @@ class BluetoothServer(QThread):
             return
         
         try:
+            # Register the server socket, and the socket used by stop() to wake up the event loop
+            self.server.setblocking(False)
+            self._wakeup_sockets = socket.socketpair()
+            self._wakeup_sockets[0].setblocking(False)
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self.server, selectors.EVENT_READ)
+            self._selector.register(self._wakeup_sockets[0], selectors.EVENT_READ)
+
             if self._running:
                 # Emit signal to indicate the server is waiting for connections
                 self.server_status_changed.emit("Waiting")
-            # Start a thread to accept client connections
-            connection_thread = threading.Thread(target=self._accept_clients)
-            connection_thread.start()
-            connection_thread.join()
+
+            next_heartbeat = time.monotonic() + Commands.BLUETOOTH_VARIABLES["heartbeat_interval"]
+            while self._running:
+                # Ping all the clients periodically
+                if time.monotonic() >= next_heartbeat:
+                    self._send_heartbeats()
+                    next_heartbeat += Commands.BLUETOOTH_VARIABLES["heartbeat_interval"]
+
+                # Wait until any of the sockets is ready, or until the next heartbeat
+                for key, mask in self._selector.select(max(0, next_heartbeat - time.monotonic())):
+                    # Skip the remaining events if the server was stopped
+                    if not self._running:
+                        break
+
+                    if key.fileobj is self.server:
+                        self._accept_client()
+                    elif key.fileobj is self._wakeup_sockets[0]:
+                        self._wakeup_sockets[0].recv(Commands.BLUETOOTH_VARIABLES["bytes"])
+                    else:
+                        if mask & selectors.EVENT_READ:
+                            self._receive_from_client(key.data)
+                        if (mask & selectors.EVENT_WRITE) and (key.data.client in self._connected_clients):
+                            self._flush_client(key.data)
+
         except Exception as e:
             if self._running:
                 self.server_status_changed.emit("Error") # Emit signal to indicate error
                 # print(f"Bluetooth Server Error: {e}") # For debugging purposes
+
+        # Close all the sockets from the server thread
+        finally:
+            self._close_server()
     
     def _initialize_server(self):
-        """ Initializes the Bluetooth server socket.
-        Gets the address of the Bluetooth adapter of the local machine.
-        Uses the RFCOMM channel defined in the Commands class.
+        """ Initializes the server socket.
+        Uses the transport to create the socket (e.g. on the local Bluetooth adapter, 
+        with the RFCOMM channel defined in the Commands class).
 
         Parameters
         ----------
@@ -143,48 +223,29 @@ class BluetoothServer(QThread):
         Returns
         -------
         socket.socket
-            The Bluetooth server socket.
+            The server socket.
         """
         # Emit signal to indicate the server is initializing
         self.server_status_changed.emit("Initializing")
 
-        # Get the address of the Bluetooth adapter of the local machine
-        # Call the method in the BluetoothDevices class
-        # This is the server address since this device is the server
-        self.local_bluetooth_adapter = self.bluetooth_devices.get_local_bluetooth_adapter()
-
-        # Return if no adapters are found
-        if not self.local_bluetooth_adapter:
-            self.server_status_changed.emit("Error") # Emit signal to indicate error
-            return
-        
-        # Use the first adapter in the list
-        # (There should only be one item in the list if get_local_bluetooth_adapter() worked correctly)
-        _, address, _ = self.local_bluetooth_adapter[0]
-
         try:
-            # Create a Bluetooth server socket
-            server = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
-            server.bind((address, Commands.BLUETOOTH_VARIABLES["RFCOMM_channel"]))
-
+            # Create the server socket
             # Set max number of connections that can be queued
             # Setting to the same value as _num_clients
-            server.listen(self._num_clients)
-
-            # Return the server socket
-            return server
+            return self.transport.create_server_socket(self._num_clients)
         
         except Exception as e:
+            # The adapter may have changed, look for it again on the next try
+            self.transport.invalidate_devices()
             self.server_status_changed.emit("Error") # Emit signal to indicate error
             # print(f"Error initializing Bluetooth server: {e}") # For debugging purposes
             return
 
-    def _accept_clients(self):
-        """ Accepts client connections.
+    def _accept_client(self):
+        """ Accepts a client connection.
         Notifies the client if the max number of clients has been reached.
 
-        Starts a thread to handle each client separately.
-        (Using threads allows multiple clients to connect at the same time.)
+        Assigns the lowest free player number to the client.
 
         Parameters
         ----------
@@ -194,98 +255,151 @@ class BluetoothServer(QThread):
         -------
         None
         """
-        while self._running:
-            try:
-                # Accept client connection
-                client, client_address = self.server.accept()
-
-                # Check if the max number of clients has been reached
-                if len(self._connected_clients) >= self._num_clients:
-                    # Send message to client indicating max clients are connected
-                    self._send_to_client(client, Commands.BLUETOOTH_VARIABLES["max_clients_message"])
-                    client.close() # Close the client socket since enough clients are connected
-                    continue
-
-                # Otherwise, send message to client indicating connection was successful
-                self._send_to_client(client, "Connected")
-                # Start a thread to handle the client separately
-                client_thread = threading.Thread(target=self._handle_client, args=(client, client_address))
-                client_thread.start()
-
-            except Exception as e:
-                # print(f"Error accepting client connection: {e}") # For debugging purposes
-                break
-
-    def _handle_client(self, client, client_address):
-        """ Handles communication with a client.
-
-        Assigns a player number to the client, depending on the count of connected players.
-        Handles commands received from clients.
+        try:
+            # Accept client connection
+            client, client_address = self.server.accept()
+        except BlockingIOError:
+            return # The client gave up before the connection was accepted
+        client.setblocking(False)
+        self.transport.configure_connection(client)
+
+        # Check if the max number of clients has been reached
+        if len(self._connected_clients) >= self._num_clients:
+            # Send message to client indicating max clients are connected
+            self._send_now(client, Commands.BLUETOOTH_VARIABLES["max_clients_message"])
+            client.close() # Close the client socket since enough clients are connected
+            return
+
+        # Assign the lowest player number not used by another client
+        # Start at 2 since Player 1 is the server (i.e. this device)
+        used_numbers = {connection.player_number for connection in self._connected_clients.values()}
+        player_index = 2
+        while f"Player {player_index}" in used_numbers:
+            player_index += 1
+        player_number = f"Player {player_index}"
+        # print(f"{player_number} connected") # For debugging purposes
+
+        # Add client to the connected clients and start waiting for its commands
+        connection = ClientConnection(client, client_address, player_number)
+        self._connected_clients[client] = connection
+        self._selector.register(client, selectors.EVENT_READ, connection)
+
+        # Send message to client indicating connection was successful
+        self._send_to_client(connection, "Connected")
+
+        # Emit the number of connected clients
+        self.clients_changed.emit(len(self._connected_clients))
+
+    def _receive_from_client(self, connection: ClientConnection):
+        """ Handles the data received from a client.
+
+        Emits every complete command received, in order.
         Calls the stop() method if the disconnect command is received.
 
         Parameters
         ----------
-        client : socket.socket
-            The client socket.
-        client_address : tuple
-            The address informationof the client.
+        connection : ClientConnection
+            The client that has data to read.
 
         Returns
         -------
         None
         """
-        # Add client and client address to the list of connected clients
-        self._connected_clients.append((client, client_address))
-        
-        # Increment player count
-        self._player_count += 1
-        # Assign player number to this client based on player count
-        player_number = "Player " + str(self._player_count)
-        # print(f"{player_number} connected") # For debugging purposes
+        try:
+            # Receive message from client
+            data = connection.client.recv(Commands.BLUETOOTH_VARIABLES["bytes"])
+            received_time = tracer.now() if tracer.enabled else None
+        except BlockingIOError:
+            return # Nothing to read yet
+        except Exception as e:
+            # The link with this client failed (e.g. connection reset), the player dropped
+            # The server keeps running and waits for the player to reconnect
+            # print(f"Error receiving command from client: {e}") # For debugging purposes
+            self._remove_client(connection)
+            return
 
-        # Emit Connected signal
-        self.server_status_changed.emit("Connected") 
+        # Remove the client if no data is received (i.e. the client closed the connection)
+        if not data:
+            self._remove_client(connection)
+            return
 
-        # Handle commands from client
-        try:
-            while self._running:
-                # Receive message from client
-                data = client.recv(Commands.BLUETOOTH_VARIABLES["bytes"])
-                if not data:
-                    break # Stop if no data is received
-                # Decode the received data
-                command = data.decode(Commands.BLUETOOTH_VARIABLES["data_format"])
+        # A single packet can contain several commands
+        for command in connection.parser.feed(data):
+            # Stop if disconnect command is received from the client
+            if command == Commands.BLUETOOTH_VARIABLES["disconnect_command"]:
+                self.stop()
+                return
+
+            # Answer pings and record the pongs from the client, these are not commands
+            kind, sequence = LinkMonitor.parse(command)
+            if kind == Commands.BLUETOOTH_VARIABLES["ping_message"]:
+                self._send_to_client(connection, LinkMonitor.pong(sequence))
+                continue
+            if kind == Commands.BLUETOOTH_VARIABLES["pong_message"]:
+                if connection.link_monitor.handle_pong(sequence) is not None:
+                    self.link_stats_changed.emit(connection.player_number, connection.link_monitor.get_stats())
+                continue
+
+            # Otherwise record and emit the player number and command
+            if self.trace:
+                self.trace.record(DEVICE, command, connection.player_number)
+            self.command_received.emit(connection.player_number, command)
+            if received_time:
+                tracer.record("bluetooth_recv_to_emit", received_time)
+
+    def _send_heartbeats(self):
+        """ Sends a ping to every connected client.
+        Emits the link statistics of the clients that have not answered the previous pings,
+        so a link that stopped responding is shown as degraded.
 
-                # Stop if disconnect command is received from the client
-                if command == Commands.BLUETOOTH_VARIABLES["disconnect_command"]:
-                    self.stop()
-                    return
+        Parameters
+        ----------
+        None
 
-                # Otherwise emit the player number and command
-                self.command_received.emit(player_number, command)
+        Returns
+        -------
+        None
+        """
+        for connection in list(self._connected_clients.values()):
+            stats = connection.link_monitor.get_stats()
+            if stats["oldest_pending"] > 0:
+                self.link_stats_changed.emit(connection.player_number, stats)
+            self._send_to_client(connection, connection.link_monitor.ping())
 
-        # Catch any errors
-        except Exception as e:
-            self.server_status_changed.emit("Error") # Emit signal to indicate error
-            # print(f"Error receiving command from client: {e}") # For debugging purposes
-        
-        # Close the client to clean up
-        finally:
-            client.close()
-            if (client, client_address) in self._connected_clients:
-                # Remove the client and client address from the list
-                self._connected_clients.remove((client, client_address))
-            if not self._connected_clients:
-                # Emit Disconnected signal if no clients are connected anymore
-                self.server_status_changed.emit("Disconnected")
-
-    def _send_to_client(self, client, command_text: str):
+    def _remove_client(self, connection: ClientConnection):
+        """ Closes a client and removes it from the connected clients.
+
+        Parameters
+        ----------
+        connection : ClientConnection
+            The client to remove.
+
+        Returns
+        -------
+        None
+        """
+        if connection.client not in self._connected_clients:
+            return
+
+        del self._connected_clients[connection.client]
+        self._selector.unregister(connection.client)
+        connection.client.close()
+
+        # Empty statistics mean the player is not connected anymore
+        self.link_stats_changed.emit(connection.player_number, {})
+
+        # Emit the number of connected clients
+        # (The server keeps waiting for the players that dropped, it is only "Disconnected" when it stops)
+        self.clients_changed.emit(len(self._connected_clients))
+
+    def _send_to_client(self, connection: ClientConnection, command_text: str):
         """ Sends a command to a specific client.
+        Data that cannot be sent right away is sent when the client socket is ready.
 
         Parameters
         ----------
-        client : socket.socket
-            The client socket.
+        connection : ClientConnection
+            The client to send the command to.
         command_text : str
             The command to send.
 
@@ -297,22 +411,64 @@ class BluetoothServer(QThread):
         if not self._running:
             return
         
+        # Encode the command text and queue it for the client
+        connection.outgoing += BluetoothProtocol.encode(command_text)
+        self._flush_client(connection)
+
+    def _flush_client(self, connection: ClientConnection):
+        """ Sends as much queued data as possible to a client without blocking.
+        Waits for the client socket to be writable only while there is data left.
+
+        Parameters
+        ----------
+        connection : ClientConnection
+            The client to send the queued data to.
+
+        Returns
+        -------
+        None
+        """
         try:
-            # Encode the command text and send it to the client
-            client.send(command_text.encode(Commands.BLUETOOTH_VARIABLES["data_format"]))
+            sent = connection.client.send(connection.outgoing)
+            del connection.outgoing[:sent]
+        except BlockingIOError:
+            pass # The socket buffer is full, try again when it is writable
         
         # Catch any errors
         except Exception as e:
             self.server_status_changed.emit("Error") # Emit signal to indicate error
             # print(f"Error sending command: {e}") # For debugging purposes
+            self._remove_client(connection)
+            return
+
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if connection.outgoing else 0)
+        self._selector.modify(connection.client, events, connection)
+
+    def _send_now(self, client, command_text: str):
+        """ Sends a short message to a client that is about to be closed, ignoring any errors.
+
+        Parameters
+        ----------
+        client : socket.socket
+            The client socket.
+        command_text : str
+            The message to send.
+
+        Returns
+        -------
+        None
+        """
+        try:
+            client.send(BluetoothProtocol.encode(command_text))
+        except Exception:
+            pass
 
     def stop(self):
-        """ Stops the Bluetooth server thread, and ensures all clients are closed.
-        Sets the _running flag to False.
-        Sends the disconnect command to all connected clients, and closes all client sockets.
-        Clears the list of connected clients.
-        Closes the server socket.
-        Emits a signal to indicate the server has disconnected.
+        """ Stops the Bluetooth server thread.
+        Sets the _running flag to False and wakes up the server thread,
+        which sends the disconnect command to all connected clients and closes all sockets.
+
+        Can be called from any thread.
 
         Parameters
         ----------
@@ -328,26 +484,58 @@ class BluetoothServer(QThread):
             return
         
         self._running = False # Reset the _running flag to False
-        self._player_count = 1 # Reset player count
 
-        # Close all connected client sockets
-        for client, _ in self._connected_clients:
-            try:
-                # Send the disconnect command to the client
-                disconnect_command = Commands.BLUETOOTH_VARIABLES["disconnect_command"]
-                client.send(disconnect_command.encode(Commands.BLUETOOTH_VARIABLES["data_format"]))
-                client.close() # Close the client socket
+        # If the event loop is not running (e.g. the server failed to initialize), there is nothing to close
+        if not self._selector:
+            self.server_status_changed.emit("Disconnected")
+            return
 
-            except Exception:
-                self.server_status_changed.emit("Error") # Emit signal to indicate error
+        # Otherwise wake up the event loop so it can close everything
+        try:
+            self._wakeup_sockets[1].send(b"\0")
+        except Exception:
+            pass
+
+    def _close_server(self):
+        """ Closes all client sockets and the server socket.
+        Called by the server thread when its event loop ends.
+        Sends the disconnect command to all connected clients.
+        Clears the dictionary of connected clients.
+        Emits a signal to indicate the server has disconnected.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        self._running = False
+
+        # Close all connected client sockets
+        disconnect_command = Commands.BLUETOOTH_VARIABLES["disconnect_command"]
+        for client in self._connected_clients:
+            # Send the disconnect command to the client
+            self._send_now(client, disconnect_command)
+            client.close() # Close the client socket
         
-        # Clear the list of connected clients
+        # Clear the connected clients
         self._connected_clients.clear()
-        
+
+        # Close the selector and the wakeup sockets
+        if self._selector:
+            self._selector.close()
+            self._selector = None
+        if self._wakeup_sockets:
+            for wakeup_socket in self._wakeup_sockets:
+                wakeup_socket.close()
+            self._wakeup_sockets = None
+
         # Close the server
         if hasattr(self, 'server') and self.server:
             try:
-                self.server.close()
+                self.transport.close_server_socket(self.server)
 
             # Catch any errors
             except Exception:
@@ -357,4 +545,4 @@ class BluetoothServer(QThread):
 
         # Emit Disconnected signal
         self.server_status_changed.emit("Disconnected")
-        # print("Bluetooth server stopped") # For debugging purposes
\ No newline at end of file
+        # print("Bluetooth server stopped") # For debugging purposes
@@ -1,109 +1,665 @@
 # Import libraries
+from typing import NamedTuple
 import subprocess
-from subprocess import CREATE_NO_WINDOW
+import threading
+import json
+import time
+import os
 import re
 import sys
 
-class BluetoothDevices:
-    """ Class that handles Bluetooth device operations.
-    Supports the BluetoothClient and BluetoothServer classes.
-    Contains methods to get paired Bluetooth devices and the local Bluetooth adapters.
+from commands import Commands
+
+# Only defined on Windows, 0 leaves the process creation flags unchanged elsewhere
+CREATE_NO_WINDOW = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+class BluetoothDevice(NamedTuple):
+    """ Bluetooth device or adapter found by BluetoothDevices.
+    It is a tuple, so it can still be unpacked as (name, address, description).
     """
+    name: str
+    address: str        # MAC address, formatted as 'AA:BB:CC:DD:EE:FF'
+    description: str
 
-    def get_paired_bluetooth_devices(self):
-        """ Retrieves a list of devices currently paired via Bluetooth to this device.
 
-        Paired devices are retrieved using a PowerShell command.
-        The output is parsed to extract the name, MAC address, and description of each paired device.
+class DiscoveryResult(NamedTuple):
+    """ Result of a discovery probe: the local Bluetooth adapters and the paired devices. """
+    adapters: list
+    devices: list
+
+
+class DiscoveryCache:
+    """ Thread-safe cache for the results of the Bluetooth discovery probes.
+    Each probe starts a PowerShell process that takes seconds, so its result is kept for a TTL.
+    When a stale result is asked for, a background thread refreshes it, so callers get the last known result instantly.
+    Nothing is probed while no one asks for the results (e.g. multiplayer mode is off or the players are connected).
+    """
+
+    def __init__(self, ttl: float):
+        """ Initializes the DiscoveryCache class.
 
         Parameters
         ----------
+        ttl : float
+            [sec] Age after which a cached result is stale and has to be probed again.
+
+        Returns
+        -------
         None
 
+        Attributes
+        ----------
+        _entries : dict
+            Cached results as {key: (probe time, result)}.
+        _probes : dict
+            Function used to probe each key, as {key: probe}.
+        _lock : threading.Lock
+            Lock for the entries and probes.
+        _probe_locks : dict
+            One lock per key, so the same probe is not run by several threads at once.
+        _refresh_event : threading.Event
+            Set to wake up the refresher thread when a result is stale or missing.
+        _refresher : threading.Thread
+            Thread that refreshes the stale results in the background, idle until woken up.
+        """
+        self.ttl = ttl
+        self._entries = {}
+        self._probes = {}
+        self._lock = threading.Lock()
+        self._probe_locks = {}
+        self._refresh_event = threading.Event()
+        self._refresher = None
+
+    def get(self, key: str, probe):
+        """ Returns the cached result of `probe`.
+
+        Returns the last known result right away, even if it is stale (the refresher thread updates it).
+        Only waits for `probe` if there is no result yet (first call or after invalidate()).
+
+        Parameters
+        ----------
+        key : str
+            Name of the cached result.
+        probe : callable
+            Function that returns the result, called without arguments.
+
         Returns
         -------
-        list
-            A list of tuples containing the name, MAC address, and description of each paired device.
-        """
-        # RUN POWERSHELL COMMAND
-        # Default path to Windows PowerShell
-        powershell_path = "C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe"
-        
-        # PowerShell command to get devices paired via Bluetooth to this device
-            # Get-PnpDevice -Class Bluetooth: Lists Bluetooth devices
-            # Where-Object { $_.Status -eq 'OK' }: Filters out devices without 'OK' status (i.e. not paired/connected)
-            # Select-Object FriendlyName, InstanceId, Description: Selects relevant properties only
-        cmd = [
-            powershell_path,
-            "-Command",
-            "Get-PnpDevice -Class Bluetooth | Where-Object { $_.Status -eq 'OK' } | Select-Object FriendlyName, InstanceId, Description"
-        ]
+        object
+            The cached result, it should not be modified by the caller.
+        """
+        with self._lock:
+            self._probes[key] = probe
+            probe_lock = self._probe_locks.setdefault(key, threading.Lock())
+            entry = self._entries.get(key)
+
+        if entry is None:
+            # Nothing cached yet, probe now
+            # If another thread is already probing this key, wait for its result instead of probing again
+            with probe_lock:
+                with self._lock:
+                    entry = self._entries.get(key)
+                if entry is None:
+                    entry = self._probe(key, probe)
+        elif time.monotonic() - entry[0] > self.ttl:
+            # Stale result, ask the refresher thread to update it
+            self._refresh_event.set()
+
+        self._start_refresher()
+        return entry[1]
+
+    def prefetch(self, key: str, probe):
+        """ Registers `probe` and runs it in the background, so the first get() does not have to wait.
+
+        Parameters
+        ----------
+        key : str
+            Name of the cached result.
+        probe : callable
+            Function that returns the result, called without arguments.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._probes.setdefault(key, probe)
+            self._probe_locks.setdefault(key, threading.Lock())
+        self._start_refresher()
+        self._refresh_event.set()
+
+    def invalidate(self, key: str = None):
+        """ Discards a cached result, the next get() probes again.
+
+        Parameters
+        ----------
+        key : str
+            Name of the cached result. Discards all the results if None.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def _probe(self, key: str, probe):
+        """ Runs `probe` and caches its result.
+
+        Parameters
+        ----------
+        key : str
+            Name of the cached result.
+        probe : callable
+            Function that returns the result, called without arguments.
+
+        Returns
+        -------
+        tuple
+            The new entry (probe time, result).
+        """
+        result = probe()
+        entry = (time.monotonic(), result)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def _start_refresher(self):
+        """ Starts the refresher thread if it is not running yet. """
+        with self._lock:
+            if self._refresher is not None:
+                return
+            # Daemon thread, so it does not keep the app open
+            self._refresher = threading.Thread(target=self._refresh_loop, name="BluetoothDiscoveryRefresher", daemon=True)
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        """ Probes the registered keys whose result is stale or missing, each time it is woken up by get() or prefetch(). """
+        while True:
+            self._refresh_event.wait()
+            self._refresh_event.clear()
+
+            now = time.monotonic()
+            with self._lock:
+                probes = [(key, probe) for key, probe in self._probes.items()
+                          if (key not in self._entries) or (now - self._entries[key][0] > self.ttl)]
+
+            for key, probe in probes:
+                with self._probe_locks[key]:
+                    try:
+                        self._probe(key, probe)
+                    except Exception as e:
+                        # Keep serving the last known result
+                        # print(f"Error refreshing {key}: {e}") # For debugging purposes
+                        pass
+
+
+class DiscoveryBackend():
+    """ Base class for the ways of finding the local Bluetooth adapters and the paired devices.
+    Used by the BluetoothDevices class, see get_discovery_backend().
+    """
+    # Name used to select the backend in Commands.BLUETOOTH_VARIABLES
+    name = ""
+
+    # Whether the results have to be cached (i.e. discover() is slow)
+    cached = True
+
+    def discover(self):
+        """ Retrieves the local Bluetooth adapters and the devices paired to this device.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        DiscoveryResult
+            The adapters and paired devices.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def format_mac_address(mac: str):
+        """ Formats a MAC address as 'AA:BB:CC:DD:EE:FF'.
+
+        Parameters
+        ----------
+        mac : str
+            MAC address with or without separators (e.g. 'aa-bb-cc-dd-ee-ff' or 'AABBCCDDEEFF').
+
+        Returns
+        -------
+        str
+            The formatted MAC address, or an empty string if `mac` is not a MAC address.
+        """
+        digits = re.sub(r'[:\-]', "", mac.strip()).upper()
+        if not re.fullmatch(r'[0-9A-F]{12}', digits):
+            return ""
+        return ':'.join(digits[i:i+2] for i in range(0, 12, 2))
+
+
+class PowerShellBackend(DiscoveryBackend):
+    """ Windows backend. Runs a single PowerShell command that returns JSON (see parse_discovery_output()). """
+    name = "powershell"
+
+    # Default path to Windows PowerShell
+    POWERSHELL_PATH = "C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe"
+
+    # PowerShell script that gets the local Bluetooth adapters and the paired devices in one call
+        # Get-NetAdapter ... -like '*Bluetooth*': Lists the network adapters of the Bluetooth radios
+        # Get-PnpDevice -Class Bluetooth: Lists Bluetooth devices
+        # Where-Object { $_.Status -eq 'OK' }: Filters out devices without 'OK' status (i.e. not paired/connected)
+        # Select-Object: Selects relevant properties only
+        # @(...): Keeps the lists as JSON arrays even with 0 or 1 items
+        # ConvertTo-Json: Machine-readable output, so nothing depends on column widths or the language of the headers
+    DISCOVERY_SCRIPT = (
+        "$adapters = @(Get-NetAdapter | Where-Object { $_.InterfaceDescription -like '*Bluetooth*' } "
+        "| Select-Object Name, MacAddress, InterfaceDescription); "
+        "$devices = @(Get-PnpDevice -Class Bluetooth | Where-Object { $_.Status -eq 'OK' } "
+        "| Select-Object FriendlyName, InstanceId, Description); "
+        "ConvertTo-Json -Compress -Depth 3 -InputObject @{ Adapters = $adapters; Devices = $devices }"
+    )
+
+    # Items listed by Get-PnpDevice that are not actual devices
+    NON_DEVICE_KEYWORDS = ("Service", "Enumerator", "Adapter", "Transport", "RFCOMM")
+
+    def discover(self):
+        """ Retrieves the local Bluetooth adapters and the devices paired to this device.
+        Runs the PowerShell discovery script and parses its output.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        DiscoveryResult
+            The adapters and paired devices.
+        """
+        cmd = [self.POWERSHELL_PATH, "-NoProfile", "-Command", self.DISCOVERY_SCRIPT]
 
         # This is needed to prevent a console window when the app is running as a .exe
         is_frozen = getattr(sys, 'frozen', False)
         creationflags = CREATE_NO_WINDOW if is_frozen else 0
 
-        # Run the command and store the output
-        result = subprocess.run(cmd, capture_output=True, text=True, creationflags=creationflags)
-        output = result.stdout
+        # Run the command and parse the output
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="replace", creationflags=creationflags)
+        return self.parse_discovery_output(result.stdout)
 
-        devices = [] # List to store paired devices
+    @classmethod
+    def parse_discovery_output(cls, output: str):
+        """ Parses the JSON output of the discovery script.
 
-        # PARSE OUTPUT
-        # Parses the output by iterating through each line
-        for line in output.splitlines():
-            # Skipping column headers and empty lines
-            if ("FriendlyName" in line or "InstanceId" in line or "Description" in line or not line.strip()):
-                continue
+        Parameters
+        ----------
+        output : str
+            Output of DISCOVERY_SCRIPT, e.g. '{"Adapters":[...],"Devices":[...]}'.
 
-            # Skipping non-device items from the output (these are not actual devices)
-            if any(x in line for x in ["Service", "Enumerator", "Adapter", "Transport", "RFCOMM"]):
+        Returns
+        -------
+        DiscoveryResult
+            The adapters and paired devices. Both lists are empty if the output is not valid.
+        """
+        # Skip anything printed before the JSON object (e.g. a byte order mark or a warning)
+        start = output.find("{")
+        if start < 0:
+            return DiscoveryResult([], [])
+        try:
+            data = json.loads(output[start:])
+        except ValueError:
+            # print(f"Invalid discovery output: {output}") # For debugging purposes
+            return DiscoveryResult([], [])
+
+        adapters = []
+        for item in cls._as_list(data.get("Adapters")):
+            name = item.get("Name") or ""
+            mac_address = cls.format_mac_address(item.get("MacAddress") or "")
+
+            # Skip Ethernet adapters and adapters without a MAC address
+            if "Ethernet" in name or not mac_address:
                 continue
+            adapters.append(BluetoothDevice(name, mac_address, item.get("InterfaceDescription") or ""))
 
-            # EXTRACT DEVICE DETAILS WITH REGEX
-            # The line should contain 3 columns separated by 2 or more spaces
-            # The first column is the name, the second is the instance ID, and the third is the device description
-            # (The instance ID is the identifer assigned to the device by Windows)
-            # Sometimes the command returned lines with only two columns (no device description)
-            # Try to match 3 columns first
-            match = re.match(r'^(.*?)\s{2,}(\S+)\s{2,}(.*)$', line.strip())
-            if not match:
-                # Then try to match 2 columns if it did not have 3
-                match = re.match(r'^(.*?)\s{2,}(\S+)$', line.strip())
-                if match:
-                    # Extract the name, instance ID, and leave description blank
-                    name = match.group(1).strip()
-                    instance_id = match.group(2).strip()
-                    description = ""
-                else:
-                    # Skipping lines that don't match the format
-                    continue
-            else:
-                # Extract the name, instance ID, and description
-                name = match.group(1).strip()
-                instance_id = match.group(2).strip()
-                description = match.group(3).strip()
+        devices = []
+        for item in cls._as_list(data.get("Devices")):
+            name = item.get("FriendlyName") or ""
+            instance_id = item.get("InstanceId") or ""
+            description = item.get("Description") or ""
 
-            # EXTRACT MAC ADDRESS FROM INSTANCE ID WITH REGEX
+            # Skip the non-device items (these are not actual devices)
+            # e.g. 'Microsoft Bluetooth Enumerator' or 'BTH\MS_RFCOMM\...'
+            if any(keyword in field for keyword in cls.NON_DEVICE_KEYWORDS for field in (name, instance_id, description)):
+                continue
+
+            # EXTRACT MAC ADDRESS FROM INSTANCE ID
             # (MAC stands for Media Access Control. The MAC address is needed to connect to the device)
-            # The PowerShell command would not directly provide the MAC address since this is for external paired devices.
-            # So the MAC address is extracted from the device's instance ID.
-            mac_match = re.search(r'([0-9A-F]{12})', instance_id, re.I)
-            if mac_match:
-                mac_raw = mac_match.group(1).upper()
-                mac_address = ':'.join(mac_raw[i:i+2] for i in range(0, 12, 2))
-
-                # Add the device's details to the list
-                devices.append((name, mac_address, description))
-        
-        # Return the list of paired Bluetooth devices
+            # The PowerShell command does not directly provide the MAC address for external paired devices.
+            # So the MAC address is extracted from the device's instance ID (the identifier assigned by Windows)
+            # e.g. 'BTHENUM\DEV_001A7DDA7113\7&2A5C0B1E&0&BLUETOOTHDEVICE_001A7DDA7113'
+            # Prefer the 'DEV_' part, so a service UUID in the instance ID is not mistaken for the address
+            mac_match = re.search(r'DEV_([0-9A-F]{12})', instance_id, re.I) or re.search(r'([0-9A-F]{12})', instance_id, re.I)
+            if not mac_match:
+                continue
+            devices.append(BluetoothDevice(name, cls.format_mac_address(mac_match.group(1)), description))
+
+        return DiscoveryResult(adapters, devices)
+
+    @staticmethod
+    def _as_list(value):
+        """ Returns `value` as a list of dicts (ConvertTo-Json may turn a list with one item into the item itself). """
+        if value is None:
+            return []
+        if isinstance(value, dict):
+            return [value]
+        return [item for item in value if isinstance(item, dict)]
+
+
+class BlueZBackend(DiscoveryBackend):
+    """ Linux backend. Reads the state of BlueZ (the Linux Bluetooth stack) from files.
+
+    The adapters are the hci devices in sysfs (/sys/class/bluetooth).
+    Their address is read from sysfs, or from the org.bluez.Adapter1 Address property on D-Bus
+    on kernels without the sysfs attribute (one busctl call per adapter, the first time only).
+    The paired devices are the ones with a key stored by bluetoothd (/var/lib/bluetooth/<adapter>/<device>/info).
+    Reading /var/lib/bluetooth usually requires root, no devices are found otherwise.
+    """
+    name = "bluez"
+
+    # Reading the files takes microseconds (the addresses from D-Bus are kept by the backend), no need to cache them
+    cached = False
+
+    # Default locations of the BlueZ state
+    SYSFS_PATH = "/sys/class/bluetooth"
+    STORAGE_PATH = "/var/lib/bluetooth"
+
+    # Sections of the info file written by bluetoothd when a device is paired
+    # (LinkKey for Bluetooth Classic, the others for Bluetooth Low Energy)
+    PAIRING_SECTIONS = ("LinkKey", "LongTermKey", "PeripheralLongTermKey", "SlaveLongTermKey")
+
+    # Major device classes (bits 8-12 of the Class of Device), used as the device description
+    MAJOR_DEVICE_CLASSES = {
+        1: "Computer",
+        2: "Phone",
+        3: "Network Access Point",
+        4: "Audio/Video",
+        5: "Peripheral",
+        6: "Imaging",
+        7: "Wearable",
+        8: "Toy",
+        9: "Health",
+    }
+
+    # Command that prints the address of an adapter, from bluetoothd over D-Bus (e.g. 's "AA:BB:CC:DD:EE:FF"')
+    BUS_ADDRESS_COMMAND = ["busctl", "--system", "get-property", "org.bluez", "/org/bluez/{hci_device}", "org.bluez.Adapter1", "Address"]
+    BUS_TIMEOUT = 2.0   # [sec]
+
+    def __init__(self, sysfs_path: str = None, storage_path: str = None, query_bus_address = None):
+        """ Initializes the BlueZBackend class.
+
+        Parameters
+        ----------
+        sysfs_path : str
+            Directory with the hci devices, defaults to SYSFS_PATH.
+        storage_path : str
+            Directory with the bluetoothd storage, defaults to STORAGE_PATH.
+        query_bus_address : callable
+            Function that returns the address of an hci device (e.g. 'hci0') from bluetoothd,
+            or an empty string if it is not known. Defaults to query_bus_address().
+
+        Returns
+        -------
+        None
+        """
+        self.sysfs_path = sysfs_path if sysfs_path else self.SYSFS_PATH
+        self.storage_path = storage_path if storage_path else self.STORAGE_PATH
+        self.query_bus_address = query_bus_address if query_bus_address else self._query_bus_address
+
+        # Addresses found on D-Bus {hci device: address}, an adapter keeps its address
+        self._bus_addresses = {}
+
+    def discover(self):
+        """ Retrieves the local Bluetooth adapters and the devices paired to them.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        DiscoveryResult
+            The adapters and paired devices.
+        """
+        adapters = self._read_adapters()
+
+        devices = []
+        for adapter in adapters:
+            if adapter.address:
+                devices.extend(self._read_paired_devices(adapter.address))
+        return DiscoveryResult(adapters, devices)
+
+    def _read_adapters(self):
+        """ Lists the adapters present in sysfs.
+
+        The address of each adapter is read from its 'address' attribute, or asked to bluetoothd if there is none.
+        If neither knows it, the adapter is listed with an empty address ("unknown address" in its description).
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list
+            A list of BluetoothDevice tuples containing the name, MAC address, and description of each adapter.
+        """
+        try:
+            entries = os.listdir(self.sysfs_path)
+        except OSError:
+            return []
+
+        # Skip the connections, listed as e.g. 'hci0:11'
+        hci_devices = sorted((entry for entry in entries if entry.startswith("hci") and ":" not in entry),
+                             key=lambda entry: int(entry[3:]) if entry[3:].isdigit() else 0)
+
+        adapters = []
+        for hci_device in hci_devices:
+            address = self.format_mac_address(self._read_file(os.path.join(self.sysfs_path, hci_device, "address")))
+            if not address:
+                address = self._get_bus_address(hci_device)
+
+            sysfs_name = self._read_file(os.path.join(self.sysfs_path, hci_device, "name")) or hci_device
+            if not address:
+                adapters.append(BluetoothDevice(sysfs_name, "", f"Bluetooth adapter ({hci_device}, unknown address)"))
+                continue
+
+            # Use the name set in bluetoothd (e.g. 'Boccia Main Device') if there is one
+            _, settings = self._read_info(os.path.join(self.storage_path, address, "settings"))
+            name = settings.get("Alias") or sysfs_name
+            adapters.append(BluetoothDevice(name, address, f"Bluetooth adapter ({hci_device})"))
+
+        return adapters
+
+    def _read_paired_devices(self, adapter_address: str):
+        """ Lists the devices paired to an adapter, from the bluetoothd storage.
+
+        Parameters
+        ----------
+        adapter_address : str
+            MAC address of the adapter.
+
+        Returns
+        -------
+        list
+            A list of BluetoothDevice tuples containing the name, MAC address, and description of each paired device.
+        """
+        adapter_path = os.path.join(self.storage_path, adapter_address)
+        try:
+            entries = sorted(os.listdir(adapter_path))
+        except OSError:
+            # No storage for this adapter, or no permission to read it
+            return []
+
+        devices = []
+        for entry in entries:
+            # Each device has a directory named after its address, next to e.g. 'settings' and 'cache'
+            address = self.format_mac_address(entry)
+            if not address:
+                continue
+
+            sections, info = self._read_info(os.path.join(adapter_path, entry, "info"))
+            if sections.isdisjoint(self.PAIRING_SECTIONS):
+                continue
+
+            name = info.get("Alias") or info.get("Name") or address
+            devices.append(BluetoothDevice(name, address, self._describe_device_class(info.get("Class", ""))))
+
         return devices
 
+    def _get_bus_address(self, hci_device: str):
+        """ Returns the address of an hci device from bluetoothd, cached once it is known. """
+        address = self._bus_addresses.get(hci_device)
+        if not address:
+            address = self.format_mac_address(self.query_bus_address(hci_device))
+            if address:
+                self._bus_addresses[hci_device] = address
+        return address
+
+    @classmethod
+    def _query_bus_address(cls, hci_device: str):
+        """ Returns the org.bluez.Adapter1 Address property of an hci device, or an empty string
+        if it cannot be read (e.g. no busctl, or bluetoothd is not running).
+        """
+        cmd = [part.format(hci_device=hci_device) for part in cls.BUS_ADDRESS_COMMAND]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=cls.BUS_TIMEOUT)
+        except (OSError, subprocess.SubprocessError):
+            return ""
+        # e.g. 's "AA:BB:CC:DD:EE:FF"'
+        match = re.search(r'"([^"]*)"', result.stdout)
+        return match.group(1) if (result.returncode == 0 and match) else ""
+
+    def _describe_device_class(self, device_class: str):
+        """ Returns the major class of a Class of Device (e.g. '0x5a020c' is a 'Phone'). """
+        try:
+            major_class = (int(device_class, 16) >> 8) & 0x1F
+        except ValueError:
+            major_class = None
+        return self.MAJOR_DEVICE_CLASSES.get(major_class, "Bluetooth Device")
+
+    @staticmethod
+    def _read_file(path: str):
+        """ Returns the stripped content of a text file, or an empty string if it cannot be read. """
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                return f.read().strip()
+        except OSError:
+            return ""
+
+    @staticmethod
+    def _read_info(path: str):
+        """ Reads an INI file written by bluetoothd (e.g. 'info' or 'settings').
+        Only the names of the sections and the keys of the [General] section are needed,
+        this is much faster than configparser (there is one file per device).
+
+        Parameters
+        ----------
+        path : str
+            Path of the file.
+
+        Returns
+        -------
+        tuple
+            The set of section names, and a dict with the [General] keys.
+            Both are empty if the file cannot be read.
+        """
+        sections = set()
+        general = {}
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                section = None
+                for line in f:
+                    line = line.strip()
+                    if line.startswith("[") and line.endswith("]"):
+                        section = line[1:-1]
+                        sections.add(section)
+                    elif section == "General" and "=" in line:
+                        key, value = line.split("=", 1)
+                        general[key.strip()] = value.strip()
+        except OSError:
+            pass
+        return sections, general
+
+DISCOVERY_BACKENDS = {backend.name: backend for backend in (PowerShellBackend, BlueZBackend)}
+
+def get_discovery_backend(name: str = None):
+    """ Creates the discovery backend selected by `name`.
+
+    Parameters
+    ----------
+    name : str
+        Name of the backend ("powershell" or "bluez"), or "auto" to select it from the platform.
+        Defaults to the backend set in Commands.BLUETOOTH_VARIABLES.
+
+    Returns
+    -------
+    DiscoveryBackend
+        Instance of the selected backend.
+    """
+    if name is None:
+        name = Commands.BLUETOOTH_VARIABLES["discovery_backend"]
+    if name == "auto":
+        name = "bluez" if sys.platform.startswith("linux") else "powershell"
+    return DISCOVERY_BACKENDS[name]()
+
+
+class BluetoothDevices:
+    """ Class that handles Bluetooth device operations.
+    Supports the BluetoothClient and BluetoothServer classes.
+    Contains methods to get paired Bluetooth devices and the local Bluetooth adapters.
+
+    Both are retrieved by a DiscoveryBackend (PowerShell on Windows, BlueZ on Linux).
+    The results of the slow backends are cached and refreshed in the background when stale (see DiscoveryCache),
+    the cache is shared by all the instances.
+    """
+    # Shared by all the instances, so the server and the clients reuse the same results
+    cache = DiscoveryCache(Commands.BLUETOOTH_VARIABLES["discovery_cache_ttl"])
+
+    def __init__(self, backend: DiscoveryBackend = None):
+        """ Initializes the BluetoothDevices class.
+
+        Parameters
+        ----------
+        backend : DiscoveryBackend
+            Backend used to find the adapters and paired devices.
+            Defaults to the backend set in Commands.BLUETOOTH_VARIABLES.
+
+        Returns
+        -------
+        None
+        """
+        self.backend = backend if backend else get_discovery_backend()
+
+    def get_paired_bluetooth_devices(self):
+        """ Retrieves a list of devices currently paired via Bluetooth to this device.
+        Returns the cached list if available.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list
+            A list of BluetoothDevice tuples containing the name, MAC address, and description of each paired device.
+        """
+        return list(self._discover().devices)
+
     def get_local_bluetooth_adapter(self):
         """ Retrieves the Bluetooth adapter on the local device.
-
-        Adapter(s) are retrieved using a PowerShell command.
-        The output is parsed to extract the name, MAC address, and description of each adapter.
+        Returns the cached adapter if available.
 
         Should return a list containing only 1 item: the Bluetooth adapter of the local device.
 
@@ -114,50 +670,39 @@ class BluetoothDevices:
         Returns
         -------
         list
-            A list of tuples containing the name, MAC address, and description of each adapter.
-        """
-        # RUN POWERSHELL COMMAND
-        # Default path to Windows PowerShell
-        powershell_path = "C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe"
-        
-        # PowerShell command to get local Bluetooth adapters
-        cmd = [
-            powershell_path,
-            "-Command",
-            "Get-NetAdapter | Where-Object { $_.InterfaceDescription -like '*Bluetooth*' } | Select-Object Name, MacAddress, InterfaceDescription"
-        ]
-
-        # Run the command and store the output
-        result = subprocess.run(cmd, capture_output=True, text=True, creationflags=CREATE_NO_WINDOW)
-        output = result.stdout
-
-        local_adapters = [] # Stores the local adapter
-
-        # PARSE OUTPUT
-        # Parses the output by iterating through each line
-        for line in output.splitlines():
-            # Skipping column headers and empty lines
-            if "Name" in line or "MacAddress" in line or "InterfaceDescription" in line or not line.strip():
-                continue
+            A list of BluetoothDevice tuples containing the name, MAC address, and description of each adapter.
+        """
+        return list(self._discover().adapters)
 
-            # EXTRACT ADAPTER DETAILS WITH REGEX
-            # The line should contain 3 columns separated by 2 or more spaces
-            # The first column is the adapter name, the second is the MAC address, and the third is the adapter description
-            # (MAC stands for Media Access Control. The MAC address is needed to connect to the device)
-            # Use regex to extract adapter details
-            match = re.match(r'^(.*?)\s+([0-9A-F:-]{17})\s+(.*)$', line.strip())
-            if match:
-                # Extract the adapter name, MAC address, and description
-                name = match.group(1).strip() 
-                mac = match.group(2).strip().replace("-", ":") # Format the MAC address with colons
-                desc = match.group(3).strip() 
-
-                # Skip Ethernet adapters
-                if "Ethernet" in name:
-                    continue
-
-                # Add the adapter's details to the list
-                local_adapters.append((name, mac, desc))
-        
-        # Return the local adapter
-        return local_adapters 
\ No newline at end of file
+    def prefetch(self):
+        """ Starts probing the paired devices and the local adapter in the background.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        if self.backend.cached:
+            self.cache.prefetch(self.backend.name, self.backend.discover)
+
+    def invalidate_cache(self):
+        """ Discards the cached devices and adapter, e.g. after a device was paired or an adapter was plugged in.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        self.cache.invalidate(self.backend.name)
+
+    def _discover(self):
+        """ Returns the adapters and paired devices, from the cache if the backend is slow. """
+        if self.backend.cached:
+            return self.cache.get(self.backend.name, self.backend.discover)
+        return self.backend.discover()
@@ -1,4 +1,6 @@
 # Standard libraries
+import time
+from collections import deque
 from PyQt5.QtCore import Qt, QTimer
 
 class Commands():
@@ -14,6 +16,48 @@ class Commands():
         "Elevation - auto": "ec1",
         }
 
+    # Calibrations and routines run step by step by MacroRunner when MACRO_VARIABLES["enabled"], see macro_engine.py
+    # Steps: ("send", command), ("wait", [sec]), ("wait_for", line pattern (regular expression), timeout [sec])
+    # The lines waited for are the ones of the ramp simulator, the firmware may not send them
+    CALIBRATION_MACROS = {
+        "Full": (
+            ("send", "dd-70"),
+            ("wait_for", "^Drop complete", 15.0),
+            ("send", "rc"),
+            ("wait_for", "^Rotation calibration complete", 30.0),
+            ("send", "ec"),
+            ("wait_for", "^Elevation calibration complete", 30.0),
+            ),
+        "Drop": (
+            ("send", "dd-70"),
+            ("wait_for", "^Drop complete", 15.0),
+            ),
+        "Rotation": (
+            ("send", "rc0"),
+            ("wait_for", "^Rotation calibration complete", 30.0),
+            ),
+        "Elevation - manual": (
+            ("send", "ec0"),
+            ("wait_for", "^Elevation calibration complete", 120.0),
+            ),
+        "Elevation - auto": (
+            ("send", "ec1"),
+            ("wait_for", "^Elevation calibration complete", 30.0),
+            ),
+        # Pre-match warm-up: move each axis both ways for a second (each toggle command starts, then stops the motor)
+        "Warm-up": (
+            ("send", "rs1"), ("wait", 1.0), ("send", "rs1"), ("wait_for", "^Rotation (stopped|limit)", 2.0),
+            ("send", "rs0"), ("wait", 1.0), ("send", "rs0"), ("wait_for", "^Rotation (stopped|limit)", 2.0),
+            ("send", "es1"), ("wait", 1.0), ("send", "es1"), ("wait_for", "^Elevation (stopped|limit)", 2.0),
+            ("send", "es0"), ("wait", 1.0), ("send", "es0"), ("wait_for", "^Elevation (stopped|limit)", 2.0),
+            ),
+        }
+
+    MACRO_VARIABLES = {
+        "enabled": False,   # Run the calibrations of CALIBRATION_MACROS step by step, instead of sending CALIBRATION_COMMANDS
+        "error_pattern": "^Unknown command",    # Lines from the ramp that stop the running macro
+    }
+
     HOLD_COMMANDS = {
         Qt.Key_A: "rs0",    # Rotation Left
         Qt.Key_D: "rs1",    # Rotation Right
@@ -44,7 +88,7 @@ class Commands():
 
     # Min and max number of players for multiplayer mode
     MIN_MULTIPLAYERS = 2
-    MAX_MULTIPLAYERS = 4
+    MAX_MULTIPLAYERS = 13
 
     BLUETOOTH_VARIABLES = {
         "RFCOMM_channel": 4,
@@ -52,30 +96,113 @@ class Commands():
         "data_format": "utf-8",
         "disconnect_command": "Disconnect",
         "max_clients_message": "Max clients reached",
+        "message_delimiter": "\n",  # Marks the end of each message sent over Bluetooth
+        "ping_message": "Ping",
+        "pong_message": "Pong",
+        "heartbeat_interval": 1.0,  # [sec] Time between pings on each link
+        "degraded_latency": 0.15,   # [sec] Round-trip time above which a link is shown as slow
+        "link_timeout": 5.0,        # [sec] Pings not answered within this time are counted as lost
+        "rtt_window": 60,           # Number of round-trip times kept for the statistics
+        "reconnect_initial_delay": 0.5, # [sec] Wait before the first reconnection attempt, doubles with each attempt
+        "reconnect_max_delay": 5.0,     # [sec] Max wait between reconnection attempts
+        "reconnect_jitter": 0.2,        # Random fraction added or removed from each wait
+        "reconnect_max_attempts": 0,    # Attempts before giving up, 0 to keep trying until the player disconnects
+        "reconnect_buffer_size": 8,     # Max number of toggle commands kept while reconnecting
+        "reconnect_buffer_ttl": 2.0,    # [sec] Buffered commands older than this are discarded
+        "reconnect_buffer_policy": "replay",    # "replay" or "discard" the buffered commands after reconnecting
+        "discovery_backend": "auto",        # "powershell" (Windows), "bluez" (Linux) or "auto" to select it from the platform
+        "discovery_cache_ttl": 60.0,        # [sec] Paired devices and adapter older than this are probed again
+    }
+
+    # Socket type used for multiplayer mode, see transports.py
+    TRANSPORT_VARIABLES = {
+        "transport": "rfcomm",                      # "rfcomm" (Bluetooth), "tcp" or "unix"
+        "tcp_port": 5050,
+        "tcp_bind_host": "127.0.0.1",               # Interface the main device listens on, e.g. "0.0.0.0" for all (no authentication, trusted networks only)
+        "tcp_server_host": "127.0.0.1",             # Address of the main device, for the secondary devices
+        "unix_socket_path": "/tmp/boccia-t2s.sock",
+    }
+
+    SERIAL_VARIABLES = {
+        "write_timeout": 0.5,       # [sec] Max time a single write can block the writer thread
+        "command_queue_size": 32,   # Max number of commands waiting to be written
+        "read_timeout": 0.2,        # [sec] Max time the reader waits for data before checking if it should stop
+        "max_line_length": 4096,    # [chars] Partial lines longer than this are flushed as they are
+        "batch_interval": 0.05,     # [sec] Max time a received line waits before its batch is emitted
+        "batch_max_lines": 50,      # Max number of lines in a batch before it is emitted
+        "max_pending_lines": 2000,  # Max number of lines waiting for the GUI, older lines are dropped
+        "max_log_lines": 5000,      # Max number of lines kept in the serial read window
+        "port_poll_interval": 1.0,  # [sec] Time between scans of the serial ports, if hotplug events are not available
+        "port_settle_delay": 0.5,   # [sec] Wait after a hotplug event before scanning, so the port can be opened
+        "port_rescan_interval": 10.0,   # [sec] Time between scans of the serial ports, if hotplug events are available
+    }
+
+    # Acknowledged commands, see SerialHandler (the firmware has to answer each command with "ACK <sequence number>")
+    ACK_VARIABLES = {
+        "enabled": False,           # Send each command as "<sequence number>:<command>" and wait for its ack
+        "ack_prefix": "ACK ",       # Start of the ack lines, followed by the sequence number
+        "timeout": 0.25,            # [sec] Time after the write before a command without ack is sent again or reported lost
+        "max_retries": 2,           # Max number of times an idempotent command is sent again
+        "idempotent_commands": ("rx", "ex"),    # Start of the commands that can be sent again (speed settings, not toggles or drops)
+        "max_sequence_number": 65535,   # Sequence numbers go from 1 to this and wrap around
+    }
+
+    # Binary record of the commands and serial lines of each session, see session_trace.py
+    TRACE_VARIABLES = {
+        "enabled": True,
+        "directory": "~/.boccia-gui/sessions",  # One trace file per day, e.g. 2024-05-14.trace
+        "retention_days": 30,       # [days] Traces older than this are deleted when the app starts, 0 to keep all of them
+        "buffer_size": 65536,       # [bytes] Records are kept in memory until the buffer is full or flushed
+        "flush_interval": 1.0,      # [sec] Max time a record waits before it is written to disk
+        "max_strings": 1024,        # Max distinct commands and serial lines per trace file, the others are recorded as "<other>"
+    }
+
+    # Latency of each stage of the command pipeline, see pipeline_tracing.py
+    PIPELINE_TRACING_VARIABLES = {
+        "environment_variable": "BOCCIA_TRACE",     # Set to 1 to switch the tracing on
+        "command_line_flag": "--trace",             # Or start the app with this flag
+        "histogram_max": 60.0,      # [sec] Latencies above this are counted in the last bucket
+        "sub_bucket_bits": 5,       # Precision of the histogram buckets, 5 bits is within 3.1%
     }
     
+    # End of the drop delay, see Commands.handle_serial_lines()
+    DROP_VARIABLES = {
+        "wait_for_ramp": True,      # End the drop delay when the ramp reports the drop is complete
+        # Lines from the ramp that end the drop delay. Only the drop-specific line: a bare "Ready" follows any
+        # finished task (or a reset) and would end the delay early. The text is the ramp simulator's and is assumed,
+        # not confirmed against the firmware; the safety timeout ends the delay if the ramp never sends it.
+        "complete_lines": ("Drop complete",),
+        "safety_timeout": 15.0,     # [sec] Max drop delay, if the ramp does not report the drop is complete
+        "adaptive_timeout": True,   # Shorten the safety timeout to the drop durations observed
+        "timeout_margin": 2.0,      # The adaptive timeout is this times the longest recent drop
+        "min_timeout": 4.0,         # [sec] Shortest adaptive timeout
+        "min_samples": 5,           # Number of drops observed before the timeout adapts
+        "history_size": 20,         # Number of recent drop durations kept
+    }
+
     HELP_URL = "https://github.com/kirtonBCIlab/Boccia-T2S-controller/wiki"
     
     def __init__(self):
         
         self.timer = None # Timer for the drop delay
-        self.drop_delay = 15000 # [msec]
-        self.drop_delay_active = None
+        self.drop_delay = int(1000 * self.DROP_VARIABLES["safety_timeout"]) # [msec] Safety timeout of the drop delay
+        self.drop_delay_scheduler = None # Function(delay [msec], callback) used instead of a QTimer, e.g. a replay's virtual clock
 
-        self.user_controls_widget = None
-        self.key_press_handler = None
-        self.operator_controls_widget = None
+        self.drop_durations = deque(maxlen=self.DROP_VARIABLES["history_size"])  # [sec] Time the recent drops took, until the ramp reported them complete
+        self.drop_timeouts = 0          # Number of drop delays ended by the timeout instead of the ramp
+        self._drop_start_time = None    # Time the current drop delay started
+        self._drop_id = 0               # Number of the current drop, so the timeout of an earlier drop is ignored
 
-        self.toggle_command_active = False
+        self.control_state = None   # ControlState of the main device, owns the drop delay state
 
-    def set_user_controls_widget(self, user_controls_widget):
-        self.user_controls_widget = user_controls_widget
+    def set_control_state(self, control_state):
+        self.control_state = control_state
+        self.control_state.subscribe(self._handle_control_state_change)
 
-    def set_key_press_handler(self, key_press_handler):
-        self.key_press_handler = key_press_handler
-
-    def set_operator_controls_widget(self, operator_controls_widget):
-        self.operator_controls_widget = operator_controls_widget
+    def _handle_control_state_change(self, state):
+        """ Start the drop delay timer when a drop starts the drop delay """
+        if state.drop_delay_active and not (self.timer and self.timer.isActive()):
+            self.drop_delay_timer()
 
     def drop_delay_timer(self):
         
@@ -83,25 +210,69 @@ class Commands():
         if self.timer:
             self.timer.stop()
 
-        # Disable user control buttons
-        self.drop_delay_active = True # Set the flag
+        self._drop_start_time = time.monotonic()
+        self._drop_id += 1
+        drop_id = self._drop_id
+        timeout = self.get_drop_timeout()
+
+        # Let the scheduler end the drop delay, if there is one
+        if self.drop_delay_scheduler:
+            self.drop_delay_scheduler(timeout, lambda: self.timer_over(drop_id))
+            return
 
-        # Start the timer
+        # Start the timer, the safety timeout in case the ramp does not report the drop is complete
         self.timer = QTimer()
         self.timer.setSingleShot(True)
-        self.timer.timeout.connect(lambda: self.timer_over())
-        self.timer.start(self.drop_delay)
+        self.timer.timeout.connect(lambda: self.timer_over(drop_id))
+        self.timer.start(timeout)
         #print("Drop delay timer started")
 
-    def timer_over(self):
+    def timer_over(self, drop_id = None):
+        # Ignore the timeout of an earlier drop (e.g. still scheduled on a replay's virtual clock)
+        if (drop_id is not None) and (drop_id != self._drop_id):
+            return
+
         #print("\nDrop delay over")
-        self.drop_delay_active = False # Reset the drop delay flag
-        self.key_press_handler.reset_flags()
-        self.user_controls_widget._reset_buttons_and_flags()
-        self.operator_controls_widget._reset_buttons_and_flag()
+        if self.control_state.end_drop_delay(): # The subscribers re-enable the controls
+            self.drop_timeouts += 1
+
+    def handle_serial_lines(self, lines: list):
+        """ End the drop delay as soon as the ramp reports the drop is complete (lines from SerialHandler.new_data_batch) """
+        if not (self.DROP_VARIABLES["wait_for_ramp"] and self.control_state and self.control_state.drop_delay_active):
+            return
+        if not any(line.strip() in self.DROP_VARIABLES["complete_lines"] for line in lines):
+            return
+
+        self.drop_durations.append(time.monotonic() - self._drop_start_time)
+        if self.timer:
+            self.timer.stop()
+        self.control_state.end_drop_delay() # The subscribers re-enable the controls
+
+    def get_drop_timeout(self):
+        """ Return the timeout of the drop delay [msec]: the safety timeout, shortened to the longest recent drop
+        (times the timeout margin) once enough drops were reported complete by the ramp
+        """
+        timeout = self.drop_delay
+        variables = self.DROP_VARIABLES
+        if variables["wait_for_ramp"] and variables["adaptive_timeout"] and (len(self.drop_durations) >= variables["min_samples"]):
+            adaptive_timeout = max(variables["min_timeout"], variables["timeout_margin"] * max(self.drop_durations))
+            timeout = min(timeout, int(1000 * adaptive_timeout))
+        return timeout
+
+    def get_drop_stats(self):
+        """ Return the number of recent drops reported complete by the ramp, their last and longest duration [sec],
+        the number of drop delays ended by the timeout, and the current timeout [sec]
+        """
+        return {
+            "count": len(self.drop_durations),
+            "last": self.drop_durations[-1] if self.drop_durations else None,
+            "max": max(self.drop_durations) if self.drop_durations else None,
+            "timeouts": self.drop_timeouts,
+            "timeout": self.get_drop_timeout() / 1000,
+            }
 
     def get_drop_delay_active(self):
-        return self.drop_delay_active
+        return self.control_state.drop_delay_active
 
     def get_key_from_hold_command(self, command):
         for key, value in self.HOLD_COMMANDS.items():
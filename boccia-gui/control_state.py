@@ -0,0 +1,151 @@
+# Import libraries
+from pipeline_tracing import tracer
+
+class ControlState():
+    """ Single source of truth for the controls of the ramp on the main device.
+
+    Owns the service state (which command is running and what started it), the current player
+    and the drop delay state. The keyboard, the buttons and the multiplayer devices change it
+    only through the transition methods, which send the command and then notify the subscribers
+    once per transition.
+
+    It does not depend on Qt, so the state can be checked (and tested) without a GUI.
+
+    Modes:
+        - IDLE: No command is running, any command can start.
+        - HOLD: An operator command is running (held key or operator button), until it is stopped.
+        - TOGGLE: A user command is running (key, button or multiplayer device), until it is stopped.
+        - DROP: A drop was sent, nothing can start until the drop delay is over.
+    """
+    IDLE = "idle"
+    HOLD = "hold"
+    TOGGLE = "toggle"
+    DROP = "drop"
+
+    def __init__(self, send_command = None):
+        """ Initializes the ControlState class.
+
+        Parameters
+        ----------
+        send_command : callable
+            Function called with each command of an accepted transition (e.g. SerialHandler.send_command).
+
+        Returns
+        -------
+        None
+
+        Attributes
+        ----------
+        mode : str
+            Current mode (IDLE, HOLD, TOGGLE or DROP).
+        active_command : str
+            Command that is running, None when idle.
+        active_key : int
+            Key that started the running command, None if it was started by a button.
+        active_button : str
+            Text of the button that started the running command, None if it was started by a key.
+        current_player : str
+            Player that started the running toggle command (e.g. "Player 1").
+        drop_delay_active : bool
+            Whether the ramp is waiting for the drop delay to be over.
+        transitions : int
+            Number of accepted transitions.
+        """
+        self._send_command = send_command
+        self._subscribers = []
+
+        self.mode = self.IDLE
+        self.active_command = None
+        self.active_key = None
+        self.active_button = None
+        self.current_player = None
+        self.drop_delay_active = False
+        self.transitions = 0
+
+    @property
+    def service_active(self):
+        """ True if a command is running (i.e. nothing else can start). """
+        return self.mode != self.IDLE
+
+    def subscribe(self, callback):
+        """ Registers a function called with this ControlState after every transition.
+
+        Parameters
+        ----------
+        callback : callable
+            Function that receives the ControlState.
+
+        Returns
+        -------
+        None
+        """
+        self._subscribers.append(callback)
+
+    def is_button_active(self, button_text: str):
+        """ Returns True if the running command was started by the button with `button_text`
+        (i.e. that button has to stay enabled to stop it).
+        """
+        return self.mode in (self.HOLD, self.TOGGLE) and self.active_button == button_text
+
+    # TRANSITIONS
+    # Each method returns True if the transition was accepted (and the command was sent)
+    def start_hold(self, command: str, key: int = None, button: str = None):
+        """ IDLE -> HOLD: Starts an operator command, from a held key or an operator button. """
+        if self.service_active:
+            return False
+        return self._transition(command, mode=self.HOLD, active_command=command, active_key=key, active_button=button)
+
+    def stop_hold(self, key: int = None, button: str = None):
+        """ HOLD -> IDLE: Stops the operator command, from the same key or button that started it. """
+        if self.mode != self.HOLD or (key, button) != (self.active_key, self.active_button):
+            return False
+        return self._transition(self.active_command, **self._idle_fields())
+
+    def start_toggle(self, command: str, player: str, key: int = None, button: str = None):
+        """ IDLE -> TOGGLE: Starts a user command, from a key, a button or a multiplayer device. """
+        if self.service_active:
+            return False
+        return self._transition(command, mode=self.TOGGLE, active_command=command, active_key=key,
+                                active_button=button, current_player=player)
+
+    def stop_toggle(self, player: str, key: int = None, button: str = None):
+        """ TOGGLE -> IDLE: Stops the user command, from the same player and key or button that started it. """
+        if self.mode != self.TOGGLE or (key, button) != (self.active_key, self.active_button):
+            return False
+        if player != self.current_player:
+            return False
+        return self._transition(self.active_command, **self._idle_fields())
+
+    def start_drop(self, command: str, player: str, key: int = None, button: str = None):
+        """ IDLE -> DROP: Drops the ball and starts the drop delay. """
+        if self.service_active:
+            return False
+        return self._transition(command, mode=self.DROP, active_command=command, active_key=key,
+                                active_button=button, current_player=player, drop_delay_active=True)
+
+    def end_drop_delay(self):
+        """ DROP -> IDLE: The drop delay is over, the controls are available again. No command is sent. """
+        if not self.drop_delay_active:
+            return False
+        return self._transition(None, **self._idle_fields())
+
+    def _idle_fields(self):
+        """ Returns the fields of the IDLE mode (the current player is kept). """
+        return dict(mode=self.IDLE, active_command=None, active_key=None, active_button=None, drop_delay_active=False)
+
+    def _transition(self, command: str, **fields):
+        """ Sends `command` (if any), applies `fields` and notifies the subscribers once. """
+        if tracer.enabled:
+            tracer.decided()
+
+        # Send first, so the command is not delayed by the subscribers (e.g. the GUI)
+        if command is not None and self._send_command is not None:
+            self._send_command(command)
+
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.transitions += 1
+
+        for callback in self._subscribers:
+            callback(self)
+        return True
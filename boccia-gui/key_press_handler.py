@@ -1,42 +1,37 @@
 # Default libraries
-from PyQt5.QtCore import QObject, Qt, pyqtSignal
+from PyQt5.QtCore import QObject, Qt
 
 # Custom libraries
 from commands import Commands
+from session_trace import KEY, KEY_RELEASE
+from pipeline_tracing import tracer
 
 class KeyPressHandler(QObject):
-    key_service_flag_changed = pyqtSignal(bool)
-
-    def __init__(self, parent=None, serial_handler = None, commands = None):
+    def __init__(self, parent=None, control_state = None, commands = None, trace = None):
         super().__init__()
         self.parent = parent
-        self.serial_handler = serial_handler
+        self.control_state = control_state  # Sends the commands and keeps the service state
         self.commands = commands
-
-        self.key_pressed = None # Store the key pressed for hold commands
-        self.key_toggled = None # Store the key pressed for toggle commands
-
-        self.service_flag = False
-
-        self.current_player = None
-
-        self.key_action_map = {}
-        self.mapKeys()
-
-    def mapKeys(self):
-        for index, key in enumerate(Commands.TOGGLE_COMMANDS.keys()):
-            self.key_action_map[key] = index + 1
+        self.trace = trace  # SessionTraceRecorder for the key presses, or None
 
     def eventFilter(self, obj, event):
         if event.type() == event.KeyPress:
+            # The help key is not a command, it is handled before the trace starts so no span is left open
             if event.key() == Qt.Key_F1:
                 self.parent.serial_controls_widget.open_help_url()
                 return True
-            else:
-                self.keyPressEvent(event)
+            if tracer.enabled:
+                tracer.begin()
+            self.keyPressEvent(event)
+            if tracer.enabled:
+                tracer.end()
             return True
         elif event.type() == event.KeyRelease:
+            if tracer.enabled:
+                tracer.begin()
             self.keyReleaseEvent(event)
+            if tracer.enabled:
+                tracer.end()
             return True
         
         return super().eventFilter(obj, event)
@@ -49,11 +44,15 @@ class KeyPressHandler(QObject):
             if (key in Commands.HOLD_COMMANDS):
                 # Get the command
                 command = Commands.HOLD_COMMANDS[key]
+                if self.trace:
+                    self.trace.record(KEY, command)
                 self.hold_key_pressed(command, key)
 
             elif (key in Commands.TOGGLE_COMMANDS):
                 # Get the command
                 command = Commands.TOGGLE_COMMANDS[key]
+                if self.trace:
+                    self.trace.record(KEY, command, "Player 1")
                 self.toggle_key_pressed("Player 1", command, key)
                 
             event.accept()
@@ -64,17 +63,8 @@ class KeyPressHandler(QObject):
 
         # print(f"\nOperator key pressed: {key}")
 
-        # If service is active, return
-        if self.service_flag:
-            return
-        
-        # Otherwise, send the command
-        self.serial_handler.send_command(command)
-        self.key_pressed = key
-        # print(f"Start {command} command")
-
-        self.toggle_service_flag(True)
-        self.key_service_flag_changed.emit(True)
+        # Start the command, unless another command is running
+        self.control_state.start_hold(command, key=key)
 
     def toggle_key_pressed(self, player, command, key=None):
         if key == None:
@@ -82,67 +72,39 @@ class KeyPressHandler(QObject):
             
         # print(f"\nUser key pressed: {key}")
 
-        # If service is active
-        if self.service_flag & (key == self.key_toggled):
+        # If service is active, stop the command
+        # (Only if it was started with the same key by the same player, and the drop delay is not active)
+        if self.control_state.service_active:
+            self.control_state.stop_toggle(player, key=key)
 
-            # If Drop delay is active, return
-            if self.commands.get_drop_delay_active():
-                return
-            
-            # Return if the player is not the current player
-            if player != self.current_player:
-                return
-            
-            # Otherwise, send the command
-            self.serial_handler.send_command(command)
-            # print(f"Stop {command} command")
-
-            # Toggle the flag and set the current action
-            self.toggle_service_flag(False)
-            self.key_service_flag_changed.emit(False)
-            self.key_toggled = None
-            
-        # If service is not active
-        elif not self.service_flag:
-            # Send the command
-            self.serial_handler.send_command(command)
-            # print(f"Start {command} command")
+        # If Drop key was pressed, drop and start the drop delay
+        elif command == "dd-70":
+            self.control_state.start_drop(command, player, key=key)
 
-            # If Drop key was pressed, start the drop delay timer
-            if command == "dd-70":
-                self.commands.drop_delay_timer()
+        # Otherwise, start the command
+        else:
+            self.control_state.start_toggle(command, player, key=key)
 
-            # Toggle the flag and set the current action
-            self.toggle_service_flag(True)
-            self.key_service_flag_changed.emit(True)
-            self.key_toggled = key
+    def hold_key_released(self, command, key=None):
+        if key == None:
+            key = self.commands.get_key_from_hold_command(command)
 
-            # Set the current player
-            self.current_player = player
+        #print(f"Operator key released: {key}")
+
+        # Stop the command, if it was started with this key
+        self.control_state.stop_hold(key=key)
 
     def keyReleaseEvent(self, event):
         if not event.isAutoRepeat():
             key = event.key()
-            if (key in Commands.HOLD_COMMANDS) and (key == self.key_pressed):
-                #print(f"Operator key released: {key}")
+            if key in Commands.HOLD_COMMANDS:
                 command = Commands.HOLD_COMMANDS[key]
-                self.serial_handler.send_command(command)
-                self.key_pressed = None
-                #print(f"Stop {command} command")
-                
-                self.toggle_service_flag(False)
-                self.key_service_flag_changed.emit(False)
+                if self.trace:
+                    self.trace.record(KEY_RELEASE, command)
+                self.hold_key_released(command, key)
 
             event.accept()
 
-    def toggle_service_flag(self, flag):
-        self.service_flag = flag
-        # print(f"Key press service flag: {self.service_flag}")
-
-    def reset_flags(self):
-        self.service_flag = False
-        self.key_toggled = None
-
 class KeyPressHandlerMultiplayer(QObject):
     """ Class to handle key presses for the multiplayer devices.
 
@@ -0,0 +1,198 @@
+# Import libraries
+import re
+import time
+import threading
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from commands import Commands
+
+
+class MacroError(Exception):
+    """ A macro has an invalid step, or could not finish (e.g. the ramp did not answer in time). """
+
+
+class MacroRunner(QObject):
+    """ Runs macros: sequences of serial commands, waits and conditions on the lines from the ramp.
+
+    A macro is a sequence of steps (see Commands.CALIBRATION_MACROS):
+        - ("send", command): Sends the command.
+        - ("wait", seconds): Waits a fixed time.
+        - ("wait_for", pattern, timeout): Waits until a line received after the last command matches the
+          regular expression `pattern`. The macro fails if none does within `timeout` seconds.
+
+    The steps run on a thread of their own, off the GUI loop. The lines are received straight from the
+    reader thread of the SerialHandler (not the batches for the GUI), so each step starts as soon as the
+    ramp reports the previous one is done, with no fixed waits. A line that matches Commands.MACRO_VARIABLES["error_pattern"]
+    stops the macro.
+
+    Only one macro runs at a time. The signals are emitted from the macro thread (queued to the GUI).
+    """
+    # Events
+    started = pyqtSignal(str, int)              # Name and number of steps of the macro
+    progress = pyqtSignal(str, int, int, str)   # Name, step number (from 1), number of steps, and description of the step
+    finished = pyqtSignal(str, bool, str)       # Name, whether all the steps were done, and the reason if not
+
+    STEP_ARGUMENTS = {"send": 1, "wait": 1, "wait_for": 2}
+
+    def __init__(self, serial_handler = None):
+        """ Initializes the MacroRunner class.
+
+        Parameters
+        ----------
+        serial_handler : SerialHandler
+            Sends the commands and receives the lines from the ramp.
+
+        Returns
+        -------
+        None
+
+        Attributes
+        ----------
+        step_times : list
+            [sec] Duration of each step of the last macro [(description, duration)].
+        """
+        super().__init__()
+        self.serial_handler = serial_handler
+        self.step_times = []
+
+        self._thread = None
+        self._condition = threading.Condition()
+        self._lines = []            # Lines received since the last command was sent
+        self._line_index = 0        # First line not checked yet by the current step
+        self._cancelled = False
+        self._error_pattern = re.compile(Commands.MACRO_VARIABLES["error_pattern"])
+
+        self.serial_handler.add_line_listener(self._handle_lines)
+
+    @classmethod
+    def check_steps(cls, steps):
+        """ Raises a MacroError if one of `steps` is not valid. """
+        for number, step in enumerate(steps, start=1):
+            kind = step[0] if step else None
+            if kind not in cls.STEP_ARGUMENTS or len(step) != cls.STEP_ARGUMENTS[kind] + 1:
+                raise MacroError(f"Step {number} is not valid: {step}")
+            if kind == "wait_for":
+                try:
+                    re.compile(step[1])
+                except re.error as e:
+                    raise MacroError(f"Step {number} has an invalid pattern: {e}")
+
+    @staticmethod
+    def describe_step(step):
+        """ Returns a short description of a step, shown as the progress of the macro. """
+        kind = step[0]
+        if kind == "send":
+            return f"Sending {step[1]}"
+        if kind == "wait":
+            return f"Waiting {step[1]:g} s"
+        return f"Waiting for '{step[1]}'"
+
+    def is_running(self):
+        """ Returns True if a macro is running. """
+        return (self._thread is not None) and self._thread.is_alive()
+
+    def run(self, name: str, steps = None):
+        """ Starts the macro `name`, returns right away.
+
+        Parameters
+        ----------
+        name : str
+            Name of the macro, in Commands.CALIBRATION_MACROS if `steps` is None.
+        steps : list
+            Steps of the macro, see the class description.
+
+        Returns
+        -------
+        bool
+            False if another macro is running.
+        """
+        if self.is_running():
+            return False
+
+        steps = list(Commands.CALIBRATION_MACROS[name] if steps is None else steps)
+        self.check_steps(steps)
+
+        self._cancelled = False
+        # Daemon thread, so it does not keep the app open
+        self._thread = threading.Thread(target=self._run, args=(name, steps), name="MacroRunner", daemon=True)
+        self._thread.start()
+        return True
+
+    def cancel(self):
+        """ Stops the running macro after its current step (the commands already sent are not undone). """
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify_all()
+
+    def wait(self, timeout: float = None):
+        """ Waits for the running macro to finish, returns False if it is still running after `timeout` [sec]. """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return not self.is_running()
+
+    def _run(self, name: str, steps: list):
+        """ Runs the steps of a macro, in the macro thread. """
+        self.step_times = []
+        self.started.emit(name, len(steps))
+        try:
+            for number, step in enumerate(steps, start=1):
+                description = self.describe_step(step)
+                self.progress.emit(name, number, len(steps), description)
+
+                start_time = time.perf_counter()
+                getattr(self, f"_{step[0]}")(*step[1:])
+                self.step_times.append((description, time.perf_counter() - start_time))
+        except MacroError as e:
+            self.finished.emit(name, False, str(e))
+            return
+        self.finished.emit(name, True, "")
+
+    def _send(self, command: str):
+        if self._cancelled:
+            raise MacroError("Cancelled")
+        if self.serial_handler.get_current_connection_status() != "Connected":
+            raise MacroError("The ramp is not connected")
+
+        # The lines received before this command are answers to earlier commands
+        with self._condition:
+            self._lines.clear()
+            self._line_index = 0
+        self.serial_handler.send_command(command)
+
+    def _wait(self, seconds: float):
+        self._wait_until(lambda line: False, seconds)
+
+    def _wait_for(self, pattern: str, timeout: float):
+        if not self._wait_until(re.compile(pattern).search, timeout):
+            raise MacroError(f"No '{pattern}' from the ramp within {timeout:g} s")
+
+    def _wait_until(self, match, timeout: float):
+        """ Checks the received lines with `match` until one matches (returns True) or `timeout` [sec] is over
+        (returns False). Raises a MacroError if the macro is cancelled or an error line is received.
+        """
+        deadline = time.perf_counter() + timeout
+        with self._condition:
+            while True:
+                if self._cancelled:
+                    raise MacroError("Cancelled")
+
+                while self._line_index < len(self._lines):
+                    line = self._lines[self._line_index]
+                    self._line_index += 1
+                    if match(line):
+                        return True
+                    if self._error_pattern.search(line):
+                        raise MacroError(f"The ramp answered '{line}'")
+
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+
+    def _handle_lines(self, lines: list):
+        """ Adds the lines received from the ramp, in the reader thread of the SerialHandler. """
+        if not self.is_running():
+            return
+        with self._condition:
+            self._lines.extend(lines)
+            self._condition.notify_all()
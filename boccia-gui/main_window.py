@@ -12,8 +12,11 @@ from PyQt5.QtWidgets import (
 from commands import Commands
 from styles import Styles
 from serial_handler import SerialHandler
+from session_trace import SessionTraceRecorder, remove_old_traces
+from pipeline_tracing import tracer
+from control_state import ControlState
+from preflight import StartupPreflight
 from key_press_handler import KeyPressHandler
-from bluetooth_server import BluetoothServer
 from user_controls_widget import UserControlsWidget
 from serial_controls_widget import SerialControlsWidget
 from operator_controls_widget import OperatorControlsWidget
@@ -24,20 +27,30 @@ class MainWindow(QMainWindow):
     def __init__(self, include_multiplayer_controls = False):
         super().__init__()        
 
+        # Initialize the session trace (the record of every command and serial line)
+        self.session_trace = self._open_session_trace()
+
         # Initialize serial handler
-        self.serial_handler = SerialHandler()
+        self.serial_handler = SerialHandler(trace=self.session_trace)
 
         # Initialize commands
         self.commands = Commands()
 
+        # Initialize the control state, shared by the keyboard, the buttons and the multiplayer devices
+        self.control_state = ControlState(self.serial_handler.send_command)
+        self.commands.set_control_state(self.control_state)
+
+        # End the drop delay as soon as the ramp reports the drop is complete
+        self.serial_handler.new_data_batch.connect(self.commands.handle_serial_lines)
+
         # Set the multiplayer version flag
         # This determines whether or not the window will include the multiplayer functionality
         self.include_multiplayer_controls = include_multiplayer_controls
 
-        # If including multiplayer functionality, 
-        # initialize instance of the Bluetooth server class
-        if self.include_multiplayer_controls:
-            self.bluetooth_server = BluetoothServer()
+        # The Bluetooth server is only created when multiplayer mode is first turned on,
+        # see _create_bluetooth_server()
+        self.bluetooth_server = None
+        self.adapter_preflight = None
 
         # Initialize user interface
         self.init_UI()
@@ -45,22 +58,22 @@ class MainWindow(QMainWindow):
         # Install event filter for keyboard events
         self.key_press_handler = KeyPressHandler(
                self,
-               self.serial_handler, 
-               self.commands
+               self.control_state, 
+               self.commands,
+               self.session_trace
                )
         
         self.key_press_handler.installEventFilter(self)
         self.installEventFilter(self.key_press_handler)
-        self.commands.set_key_press_handler(self.key_press_handler)
-
-        # Set up event connections
-        self.set_up_event_connections()
 
         # Set window size
         width = 600 * Styles.SCALE_FACTOR
         height = 400 * Styles.SCALE_FACTOR
         self.resize(width, height)
 
+        # Look for the serial ports in the background, while the window is shown
+        self._start_preflight()
+
 
     def init_UI(self):
          # Create and set central widget once
@@ -76,7 +89,7 @@ class MainWindow(QMainWindow):
         current_file_path = os.path.dirname(os.path.abspath(__file__))
         self.setWindowIcon(QIcon(fr"{current_file_path}/brain.png"))
         self.setWindowTitle('Boccia T2S Controller')
-        self.setStyleSheet(Styles.WINDOW_BACKGROUND)
+        Styles.apply_app_stylesheet() # Background and buttons, see Styles.APP_STYLESHEET
 
         # Create serial controls widget
         self.serial_controls_widget = SerialControlsWidget(self, self.serial_handler)
@@ -84,18 +97,16 @@ class MainWindow(QMainWindow):
 
         # Create multiplayer controls widget
         if self.include_multiplayer_controls:
-            self.multiplayer_controls_widget = MultiplayerControlsMainDevice(self.bluetooth_server)
+            self.multiplayer_controls_widget = MultiplayerControlsMainDevice(self._create_bluetooth_server)
             self.multiplayer_controls_widget.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
 
         # Create operator controls
-        self.operator_controls_widget = OperatorControlsWidget(self.serial_handler, self.commands)
+        self.operator_controls_widget = OperatorControlsWidget(self.serial_handler, self.control_state, self.session_trace)
         self.operator_controls_widget.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-        self.commands.set_operator_controls_widget(self.operator_controls_widget)
 
         # Create user controls
-        self.user_controls_widget = UserControlsWidget(self.serial_handler, self.commands)
+        self.user_controls_widget = UserControlsWidget(self.control_state, self.session_trace)
         self.user_controls_widget.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-        self.commands.set_user_controls_widget(self.user_controls_widget) 
 
         # Organize main layout
         self.mainLayout.addWidget(self.serial_controls_widget)
@@ -105,31 +116,98 @@ class MainWindow(QMainWindow):
         self.mainLayout.addWidget(self.user_controls_widget)
 
 
-    def set_up_event_connections(self):
-        # KeyPressHandler sends service flag
-        self.key_press_handler.key_service_flag_changed.connect(self.user_controls_widget._receive_service_flag)
-        self.key_press_handler.key_service_flag_changed.connect(self.operator_controls_widget._receive_service_flag)
-
-        # UserControlsWidget sends service flag  
-        self.user_controls_widget.button_service_flag_changed.connect(self.key_press_handler.toggle_service_flag)
-        self.user_controls_widget.button_service_flag_changed.connect(self.operator_controls_widget._receive_service_flag)
-
-         # OperatorControlsWidget sends service flag
-        self.operator_controls_widget.hold_button_service_flag_changed.connect(self.key_press_handler.toggle_service_flag)
-        self.operator_controls_widget.hold_button_service_flag_changed.connect(self.user_controls_widget._receive_service_flag)
-
-        # Set up Bluetooth server events if multiplayer controls are included
-        if self.include_multiplayer_controls:
-            self.bluetooth_server.server_status_changed.connect(self.multiplayer_controls_widget._handle_server_status_change)
-            self.bluetooth_server.command_received.connect(self.command_received_from_multiplayer_device)
+    def _start_preflight(self):
+        """ Starts the slow startup probes at the same time on a thread pool, see preflight.py.
+        The widgets fill in as the results arrive, in _handle_preflight_result().
+        """
+        self.preflight = StartupPreflight()
+        self.preflight.add_probe("serial_ports", self.serial_controls_widget.port_watcher.list_ports)
+        self.preflight.probe_finished.connect(self._handle_preflight_result)
+        self.preflight.start()
+
+    def _start_adapter_preflight(self):
+        """ Looks for the Bluetooth adapter in the background, when multiplayer mode is first turned on.
+        It is not a startup probe, so the multiplayer stack (and the Bluetooth discovery) is not loaded at startup.
+        """
+        self.adapter_preflight = StartupPreflight()
+        self.adapter_preflight.add_probe("bluetooth_adapter", self._find_bluetooth_adapter)
+        self.adapter_preflight.probe_finished.connect(self._handle_preflight_result)
+        self.adapter_preflight.start()
+
+    @staticmethod
+    def _find_bluetooth_adapter():
+        """ Returns the local Bluetooth adapters, runs in a preflight thread.
+        The result is kept in the discovery cache, so the server does not wait for it when Connect is clicked.
+        """
+        from bt_devices import BluetoothDevices
+
+        return BluetoothDevices().get_local_bluetooth_adapter()
+
+    def _handle_preflight_result(self, name, result):
+        """ Fills in the widgets with the result of a preflight probe (None if the probe failed). """
+        if name == "serial_ports":
+            self.serial_controls_widget.start_port_watcher(result)
+        elif name == "bluetooth_adapter":
+            self.multiplayer_controls_widget.set_bluetooth_adapter(result)
+
+    def _create_bluetooth_server(self):
+        """ Creates the Bluetooth server and connects its events, called when multiplayer mode is first turned on.
+        The multiplayer stack (Bluetooth server, transports and device discovery) is only imported here,
+        so the app starts faster when multiplayer mode is not used.
+        """
+        from bluetooth_server import BluetoothServer
+
+        self.bluetooth_server = BluetoothServer(trace=self.session_trace)
+        self.bluetooth_server.server_status_changed.connect(self.multiplayer_controls_widget._handle_server_status_change)
+        self.bluetooth_server.clients_changed.connect(self.multiplayer_controls_widget._handle_clients_change)
+        self.bluetooth_server.command_received.connect(self.command_received_from_multiplayer_device)
+        self.bluetooth_server.link_stats_changed.connect(self.multiplayer_controls_widget._handle_link_stats_change)
+
+        if Commands.TRANSPORT_VARIABLES["transport"] == "rfcomm":
+            self._start_adapter_preflight()
+        return self.bluetooth_server
+
+    def _open_session_trace(self):
+        """ Returns the recorder of today's session trace, None if it is disabled or cannot be opened.
+        The traces older than the retention period are deleted first.
+        """
+        if not Commands.TRACE_VARIABLES["enabled"]:
+            return None
+        try:
+            remove_old_traces()
+            return SessionTraceRecorder()
+        except (OSError, ValueError) as e:
+            # print(f"Session trace not recorded: {e}")  # For debugging purposes
+            return None
 
     def command_received_from_multiplayer_device(self, player_number, command_text):
         """ Handles a command received from a multiplayer device. """
+        if tracer.enabled:
+            tracer.begin()
         self.key_press_handler.toggle_key_pressed(player_number, command_text)
+        if tracer.enabled:
+            tracer.end()
 
     def closeEvent(self, event):
+        # Stop the running calibration, before the port is closed
+        self.serial_controls_widget.stop_macro()
+
         # Safely disconnect from serial port
         if self.serial_handler.get_current_connection_status() == "Connected":
             self.serial_handler.disconnect()
 
+        # Stop looking for serial ports and the Bluetooth adapter
+        self.preflight.stop()
+        if self.adapter_preflight:
+            self.adapter_preflight.stop()
+        self.serial_controls_widget.stop_port_watcher()
+
+        # Write the rest of the session trace
+        if self.session_trace:
+            self.session_trace.close()
+
+        # Show where the latency of the commands went
+        if tracer.enabled:
+            print(tracer.report())
+
         event.accept()
\ No newline at end of file
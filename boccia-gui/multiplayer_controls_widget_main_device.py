@@ -11,6 +11,7 @@ from PyQt5.QtWidgets import (
 # Custom libraries
 from styles import Styles
 from commands import Commands
+from bluetooth_protocol import LinkMonitor
 
 class MultiplayerControlsMainDevice(QWidget):
     """ Class for the multiplayer controls widget, part of the main device app.
@@ -19,26 +20,28 @@ class MultiplayerControlsMainDevice(QWidget):
     
     It handles the UI for the multiplayer controls.
     """
-    def __init__(self, bluetooth_server = None):
-        """ Initializes the MultiplayerControlsMainDevice class. """
+    def __init__(self, create_bluetooth_server = None):
+        """ Initializes the MultiplayerControlsMainDevice class.
+
+        `create_bluetooth_server` is a function that returns the Bluetooth server. It is only called
+        when multiplayer mode is first turned on, so the multiplayer stack is not loaded before that.
+        """
         super().__init__()
         
-        # Get access to Bluetooth server object
-        self.bluetooth_server_thread = bluetooth_server
+        # The Bluetooth server object, created the first time multiplayer mode is turned on
+        self.create_bluetooth_server = create_bluetooth_server
+        self.bluetooth_server_thread = None
+        self.num_players = Commands.MIN_MULTIPLAYERS
 
         # Initialize multiplayer mode indicator
         self.multiplayer_mode = False
         # Initialize connection status
         self.connection_status = "Disconnected" # Tracks connection status
-        # Initialize count of connected devices
+        # Initialize count of connected devices (from the Bluetooth server)
         self.connected_devices_count = 0
+        # Initialize latency statistics of each player's link {player number: stats}
+        self.link_stats = {}
 
-        # Button styles for the connect button
-        self.connect_button_styles = {
-            "connect": Styles.create_button_style("green"),
-            "disconnect": Styles.create_button_style("red"),
-            "error": Styles.create_button_style("orange")
-        }
 
         # Main label section
         self.main_label = QLabel('MULTIPLAYER CONTROLS')
@@ -58,7 +61,6 @@ class MultiplayerControlsMainDevice(QWidget):
         """ Creates the UI for the multiplayer mode section. """
         # Create button to toggle multiplayer mode on/off
         self.multiplayer_mode_button = QPushButton("Turn ON Multiplayer Mode")
-        self.multiplayer_mode_button.setStyleSheet(Styles.HOVER_BUTTON)
         self.multiplayer_mode_button.clicked.connect(self._multiplayer_mode_clicked)
 
         # Create combobox to set the number of players
@@ -84,7 +86,7 @@ class MultiplayerControlsMainDevice(QWidget):
         """ Creates the UI for the connection section. """
         # Create the Connect button, initialized as disabled
         self.connect_button = QPushButton("Connect")
-        self.connect_button.setStyleSheet(Styles.DISABLED_BUTTON)
+        Styles.set_property(self.connect_button, "state", "connect")    # Shown as disabled until it is enabled
         self.connect_button.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Minimum)
         self.scaled_margin = int(5 * Styles.SCALE_FACTOR)
         self.connect_button.setContentsMargins(self.scaled_margin, self.scaled_margin, self.scaled_margin, self.scaled_margin)
@@ -100,21 +102,36 @@ class MultiplayerControlsMainDevice(QWidget):
         self.status_label = QLabel("Status: Disconnected")
         self.status_label.setStyleSheet(Styles.LABEL_TEXT)
 
+        # Bluetooth adapter label, filled in when multiplayer mode is first turned on
+        self.adapter_label = QLabel("")
+        self.adapter_label.setObjectName("adapterLabel")   # Styled by the application stylesheet
+
+        # Link latency labels, one per connected player {player number: label}, see _update_link_stats_labels()
+        self.link_stats_labels = {}
+        self.link_stats_layout = QVBoxLayout()
+
         # Organize layout
         self.connection_section_layout = QVBoxLayout()
         self.connection_section_layout.addLayout(button_container)
         self.connection_section_layout.addWidget(self.status_label)
+        self.connection_section_layout.addWidget(self.adapter_label)
+        self.connection_section_layout.addLayout(self.link_stats_layout)
 
     def _multiplayer_mode_clicked(self):
         """ Toggles multiplayer mode on/off. """
         # If multiplayer mode is off, turn it on
         if self.multiplayer_mode == False:
+            # Create the Bluetooth server the first time
+            if self.bluetooth_server_thread is None:
+                self.bluetooth_server_thread = self.create_bluetooth_server()
+                self.bluetooth_server_thread.set_num_clients(self.num_players)
+
             self.multiplayer_mode = True # Toggle multiplayer mode
             self.multiplayer_mode_button.setText("Turn OFF Multiplayer Mode")
             self.num_players_box.setEnabled(True) # Enable the number of players dropdown
             self.connect_button.setEnabled(True) # Enable the connect button
             self.connect_button.setText("Connect") # Make sure button says "Connect"
-            self.connect_button.setStyleSheet(self.connect_button_styles["connect"])
+            Styles.set_property(self.connect_button, "state", "connect")
             self.status_label.setText("Status: Ready to setup") # Change status
 
         # If multiplayer mode is on, turn it off
@@ -125,7 +142,6 @@ class MultiplayerControlsMainDevice(QWidget):
             self.connection_status = "Disconnected" # Reset connection status
             self.num_players_box.setEnabled(False) # Disable the number of players box
             self.connect_button.setEnabled(False) # Disable the connect button
-            self.connect_button.setStyleSheet(Styles.DISABLED_BUTTON)
             self.connect_button.setText("Connect") # Make sure button says "Connect"
             self.status_label.setText("Status: Off") # Change status
 
@@ -148,50 +164,108 @@ class MultiplayerControlsMainDevice(QWidget):
         
         This is called when the dropdown is created, and whenever its value is changed.
         """
-        # Convert the number of players to an integer and set it in the Bluetooth server
-        self.bluetooth_server_thread.set_num_clients(int(self.num_players_box.currentText()))
+        # Convert the number of players to an integer and set it in the Bluetooth server, if it was created
+        self.num_players = int(self.num_players_box.currentText())
+        if self.bluetooth_server_thread:
+            self.bluetooth_server_thread.set_num_clients(self.num_players)
+            self._update_clients_status()
+
+    def set_bluetooth_adapter(self, adapters: list):
+        """ Shows the Bluetooth adapter of this device, found in the background when multiplayer mode is first turned on.
+
+        `adapters` is the list of BluetoothDevice tuples of the local adapters, None if the lookup failed.
+        """
+        if adapters:
+            name, address, _ = adapters[0]
+            self.adapter_label.setText(f"Bluetooth adapter: {name} ({address or 'unknown address'})")
+        else:
+            self.adapter_label.setText("No Bluetooth adapter found")
+
+        # Highlight the label if there is no adapter
+        Styles.set_property(self.adapter_label, "missing", not adapters)
 
     def _handle_server_status_change(self, message: str):
         """ Handles server connection status changes to update the UI accordingly. """
 
         if message == "Error":
             self.connect_button.setText("Error")
-            self.connect_button.setStyleSheet(self.connect_button_styles["error"])
+            Styles.set_property(self.connect_button, "state", "error")
             self.status_label.setText("Status: Error")
             self.connection_status = "Error"
 
         if message == "Initializing":
             self.connect_button.setText("Cancel")
-            self.connect_button.setStyleSheet(self.connect_button_styles["disconnect"])
+            Styles.set_property(self.connect_button, "state", "disconnect")
             self.status_label.setText("Status: Setting up this device...")
             self.connection_status = "Initializing"
 
         if message == "Waiting":
-            self.connect_button.setText("Cancel")
-            self.connect_button.setStyleSheet(self.connect_button_styles["disconnect"])
-            self.status_label.setText("Status: Waiting for other devices...")
+            # The server is running, the status depends on the number of connected devices from now on
             self.connection_status = "Waiting"
-        
-        if message == "Connected":
-            # Increment number of connected devices
-            self.connected_devices_count += 1
-            # Get the number of players currently set in the GUI
-            num_players = int(self.num_players_box.currentText())
-
-            # Check if enough devices are connected
-            # The number of connected devices needs to be (num_players - 1)
-            # Since the server device (this device) counts as Player 1
-            if self.connected_devices_count == (num_players - 1):
-                # Update status to "Connected" if all players are connected
-                self.connect_button.setText("Disconnect")
-                self.connect_button.setStyleSheet(self.connect_button_styles["disconnect"])
-                self.status_label.setText("Status: Connected")
-                self.connection_status = "Connected"
+            self._update_clients_status()
 
         if message == "Disconnected":
-            # ("Disconnected" message means all devices are disconnected)
+            # ("Disconnected" message means the server stopped, all devices are disconnected)
             self.connected_devices_count = 0 # Reset number of connected devices
             self.connect_button.setText("Connect")
-            self.connect_button.setStyleSheet(self.connect_button_styles["connect"])
+            Styles.set_property(self.connect_button, "state", "connect")
             self.status_label.setText("Status: Disconnected")
-            self.connection_status = "Disconnected"
\ No newline at end of file
+            self.connection_status = "Disconnected"
+            self.link_stats.clear() # Clear the latency of all players
+            self._update_link_stats_labels()
+
+    def _handle_clients_change(self, count: int):
+        """ Handles changes in the number of connected devices (a player connected, dropped or reconnected). """
+        self.connected_devices_count = count
+        self._update_clients_status()
+
+    def _update_clients_status(self):
+        """ Shows "Connected" if all the players are connected, and how many are connected otherwise.
+        Only while the server is running (i.e. "Waiting" or "Connected").
+        """
+        if self.connection_status not in ("Waiting", "Connected"):
+            return
+
+        # The number of connected devices needs to be (num_players - 1)
+        # Since the server device (this device) counts as Player 1
+        num_devices = self.num_players - 1
+        Styles.set_property(self.connect_button, "state", "disconnect")
+        if self.connected_devices_count >= num_devices:
+            self.connect_button.setText("Disconnect")
+            self.status_label.setText("Status: Connected")
+            self.connection_status = "Connected"
+        else:
+            self.connect_button.setText("Cancel")
+            self.status_label.setText(f"Status: Waiting for other devices... ({self.connected_devices_count} of {num_devices} connected)")
+            self.connection_status = "Waiting"
+
+    def _handle_link_stats_change(self, player_number: str, stats: dict):
+        """ Handles changes in the latency of a player's link to update the UI accordingly. 
+        
+        Empty statistics mean the player is not connected anymore.
+        """
+        if stats:
+            self.link_stats[player_number] = stats
+        else:
+            self.link_stats.pop(player_number, None)
+        self._update_link_stats_labels()
+
+    def _update_link_stats_labels(self):
+        """ Shows the latency of each player's link, one label per player, highlighting the slow ones. """
+        # Remove the labels of the players that are not connected anymore
+        for player_number in [player for player in self.link_stats_labels if player not in self.link_stats]:
+            label = self.link_stats_labels.pop(player_number)
+            self.link_stats_layout.removeWidget(label)
+            label.deleteLater()
+
+        for player_number in sorted(self.link_stats, key=lambda player: int(player.split()[-1])):
+            label = self.link_stats_labels.get(player_number)
+            if label is None:
+                label = self.link_stats_labels[player_number] = QLabel("")
+                label.setObjectName("latencyLabel")    # Styled by the application stylesheet
+            # Keep the labels in the order of the players
+            self.link_stats_layout.addWidget(label)
+
+            stats = self.link_stats[player_number]
+            label.setText(f"{player_number}: {LinkMonitor.format_stats(stats)}")
+            Styles.set_property(label, "degraded", bool(stats["degraded"]))
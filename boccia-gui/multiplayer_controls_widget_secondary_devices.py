@@ -11,6 +11,7 @@ from PyQt5.QtWidgets import (
 # Custom libraries
 from styles import Styles
 from custom_combo_box import CustomComboBox
+from bluetooth_protocol import LinkMonitor
 
 class MultiplayerControlsSecondaryDevices(QWidget):
     """ Class for the multiplayer controls widget for secondary devices.
@@ -28,13 +29,6 @@ class MultiplayerControlsSecondaryDevices(QWidget):
         # Initialize connection status
         self.connection_status = "Disconnected"
 
-        # Button styles for the connect button
-        self.connect_button_styles = {
-            "connect": Styles.create_button_style("green"),
-            "disconnect": Styles.create_button_style("red"),
-            "error": Styles.create_button_style("orange")
-        }
-
         # Main label section
         self.main_label = QLabel('MULTIPLAYER CONTROLS')
         self.main_label.setStyleSheet(Styles.MAIN_LABEL)
@@ -74,7 +68,7 @@ class MultiplayerControlsSecondaryDevices(QWidget):
         """ Creates the UI for the connection section. """
         # Create the Connect button, initialized as disabled
         self.connect_button = QPushButton("Connect")
-        self.connect_button.setStyleSheet(Styles.DISABLED_BUTTON)
+        Styles.set_property(self.connect_button, "state", "connect")    # Shown as disabled until it is enabled
         self.connect_button.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Minimum)
         self.scaled_margin = int(5 * Styles.SCALE_FACTOR)
         self.connect_button.setContentsMargins(self.scaled_margin, self.scaled_margin, self.scaled_margin, self.scaled_margin)
@@ -90,10 +84,15 @@ class MultiplayerControlsSecondaryDevices(QWidget):
         self.status_label = QLabel("Status: Disconnected")
         self.status_label.setStyleSheet(Styles.LABEL_TEXT)
 
+        # Link latency label
+        self.latency_label = QLabel("")
+        self.latency_label.setObjectName("latencyLabel")   # Styled by the application stylesheet
+
         # Organize layout
         self.connection_section_layout = QVBoxLayout()
         self.connection_section_layout.addLayout(button_container)
         self.connection_section_layout.addWidget(self.status_label)
+        self.connection_section_layout.addWidget(self.latency_label)
 
     def _populate_devices(self):
         """ Populates the dropdown with paired devices. """
@@ -126,7 +125,7 @@ class MultiplayerControlsSecondaryDevices(QWidget):
         
         # Enable the connect button now that a device is selected
         self.connect_button.setEnabled(True)
-        self.connect_button.setStyleSheet(self.connect_button_styles["connect"])
+        Styles.set_property(self.connect_button, "state", "connect")
     
     def _toggle_connection_status(self):
         """ Toggles the connection status. 
@@ -149,18 +148,32 @@ class MultiplayerControlsSecondaryDevices(QWidget):
         
         if message == "Error":
             self.connect_button.setText("Error")
-            self.connect_button.setStyleSheet(self.connect_button_styles["error"])
+            Styles.set_property(self.connect_button, "state", "error")
             self.status_label.setText("Status: Error")
             self.connection_status = "Error"
         
         if message == "Connected":
             self.connect_button.setText("Disconnect")
-            self.connect_button.setStyleSheet(self.connect_button_styles["disconnect"])
+            Styles.set_property(self.connect_button, "state", "disconnect")
             self.status_label.setText("Status: Connected")
             self.connection_status = "Connected"
 
+        if message == "Reconnecting":
+            self.connect_button.setText("Cancel")
+            Styles.set_property(self.connect_button, "state", "disconnect")
+            self.status_label.setText("Status: Connection lost, reconnecting...")
+            self.connection_status = "Reconnecting"
+
         if message == "Disconnected":
             self.connect_button.setText("Connect")
-            self.connect_button.setStyleSheet(self.connect_button_styles["connect"])
+            Styles.set_property(self.connect_button, "state", "connect")
             self.status_label.setText("Status: Disconnected")
             self.connection_status = "Disconnected"
+            self.latency_label.setText("") # Clear the latency of the link
+
+    def _handle_link_stats_change(self, stats: dict):
+        """ Handles changes in the latency of the link to the main device to update the UI accordingly. """
+        self.latency_label.setText(f"Latency: {LinkMonitor.format_stats(stats)}")
+        
+        # Highlight the label if the link is slow
+        Styles.set_property(self.latency_label, "degraded", bool(stats["degraded"]))
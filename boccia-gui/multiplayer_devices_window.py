@@ -69,7 +69,7 @@ class MultiplayerDevicesWindow(QMainWindow):
         current_file_path = os.path.dirname(os.path.abspath(__file__))
         self.setWindowIcon(QIcon(fr"{current_file_path}/brain.png"))
         self.setWindowTitle('Boccia T2S Controller: Multiplayer App')
-        self.setStyleSheet(Styles.WINDOW_BACKGROUND)
+        Styles.apply_app_stylesheet() # Background and buttons, see Styles.APP_STYLESHEET
 
         # Create multiplayer controls widget
         self.multiplayer_controls_widget = MultiplayerControlsSecondaryDevices(self.bluetooth_client)
@@ -86,4 +86,5 @@ class MultiplayerDevicesWindow(QMainWindow):
     def set_up_event_connections(self):
         """ Sets up event connections. """
         # Connect the client status changed signal
-        self.bluetooth_client.client_status_changed.connect(self.multiplayer_controls_widget._handle_client_status_change)
\ No newline at end of file
+        self.bluetooth_client.client_status_changed.connect(self.multiplayer_controls_widget._handle_client_status_change)
+        self.bluetooth_client.link_stats_changed.connect(self.multiplayer_controls_widget._handle_link_stats_change)
\ No newline at end of file
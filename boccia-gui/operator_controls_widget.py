@@ -1,5 +1,5 @@
 # Standard libraries
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import (
     QLabel,
     QWidget,
@@ -15,15 +15,15 @@ from PyQt5.QtWidgets import (
 # Custom libraries
 from styles import Styles
 from commands import Commands
+from session_trace import BUTTON
 
 class OperatorControlsWidget(QWidget):
-    hold_button_service_flag_changed = pyqtSignal(bool)
-
-    def __init__(self, serial_handler = None, commands = None):
+    def __init__(self, serial_handler = None, control_state = None, trace = None):
         super().__init__()
 
-        self.serial_handler = serial_handler
-        self.commands = commands
+        self.serial_handler = serial_handler    # Sends the speed commands
+        self.control_state = control_state  # Sends the commands and keeps the service state
+        self.trace = trace  # SessionTraceRecorder for the button clicks, or None
 
         self.default_speeds = {
             "elevation": 50,
@@ -31,6 +31,7 @@ class OperatorControlsWidget(QWidget):
         }
 
         self.operator_buttons = []
+        self.all_buttons = []   # Operator buttons and drop button
         
         # Main label section   
         self.controls_label = QLabel('OPERATOR CONTROLS')
@@ -52,7 +53,7 @@ class OperatorControlsWidget(QWidget):
         for button in self.operator_buttons:
             button.installEventFilter(self)
 
-        self.service_flag = False
+        self.control_state.subscribe(self._handle_control_state_change)
 
 
     def _create_operator_controls(self):
@@ -135,11 +136,11 @@ class OperatorControlsWidget(QWidget):
     def _create_operator_button(self, button_text:str = ""):
         """ Returns the operator buttons for the hold commands """
 
-        button_style = f"{Styles.HOVER_BUTTON} width: {50 * Styles.SCALE_FACTOR}px; height: {50 * Styles.SCALE_FACTOR}px;"
         button = QPushButton(button_text)
-        button.setStyleSheet(button_style)
+        button.setObjectName("operatorButton")  # Square button, see Styles.APP_STYLESHEET
         button.clicked.connect(self._handle_button_clicked)
         self.operator_buttons.append(button)
+        self.all_buttons.append(button)
 
         return button
     
@@ -147,10 +148,10 @@ class OperatorControlsWidget(QWidget):
     def _create_drop_button(self, button_text:str = ""):
         """ Returns the drop button for the operator controls """
 
-        button_style = f"{Styles.HOVER_BUTTON} width: {50 * Styles.SCALE_FACTOR}px; height: {50 * Styles.SCALE_FACTOR}px;"
         button = QPushButton(button_text)
-        button.setStyleSheet(button_style)
+        button.setObjectName("operatorButton")  # Square button, see Styles.APP_STYLESHEET
         button.clicked.connect(self._handle_drop_click)
+        self.all_buttons.append(button)
 
         return button
     
@@ -160,69 +161,30 @@ class OperatorControlsWidget(QWidget):
         sender = self.sender()
         command = Commands.OPERATOR_COMMANDS.get(sender.text())
         # print(f"\nOperator button clicked: {sender.text()}")
+        if self.trace:
+            self.trace.record(BUTTON, sender.text())
 
-        # If the command is in the list, send it
-        if command:
-            self.serial_handler.send_command(command)
-
-        # Update service flag
-        self._update_service_flag(not self.service_flag)
-
-        command_action = "Start" if self.service_flag else "Stop"
-        #print(f"{command_action} {command} command")
-
-        for button in self.findChildren(QPushButton):
-            if button != sender:
-                button.setEnabled(not button.isEnabled())
-
-            self._update_button_style(button)
+        # Stop the command if this button started it, otherwise start it
+        if self.control_state.is_button_active(sender.text()):
+            self.control_state.stop_hold(button=sender.text())
+        else:
+            self.control_state.start_hold(command, button=sender.text())
 
 
     def _handle_drop_click(self):
         # print("Operator drop button clicked")
-        # Send the command
+        if self.trace:
+            self.trace.record(BUTTON, "Drop \n(R)")
+        # Drop and start the drop delay
         command = Commands.OPERATOR_COMMANDS.get("Drop \n(R)")
-        self.serial_handler.send_command(command)
-        # print(f"Sent command: {command}")
-
-        # Update service flag
-        self._update_service_flag(True)
-
-        self.commands.drop_delay_timer()
-        self._toggle_all_buttons(False)
+        self.control_state.start_drop(command, "Player 1", button="Drop \n(R)")
         
     
-    def _toggle_all_buttons(self, is_enable):
-        for button in self.findChildren(QPushButton):
-            button.setEnabled(is_enable)
-            self._update_button_style(button)
-
-
-    def _update_button_style(self, button):
-        """ Update the button style based on its enabled state """
-        if button.isEnabled():
-            button_style = f"{Styles.HOVER_BUTTON} width: {50 * Styles.SCALE_FACTOR}px; height: {50 * Styles.SCALE_FACTOR}px;"
-            button.setStyleSheet(button_style)
-        else:
-            button_style = f"{Styles.DISABLED_BUTTON} width: {50 * Styles.SCALE_FACTOR}px; height: {50 * Styles.SCALE_FACTOR}px;"
-            button.setStyleSheet(button_style)
-
-
-    def _receive_service_flag(self, flag: bool):
-        self.service_flag = flag # toggle the service flag
-        self._toggle_all_buttons(not flag) # toggle the buttons
-        # print(f"Operator controls service flag: {self.service_flag}")
-
-
-    def _reset_buttons_and_flag(self):
-        self._toggle_all_buttons(True)
-        self._update_service_flag(False)
-
-    
-    def _update_service_flag(self, flag: bool):
-        self.service_flag = flag
-        self.hold_button_service_flag_changed.emit(self.service_flag)
-        # print(f"Operator controls service flag: {self.service_flag}")
+    def _handle_control_state_change(self, state):
+        """ Enable the buttons when no command is running, otherwise only the button that can stop it """
+        # The disabled style comes from the application stylesheet (Styles.APP_STYLESHEET)
+        for button in self.all_buttons:
+            button.setEnabled(not state.service_active or state.is_button_active(button.text()))
 
 
     def _change_slider_label(self, slider, label):
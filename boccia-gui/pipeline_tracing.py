@@ -0,0 +1,251 @@
+# Import libraries
+import os
+import sys
+import time
+
+from commands import Commands
+
+
+class LatencyHistogram():
+    """ Fixed-memory histogram of latencies, with buckets of the same relative width (HDR-style).
+
+    Values below 2**sub_bucket_bits [nsec] are counted exactly. Above that, each power of two is split
+    into 2**(sub_bucket_bits - 1) buckets, so a percentile is within 1 / 2**(sub_bucket_bits - 1) of the
+    recorded value (e.g. 3.1% with 5 bits). Values above the max are counted in the last bucket.
+
+    Recording is O(1) and does not allocate. It is not locked, each histogram is meant to be recorded
+    from a single thread (a count can be lost if two threads record the same histogram at the same time).
+    """
+
+    def __init__(
+            self,
+            max_value: float = Commands.PIPELINE_TRACING_VARIABLES["histogram_max"],
+            sub_bucket_bits: int = Commands.PIPELINE_TRACING_VARIABLES["sub_bucket_bits"]):
+        """ Initializes the LatencyHistogram class.
+
+        Parameters
+        ----------
+        max_value : float
+            [sec] Largest latency with its own bucket.
+        sub_bucket_bits : int
+            Number of bits of precision of the buckets.
+
+        Returns
+        -------
+        None
+
+        Attributes
+        ----------
+        counts : list
+            Number of values recorded in each bucket.
+        count : int
+            Number of values recorded.
+        min : int
+            [nsec] Smallest value recorded, None if there is none.
+        max : int
+            [nsec] Largest value recorded, None if there is none.
+        """
+        self._sub_bucket_bits = sub_bucket_bits
+        self._sub_bucket_count = 1 << sub_bucket_bits
+        self._half_count = self._sub_bucket_count >> 1
+        self._max_index = self._index(int(max_value * 1e9))
+        self.counts = [0] * (self._max_index + 1)
+        self.reset()
+
+    def reset(self):
+        """ Removes all the recorded values. """
+        for index in range(len(self.counts)):
+            self.counts[index] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value: int):
+        """ Records a latency of `value` [nsec]. """
+        if value < 0:
+            value = 0
+        self.counts[min(self._index(value), self._max_index)] += 1
+        self.count += 1
+        self.total += value
+        if (self.min is None) or (value < self.min):
+            self.min = value
+        if (self.max is None) or (value > self.max):
+            self.max = value
+
+    def mean(self):
+        """ Returns the mean of the recorded values [nsec], None if there is none. """
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percentile: float):
+        """ Returns the value [nsec] below which `percentile` % of the recorded values are, None if there is none.
+
+        The value is the upper bound of the bucket of the percentile, capped to the largest value recorded.
+        """
+        if not self.count:
+            return None
+
+        rank = max(1, int(round(percentile / 100 * self.count)))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def get_stats(self):
+        """ Returns the count and the min, mean, p50, p95, p99 and max latencies [sec] (None without values). """
+        def seconds(value):
+            return value / 1e9 if value is not None else None
+
+        return {
+            "count": self.count,
+            "min": seconds(self.min),
+            "mean": seconds(self.mean()),
+            "p50": seconds(self.percentile(50)),
+            "p95": seconds(self.percentile(95)),
+            "p99": seconds(self.percentile(99)),
+            "max": seconds(self.max),
+            }
+
+    def _index(self, value: int):
+        """ Returns the bucket of `value`. """
+        if value < self._sub_bucket_count:
+            return value
+
+        shift = value.bit_length() - self._sub_bucket_bits
+        return self._sub_bucket_count + (shift - 1) * self._half_count + ((value >> shift) - self._half_count)
+
+    def _upper_bound(self, index: int):
+        """ Returns the largest value counted in the bucket `index`. """
+        if index < self._sub_bucket_count:
+            return index
+
+        shift, sub_bucket = divmod(index - self._sub_bucket_count, self._half_count)
+        shift += 1
+        return ((sub_bucket + self._half_count + 1) << shift) - 1
+
+
+class PipelineTracer():
+    """ Stamps the commands as they move through the pipeline, and keeps a latency histogram per stage.
+
+    Stages:
+        - state_check: key press or device command received -> control state decision (command accepted)
+        - enqueue: control state decision -> command queued for the serial port
+        - serial_write: command queued -> written to the serial port
+        - input_to_write: key press or device command received -> written to the serial port
+        - bluetooth_recv_to_emit: data received from a multiplayer device -> command emitted
+
+    Every call site checks `tracer.enabled` first, so tracing costs one attribute lookup when it is disabled.
+    The span of the current input (begin(), decided(), enqueued()) is only used from the GUI thread.
+    """
+    STAGES = ("state_check", "enqueue", "serial_write", "input_to_write", "bluetooth_recv_to_emit")
+
+    def __init__(self, enabled: bool = False):
+        """ Initializes the PipelineTracer class.
+
+        Parameters
+        ----------
+        enabled : bool
+            Whether the commands are stamped.
+
+        Returns
+        -------
+        None
+
+        Attributes
+        ----------
+        enabled : bool
+            Whether the commands are stamped.
+        histograms : dict
+            Latency histogram of each stage {stage: LatencyHistogram}.
+        """
+        self.enabled = enabled
+        self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+        self._span_start = None     # [nsec] Time the current input was received
+        self._decision_time = None  # [nsec] Time the control state accepted the current input
+
+    @staticmethod
+    def now():
+        """ Returns the time used for all the stamps [nsec]. """
+        return time.perf_counter_ns()
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def begin(self):
+        """ Starts the span of an input (key press or device command), the stages after it are measured from here. """
+        self._span_start = self.now()
+        self._decision_time = None
+
+    def end(self):
+        """ Ends the span of the current input, commands sent after this are not part of it. """
+        self._span_start = None
+        self._decision_time = None
+
+    def decided(self):
+        """ Stamps the control state decision of the current input. """
+        if self._span_start is not None:
+            self._decision_time = self.now()
+            self.histograms["state_check"].record(self._decision_time - self._span_start)
+
+    def enqueued(self):
+        """ Stamps a command queued for the serial port.
+
+        Returns
+        -------
+        stamp : tuple
+            (span start, enqueue time) [nsec] to pass to written() once the command is written.
+            The span start is None if the command was not sent by an input (e.g. a speed slider).
+        """
+        enqueue_time = self.now()
+        if self._decision_time is not None:
+            self.histograms["enqueue"].record(enqueue_time - self._decision_time)
+        return self._span_start, enqueue_time
+
+    def written(self, stamp: tuple):
+        """ Stamps a command written to the serial port, `stamp` is the value returned by enqueued(). """
+        write_time = self.now()
+        span_start, enqueue_time = stamp
+        self.histograms["serial_write"].record(write_time - enqueue_time)
+        if span_start is not None:
+            self.histograms["input_to_write"].record(write_time - span_start)
+
+    def record(self, stage: str, start_time: int):
+        """ Records the time from `start_time` [nsec] to now in the histogram of `stage`. """
+        self.histograms[stage].record(self.now() - start_time)
+
+    def reset(self):
+        """ Removes the recorded latencies of all the stages. """
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def get_stats(self):
+        """ Returns the statistics of each stage {stage: LatencyHistogram.get_stats()}. """
+        return {stage: histogram.get_stats() for stage, histogram in self.histograms.items()}
+
+    def report(self):
+        """ Returns a table with the latency of each stage [msec]. """
+        lines = [f"{'stage':<24}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  [ms]"]
+        for stage, stats in self.get_stats().items():
+            if not stats["count"]:
+                lines.append(f"{stage:<24}{0:>8}")
+                continue
+            values = "".join(f"{1e3 * stats[name]:>10.3f}" for name in ("p50", "p95", "p99", "max"))
+            lines.append(f"{stage:<24}{stats['count']:>8}{values}")
+        return "\n".join(lines)
+
+
+def is_tracing_requested(argv: list = None, environ: dict = None):
+    """ Returns True if the tracing is switched on by the environment variable or the command line flag
+    set in Commands.PIPELINE_TRACING_VARIABLES (e.g. BOCCIA_TRACE=1 or --trace).
+    """
+    argv = sys.argv if argv is None else argv
+    environ = os.environ if environ is None else environ
+    value = environ.get(Commands.PIPELINE_TRACING_VARIABLES["environment_variable"], "")
+    return (value.strip().lower() not in ("", "0", "false", "no", "off")) \
+        or (Commands.PIPELINE_TRACING_VARIABLES["command_line_flag"] in argv)
+
+
+# Tracer shared by the whole app
+tracer = PipelineTracer(enabled=is_tracing_requested())
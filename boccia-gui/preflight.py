@@ -0,0 +1,121 @@
+# Import libraries
+import time
+import threading
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class _ProbeRunnable(QRunnable):
+    """ Runs one probe of a StartupPreflight in its thread pool. """
+
+    def __init__(self, preflight, name: str, probe):
+        super().__init__()
+        self.preflight = preflight
+        self.name = name
+        self.probe = probe
+
+    def run(self):
+        self.preflight._run_probe(self.name, self.probe)
+
+
+class StartupPreflight(QObject):
+    """ Runs slow probes (e.g. serial ports at startup, the Bluetooth adapter in multiplayer mode) at the same time on a thread pool.
+
+    The startup probes start when the app is launched, while the window is shown. Each result is emitted as soon as
+    its probe finishes, so the widgets fill in one by one, and the app is ready when the slowest probe is done
+    (instead of after all of them in sequence).
+
+    The pool is a QThreadPool (Qt is already loaded, concurrent.futures would import logging at startup).
+    The signals are emitted from the pool threads, the slots of the widgets run in the GUI thread (queued).
+    """
+    # Events
+    probe_finished = pyqtSignal(str, object)    # Name and result of a probe, the result is None if the probe failed
+    finished = pyqtSignal()                     # All the probes are done
+
+    def __init__(self):
+        """ Initializes the StartupPreflight class.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+
+        Attributes
+        ----------
+        results : dict
+            Result of each probe that finished {name: result}, None if the probe failed.
+        durations : dict
+            [sec] Time from start() to the end of each probe {name: duration}.
+        elapsed : float
+            [sec] Time from start() to the end of the slowest probe, None until all the probes are done.
+        """
+        super().__init__()
+        self.results = {}
+        self.durations = {}
+        self.elapsed = None
+
+        self._probes = {}
+        self._pool = QThreadPool(self)
+        self._start_time = None
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def add_probe(self, name: str, probe):
+        """ Adds a probe, run by start().
+
+        Parameters
+        ----------
+        name : str
+            Name of the probe, emitted with its result.
+        probe : callable
+            Function that returns the result, called without arguments in a pool thread.
+
+        Returns
+        -------
+        None
+        """
+        self._probes[name] = probe
+
+    def start(self):
+        """ Starts all the probes at the same time, returns right away. """
+        self._start_time = time.perf_counter()
+        if not self._probes:
+            self.elapsed = 0.0
+            self.finished.emit()
+            return
+
+        # One thread per probe, so they all run at the same time
+        self._pool.setMaxThreadCount(len(self._probes))
+        for name, probe in self._probes.items():
+            self._pool.start(_ProbeRunnable(self, name, probe))
+
+    def is_finished(self):
+        """ Returns True if all the probes are done. """
+        return self.elapsed is not None
+
+    def stop(self):
+        """ Stops emitting results (e.g. the window was closed), the running probes are left to finish. """
+        self._stopped = True
+
+    def _run_probe(self, name: str, probe):
+        """ Runs `probe` in a pool thread and emits its result. """
+        try:
+            result = probe()
+        except Exception as e:
+            # print(f"Preflight {name} failed: {e}") # For debugging purposes
+            result = None
+
+        with self._lock:
+            self.results[name] = result
+            self.durations[name] = time.perf_counter() - self._start_time
+            done = len(self.results) == len(self._probes)
+            if done:
+                self.elapsed = max(self.durations.values())
+
+        if self._stopped:
+            return
+        self.probe_finished.emit(name, result)
+        if done:
+            self.finished.emit()
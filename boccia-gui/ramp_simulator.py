@@ -0,0 +1,396 @@
+# Standard libraries
+import os
+import pty
+import sys
+import tty
+import time
+import heapq
+import random
+import select
+import threading
+
+class RampSimulator():
+    """ Simulates the Boccia ramp firmware behind a Linux pseudo-terminal.
+
+    The simulator opens a pty and answers the serial commands used by `Commands`,
+    so `SerialHandler` can connect to `port_name` as if it was the Arduino.
+
+    Supported commands:
+        - `rs0`/`rs1`: Toggle rotation left/right
+        - `es0`/`es1`: Toggle elevation down/up
+        - `dd<angle>`: Drop the ball (e.g. `dd-70`)
+        - `rc<mode>`/`ec<mode>`: Rotation/elevation calibration
+        - `rx<accel>`/`ex<speed>`: Rotation acceleration/elevation speed
+        - Several commands chained with `>` run one after the other (e.g. `dd-70>rc>ec`)
+        - `<sequence number>:<command>`: Acknowledged command, answered with `ACK <sequence number>`
+          when it is received (see Commands.ACK_VARIABLES)
+    """
+    # Responses sent back to the controller
+    RESPONSES = {
+        "rotation_start": "Rotation started: {direction}",
+        "rotation_stop": "Rotation stopped at {angle:.1f} deg",
+        "rotation_limit": "Rotation limit reached at {angle:.1f} deg",
+        "elevation_start": "Elevation started: {direction}",
+        "elevation_stop": "Elevation stopped at {elevation:.1f} %",
+        "elevation_limit": "Elevation limit reached at {elevation:.1f} %",
+        "drop_start": "Drop started",
+        "drop_complete": "Drop complete",
+        "calibration_start": "{axis} calibration started",
+        "calibration_complete": "{axis} calibration complete",
+        "speed": "{axis} speed set to {value}",
+        "ready": "Ready",
+        "ack": "ACK {sequence_number}",
+        "unknown": "Unknown command: {command}",
+        }
+
+    ROTATION_LIMIT = 90.0           # [deg] Rotation range is [-limit, limit]
+    ELEVATION_LIMIT = 100.0         # [%] Elevation range is [0, limit]
+
+    def __init__(
+            self,
+            latency:float = 0.005,
+            jitter:float = 0.002,
+            rotation_speed:float = 30.0,
+            elevation_speed:float = 20.0,
+            drop_time:float = 2.0,
+            calibration_time:float = 1.0,
+            seed:int = None,
+            loss:float = 0.0):
+        """
+            Initialize the RampSimulator object
+
+            Attributes
+            ----------
+                - `latency`: float\n
+                    Time [sec] the firmware takes to react to a command
+                - `jitter`: float\n
+                    Max random time [sec] added to `latency` for each command
+                - `rotation_speed`: float\n
+                    Rotation speed [deg/sec] at 100% acceleration
+                - `elevation_speed`: float\n
+                    Elevation speed [%/sec] at max PWM
+                - `drop_time`: float\n
+                    Time [sec] it takes to drop the ball
+                - `calibration_time`: float\n
+                    Time [sec] each calibration takes, on top of moving back to the home position
+                - `seed`: int\n
+                    Seed for the jitter, to make runs repeatable
+                - `loss`: float\n
+                    Probability [0 - 1] that a received command is lost (e.g. a noisy USB link)
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rotation_speed = rotation_speed
+        self.elevation_speed = elevation_speed
+        self.drop_time = drop_time
+        self.calibration_time = calibration_time
+        self.loss = loss
+        self._random = random.Random(seed)
+
+        # Ramp state
+        self.rotation = 0.0         # [deg]
+        self.elevation = 0.0        # [%]
+        self.rotation_accel = 50    # [%] Set with `rx`, scales the rotation speed
+        self.elevation_pwm = 153    # [51 - 255] Set with `ex`, scales the elevation speed
+        self._rotation_direction = 0    # -1: left, 0: stopped, 1: right
+        self._elevation_direction = 0   # -1: down, 0: stopped, 1: up
+        self._motion_time = None        # Time at which the position was last updated
+        self.busy = False               # True while a drop or a calibration is running
+        self.received_commands = []     # List of (time, command) received, for benchmarks
+        self.lost_commands = 0          # Number of commands lost on purpose (see `loss`)
+
+        # Pseudo-terminal and scheduler
+        self._master_fd = None
+        self._slave_fd = None
+        self.port_name = None
+        self._events = []               # Heap of (time, order, callback)
+        self._event_order = 0
+        self._chain = []                # Chained commands waiting for the current one to finish
+        self._last_command_time = 0.0   # Time at which the last received command is executed
+        self._running = False
+        self._thread = None
+        self._limit_check_id = 0        # Only the most recent limit check is valid
+
+
+    def start(self):
+        """ Open the pseudo-terminal, start the simulator thread and return the port name """
+        self._master_fd, self._slave_fd = pty.openpty()
+        tty.setraw(self._slave_fd)
+        os.set_blocking(self._master_fd, False)
+        self.port_name = os.ttyname(self._slave_fd)
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        return self.port_name
+
+
+    def stop(self):
+        """ Stop the simulator thread and close the pseudo-terminal """
+        if not self._running:
+            return
+
+        self._running = False
+        self._thread.join()
+        self._thread = None
+
+        os.close(self._master_fd)
+        os.close(self._slave_fd)
+        self._master_fd = None
+        self._slave_fd = None
+
+
+    def _run(self):
+        """ Simulator loop, waits for commands or for the next scheduled event """
+        buffer = b""
+
+        while self._running:
+            # Wake up for the next event, or periodically to check if the simulator should stop
+            timeout = 0.1
+            if self._events:
+                timeout = min(timeout, max(0, self._events[0][0] - time.monotonic()))
+
+            readable, _, _ = select.select([self._master_fd], [], [], timeout)
+            if readable:
+                try:
+                    buffer += os.read(self._master_fd, 4096)
+                except (BlockingIOError, OSError):
+                    pass    # No data, or the port was closed on the other side
+
+                # Split complete lines, keep the rest for the next read
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    command = line.decode("UTF-8", errors="replace").strip()
+                    if command:
+                        self._receive(command)
+
+            # Run the events that are due
+            now = time.monotonic()
+            while self._events and (self._events[0][0] <= now):
+                _, _, callback = heapq.heappop(self._events)
+                callback()
+
+
+    def _receive(self, command:str):
+        """ Schedule `command` after the simulated firmware latency """
+        if self.loss and (self._random.random() < self.loss):
+            self.lost_commands += 1
+            return
+
+        # Acknowledged command, e.g. `12:rx20`
+        sequence_number, separator, acknowledged_command = command.partition(":")
+        if separator and sequence_number.isdigit():
+            command = acknowledged_command
+        else:
+            sequence_number = None
+
+        self.received_commands.append((time.monotonic(), command))
+        delay = self.latency + self._random.uniform(0, self.jitter)
+
+        def execute():
+            # The ack is sent when the command is read, before it runs (a drop can take seconds)
+            if sequence_number is not None:
+                self._write("ack", sequence_number=sequence_number)
+            self._execute_chain(command.split(">"))
+
+        # Commands are handled in the order they arrive, like the firmware's serial loop
+        execute_time = max(time.monotonic() + delay, self._last_command_time)
+        self._last_command_time = execute_time
+        self._schedule_at(execute_time, execute)
+
+
+    def _schedule(self, delay:float, callback):
+        """ Run `callback` in the simulator thread after `delay` seconds """
+        self._schedule_at(time.monotonic() + delay, callback)
+
+
+    def _schedule_at(self, event_time:float, callback):
+        """ Run `callback` in the simulator thread at `event_time` (`time.monotonic()` clock) """
+        self._event_order += 1
+        heapq.heappush(self._events, (event_time, self._event_order, callback))
+
+
+    def _execute_chain(self, commands:list):
+        """ Queue `commands`, each one is executed when the ramp is not busy anymore """
+        self._chain.extend(commands)
+        self._continue_chain()
+
+
+    def _continue_chain(self):
+        """ Execute the next chained command if the ramp is not busy """
+        while self._chain and not self.busy:
+            self._execute(self._chain.pop(0).strip())
+
+
+    def _execute(self, command:str):
+        """ Execute a single firmware command """
+        name = command[:2]
+        argument = command[2:]
+
+        if name == "rs":
+            self._toggle_rotation(-1 if argument == "0" else 1)
+        elif name == "es":
+            self._toggle_elevation(-1 if argument == "0" else 1)
+        elif name == "dd":
+            self._start_task(self.drop_time, "drop_start", "drop_complete")
+        elif name == "rc":
+            home_time = abs(self._get_position()[0]) / self._get_rotation_speed()
+            self._start_task(home_time + self.calibration_time, "calibration_start", "calibration_complete", axis="Rotation", rotation=0.0)
+        elif name == "ec":
+            home_time = self._get_position()[1] / self._get_elevation_speed()
+            self._start_task(home_time + self.calibration_time, "calibration_start", "calibration_complete", axis="Elevation", elevation=0.0)
+        elif name == "rx" and argument.isdigit():
+            self._update_position()
+            self.rotation_accel = min(int(argument) * 100 // 30, 100)
+            self._write("speed", axis="Rotation", value=argument)
+            self._schedule_limit_check()
+        elif name == "ex" and argument.isdigit():
+            self._update_position()
+            self.elevation_pwm = min(int(argument), 255)
+            self._write("speed", axis="Elevation", value=argument)
+            self._schedule_limit_check()
+        else:
+            self._write("unknown", command=command)
+
+
+    def _start_task(self, duration:float, start_response:str, end_response:str, rotation:float = None, elevation:float = None, **kwargs):
+        """ Run a drop or calibration that keeps the ramp busy for `duration` seconds """
+        self._stop_motors()
+        self.busy = True
+        self._write(start_response, **kwargs)
+
+        def finish():
+            if rotation is not None:
+                self.rotation = rotation
+            if elevation is not None:
+                self.elevation = elevation
+            self.busy = False
+            self._write(end_response, **kwargs)
+            self._write("ready")
+            self._continue_chain()
+
+        self._schedule(duration, finish)
+
+
+    def _toggle_rotation(self, direction:int):
+        """ Start rotating in `direction`, or stop if already rotating that way """
+        if self.busy:
+            return
+
+        self._update_position()
+        if self._rotation_direction == direction:
+            self._rotation_direction = 0
+            self._write("rotation_stop", angle=self.rotation)
+            return
+
+        self._rotation_direction = direction
+        self._write("rotation_start", direction="right" if direction > 0 else "left")
+        self._schedule_limit_check()
+
+
+    def _toggle_elevation(self, direction:int):
+        """ Start moving the elevation in `direction`, or stop if already moving that way """
+        if self.busy:
+            return
+
+        self._update_position()
+        if self._elevation_direction == direction:
+            self._elevation_direction = 0
+            self._write("elevation_stop", elevation=self.elevation)
+            return
+
+        self._elevation_direction = direction
+        self._write("elevation_start", direction="up" if direction > 0 else "down")
+        self._schedule_limit_check()
+
+
+    def _stop_motors(self):
+        """ Stop both axes at their current position """
+        self._update_position()
+        self._rotation_direction = 0
+        self._elevation_direction = 0
+
+
+    def _get_rotation_speed(self):
+        return max(self.rotation_speed * self.rotation_accel / 100, 1e-3)
+
+
+    def _get_elevation_speed(self):
+        return max(self.elevation_speed * self.elevation_pwm / 255, 1e-3)
+
+
+    def _get_position(self):
+        """ Return the current (rotation, elevation), taking the motion since the last update into account """
+        if self._motion_time is None:
+            return self.rotation, self.elevation
+
+        elapsed = time.monotonic() - self._motion_time
+        rotation = self.rotation + self._rotation_direction * self._get_rotation_speed() * elapsed
+        elevation = self.elevation + self._elevation_direction * self._get_elevation_speed() * elapsed
+
+        rotation = min(max(rotation, -self.ROTATION_LIMIT), self.ROTATION_LIMIT)
+        elevation = min(max(elevation, 0.0), self.ELEVATION_LIMIT)
+
+        return rotation, elevation
+
+
+    def _update_position(self):
+        self.rotation, self.elevation = self._get_position()
+        self._motion_time = time.monotonic()
+
+
+    def _schedule_limit_check(self):
+        """ Stop the moving axes when they reach their limits """
+        self._update_position()
+        times = []
+        if self._rotation_direction:
+            target = self.ROTATION_LIMIT * self._rotation_direction
+            times.append(abs(target - self.rotation) / self._get_rotation_speed())
+        if self._elevation_direction:
+            target = self.ELEVATION_LIMIT if self._elevation_direction > 0 else 0.0
+            times.append(abs(target - self.elevation) / self._get_elevation_speed())
+
+        self._limit_check_id += 1
+        if times:
+            check_id = self._limit_check_id
+            self._schedule(min(times), lambda: self._check_limits(check_id))
+
+
+    def _check_limits(self, check_id:int):
+        # Skip if the motion changed after this check was scheduled
+        if check_id != self._limit_check_id:
+            return
+
+        self._update_position()
+        if self._rotation_direction and (abs(self.rotation) >= self.ROTATION_LIMIT):
+            self._rotation_direction = 0
+            self._write("rotation_limit", angle=self.rotation)
+        if self._elevation_direction and (self.elevation in (0.0, self.ELEVATION_LIMIT)):
+            self._elevation_direction = 0
+            self._write("elevation_limit", elevation=self.elevation)
+        self._schedule_limit_check()
+
+
+    def _write(self, response:str, **kwargs):
+        """ Send a response line to the controller, like `Serial.println` in the firmware """
+        line = self.RESPONSES[response].format(**kwargs) + "\r\n"
+        try:
+            os.write(self._master_fd, line.encode("UTF-8"))
+        except (BlockingIOError, OSError):
+            pass    # Nobody is reading the port, drop the response like the Arduino would
+
+
+def main():
+    simulator = RampSimulator()
+    port_name = simulator.start()
+    print(f"Ramp simulator listening on {port_name}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,4 @@
 # Import libraries
-import webbrowser
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import (
     QLabel,
@@ -14,7 +13,8 @@ from PyQt5.QtWidgets import (
 # Custom libraries
 from styles import Styles
 from commands import Commands
-from custom_combo_box import CustomComboBox
+from serial_port_watcher import SerialPortWatcher
+from macro_engine import MacroRunner
 from serial_read_window import SerialReadWindow
 
 
@@ -28,20 +28,22 @@ class SerialControlsWidget(QWidget):
 
         # Suscribe to external events
         self.serial_handler.connection_changed.connect(self._handle_connection_change)
+
+        # Keeps the port list current in the background, so opening the dropdown never blocks
+        # (Started by start_port_watcher(), once the startup preflight has listed the ports)
+        self.port_watcher = SerialPortWatcher()
+        self.port_watcher.ports_changed.connect(self._update_ports)
+
+        # Runs the calibrations and routines step by step and reports their progress, if Commands.MACRO_VARIABLES["enabled"]
+        self.macro_runner = MacroRunner(self.serial_handler)
+        self.macro_runner.progress.connect(self._handle_macro_progress)
+        self.macro_runner.finished.connect(self._handle_macro_finished)
         
-        # Settings
-        self.connect_button_styles = {
-            "connect": Styles.create_button_style("green"),
-            "disconnect": Styles.create_button_style("red"),
-            "error": Styles.create_button_style("orange")
-            }
-    
         # Main label section
         self.main_label = QLabel('SERIAL CONNECTION')
         self.main_label.setStyleSheet(Styles.MAIN_LABEL)
 
         self.help_button = QPushButton("Help")
-        self.help_button.setStyleSheet(Styles.HOVER_BUTTON)
         self.help_button.clicked.connect(self.open_help_url)
 
         self.main_label_layout = QHBoxLayout()
@@ -67,22 +69,19 @@ class SerialControlsWidget(QWidget):
 
     
     def toggle_read_serial(self):
-        if self.read_serial_button.isEnabled():
-            self.read_serial_button.setEnabled(False)
-            self.read_serial_button.setStyleSheet(Styles.DISABLED_BUTTON)
-        else:
-            self.read_serial_button.setEnabled(True)
-            self.read_serial_button.setStyleSheet(Styles.HOVER_BUTTON)
+        self.read_serial_button.setEnabled(not self.read_serial_button.isEnabled())
 
 
     def open_help_url(self):
+        # Imported when needed, webbrowser takes a few milliseconds to import
+        import webbrowser
         webbrowser.open(Commands.HELP_URL)
 
 
     def _create_connect_and_status_section(self):
         # Button section
         self.connect_button = QPushButton('Connect')
-        self.connect_button.setStyleSheet(self.connect_button_styles["connect"])
+        Styles.set_property(self.connect_button, "state", "connect")
         self.connect_button.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Minimum)
         self.scaled_margin = int(5 * Styles.SCALE_FACTOR)
         # Add small padding around text
@@ -109,7 +108,11 @@ class SerialControlsWidget(QWidget):
 
         self.calibration_combo_box = QComboBox()
         self.calibration_combo_box.setStyleSheet( f"{Styles.COMBOBOX_BASE} width: {130 * Styles.SCALE_FACTOR}px;")
-        self.calibration_combo_box.addItems(Commands.CALIBRATION_COMMANDS.keys())
+        # The calibrations are sent as single commands, unless the macros are enabled
+        if Commands.MACRO_VARIABLES["enabled"]:
+            self.calibration_combo_box.addItems(Commands.CALIBRATION_MACROS.keys())
+        else:
+            self.calibration_combo_box.addItems(Commands.CALIBRATION_COMMANDS.keys())
 
         self.calibration_section = QHBoxLayout()
         self.calibration_section.addWidget(self.calibration_label)
@@ -119,10 +122,8 @@ class SerialControlsWidget(QWidget):
         self.port_label = QLabel('COM Port')
         self.port_label.setStyleSheet(Styles.LABEL_TEXT)
 
-        self.port_combo_box = CustomComboBox(parent=self, on_mouse_press=self._populate_ports)
+        self.port_combo_box = QComboBox()
         self.port_combo_box.setStyleSheet( f"{Styles.COMBOBOX_BASE} width: {70 * Styles.SCALE_FACTOR}px;")
-        self._populate_ports()
-
 
         self.port_section = QHBoxLayout()
         self.port_section.addWidget(self.port_label)
@@ -137,19 +138,22 @@ class SerialControlsWidget(QWidget):
     def _create_serial_actions(self):
         # Calibrate button
         self.calibrate_button = QPushButton('Calibrate')
-        self.calibrate_button.setStyleSheet(Styles.HOVER_BUTTON)
         self.calibrate_button.clicked.connect(self._send_calibration_command)
         self.calibrate_button.setEnabled(False)
 
         # Read serial button
         self.read_serial_button = QPushButton('Read serial')
-        self.read_serial_button.setStyleSheet(Styles.HOVER_BUTTON)
         self.read_serial_button.clicked.connect(self._read_serial_data)
         self.read_serial_button.setEnabled(False)
 
+        # Progress of the running calibration
+        self.macro_status_label = QLabel('')
+        self.macro_status_label.setStyleSheet(Styles.LABEL_TEXT)
+
         # Organize layout
         self.serial_actions_container = QVBoxLayout()
         self.serial_actions_container.addWidget(self.calibrate_button)
+        self.serial_actions_container.addWidget(self.macro_status_label)
         self.serial_actions_container.addWidget(self.read_serial_button)
         
 
@@ -160,8 +164,36 @@ class SerialControlsWidget(QWidget):
 
     def _send_calibration_command(self):
         current_calibration = self.calibration_combo_box.currentText()
-        self.serial_handler.send_command(Commands.CALIBRATION_COMMANDS[current_calibration])
-        pass
+        if not Commands.MACRO_VARIABLES["enabled"]:
+            self.serial_handler.send_command(Commands.CALIBRATION_COMMANDS[current_calibration])
+            return
+
+        # The button cancels the calibration while it runs
+        if self.macro_runner.is_running():
+            self.macro_runner.cancel()
+            return
+
+        if self.macro_runner.run(current_calibration):
+            self.calibrate_button.setText('Cancel')
+            self.calibration_combo_box.setEnabled(False)
+
+
+    def _handle_macro_progress(self, name: str, step: int, steps: int, description: str):
+        """ Show the step the calibration is at """
+        self.macro_status_label.setText(f"{name}: {step}/{steps} {description}")
+
+
+    def _handle_macro_finished(self, name: str, success: bool, message: str):
+        """ Show how the calibration ended, and make the button start a new one """
+        self.macro_status_label.setText(f"{name}: Done" if success else f"{name}: {message}")
+        self.calibrate_button.setText('Calibrate')
+        self.calibration_combo_box.setEnabled(True)
+
+
+    def stop_macro(self):
+        """ Cancel the running calibration, e.g. when the window is closed """
+        self.macro_runner.cancel()
+        self.macro_runner.wait(1.0)
 
 
     def _read_serial_data(self):
@@ -179,36 +211,44 @@ class SerialControlsWidget(QWidget):
 
         if message == "Connected":
             self.connect_button.setText("Disconnect")
-            self.connect_button.setStyleSheet(self.connect_button_styles["disconnect"])
+            Styles.set_property(self.connect_button, "state", "disconnect")
             self._actions_enabled(True)
 
         elif message == "Error":
             self.connect_button.setText("Error")
-            self.connect_button.setStyleSheet(self.connect_button_styles["error"])
+            Styles.set_property(self.connect_button, "state", "error")
             self._actions_enabled(False)
+            self.macro_runner.cancel()
 
         elif message == "Disconnected":
             self.connect_button.setText("Connect")
-            self.connect_button.setStyleSheet(self.connect_button_styles["connect"])
+            Styles.set_property(self.connect_button, "state", "connect")
             self._actions_enabled(False)
+            self.macro_runner.cancel()
+
+
+    def _update_ports(self, added: list, removed: list):
+        """ Update the port combo box with the ports added and removed (from the port watcher) """
+        for port in removed:
+            index = self.port_combo_box.findText(port)
+            if index >= 0:
+                self.port_combo_box.removeItem(index)
+
+        # The first port is selected automatically if the combo box was empty (e.g. a ramp was plugged in)
+        self.port_combo_box.addItems(added)
 
 
-    def _populate_ports(self):
-        """ Populate the port combo box with available ports """
-        # Store current port selection
-        current_port = self.port_combo_box.currentText()
+    def start_port_watcher(self, ports: list = None):
+        """ Show the ports found by the startup preflight, then keep the list current with the port watcher """
+        if ports:
+            self._update_ports(ports, [])
+        self.port_watcher.start_watching(ports)
 
-        # Clear and populate port combo box
-        self.port_combo_box.clear()
-        ports = self.serial_handler.list_serial_ports()
-        self.port_combo_box.addItems(ports)
 
-        # Restore previous selection if available
-        index = self.port_combo_box.findText(current_port)
-        if index >= 0:
-            self.port_combo_box.setCurrentIndex(index)
-        elif ports:  # Default to first port if available
-            self.port_combo_box.setCurrentIndex(0)
+    def stop_port_watcher(self):
+        """ Stop the port watcher thread, e.g. when the window is closed """
+        self.port_watcher.stop()
+        self.port_watcher.wait()
 
 
     def _actions_enabled(self, status: bool):
@@ -1,17 +1,62 @@
+import codecs
+import queue
+import threading
+import time
+from collections import deque
 import serial
 import serial.tools.list_ports
 from PyQt5.QtCore import QThread, pyqtSignal
 
+# Custom libraries
+from commands import Commands
+from session_trace import SENT, RECEIVED
+from pipeline_tracing import tracer, LatencyHistogram
+
+class SerialLineSplitter():
+    """ Incrementally decodes raw serial bytes and splits them into lines """
+
+    def __init__(
+            self,
+            encoding:str = "UTF-8",
+            max_line_length:int = Commands.SERIAL_VARIABLES["max_line_length"]):
+        # Invalid bytes are replaced instead of raising, so a stray byte cannot stop the reader
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._max_line_length = max_line_length
+        self._partial_line = ""
+
+
+    def feed(self, data:bytes):
+        """ Add `data` to the buffer and return the list of complete, non-empty lines """
+        text = self._partial_line + self._decoder.decode(data)
+        lines = text.split("\n")
+
+        # The last item is an incomplete line (empty if `data` ended with a newline)
+        self._partial_line = lines.pop()
+        if len(self._partial_line) > self._max_line_length:
+            lines.append(self._partial_line)
+            self._partial_line = ""
+
+        return [line.strip() for line in lines if line.strip()]
+
+
 class SerialHandler(QThread):
     """ Handles serial communication with the COM ports and connected devices """
     # Events
     connection_changed = pyqtSignal(str)    # Signal to indicate a change in the connection status
     new_data = pyqtSignal(str)              # Signal to indicate new data has been received from the Arduino
+    new_data_batch = pyqtSignal(list)       # Signal with the list of lines received since the last batch
+    _batch_ready = pyqtSignal()             # Internal signal from the reader thread, delivered in the GUI thread
+    command_acknowledged = pyqtSignal(str, int, float)  # Command, sequence number and round trip [sec] (acknowledged commands)
+    command_lost = pyqtSignal(str, int)     # Command and sequence number that were not acknowledged, after the retries
 
     def __init__(
             self,
             port:str = "",
-            baudrate:int = 9600):
+            baudrate:int = 9600,
+            write_timeout:float = Commands.SERIAL_VARIABLES["write_timeout"],
+            command_queue_size:int = Commands.SERIAL_VARIABLES["command_queue_size"],
+            trace = None,
+            acknowledge:bool = Commands.ACK_VARIABLES["enabled"]):
         """
             Initialize the SerialHandler object
 
@@ -21,16 +66,55 @@ class SerialHandler(QThread):
                     The COM port to connect to
                 - `baudrate`: int\n
                     The baudrate to use for the serial connection
+                - `write_timeout`: float\n
+                    Max time [sec] a single write can block the writer thread
+                - `command_queue_size`: int\n
+                    Max number of commands waiting to be written to the port
+                - `trace`: SessionTraceRecorder\n
+                    Records the commands sent and the lines received, None to not record them
+                - `acknowledge`: bool\n
+                    Send each command with a sequence number and wait for the ramp to acknowledge it
+                    (see Commands.ACK_VARIABLES, the firmware has to support it)
         """
         super().__init__()
         self._port = port
         self._baudrate = baudrate
+        self._write_timeout = write_timeout
+        self._command_queue_size = command_queue_size
+        self.trace = trace
         
         self._serial = None
         self._connection_status = ["Connected", "Disconnected", "Error"]
         self._current_connection_status = self._connection_status[1]
         self.command_sent = False   # Flag to indicate if a command has been sent succesfully
 
+        # Writer thread, fed through a bounded queue so that `send_command` never blocks the GUI
+        self._command_queue = queue.Queue(maxsize=self._command_queue_size)
+        self._writer_thread = None
+        self._writer_running = False
+        self.dropped_commands = 0   # Number of commands dropped because the queue was full
+
+        # Reader thread (this QThread), runs while the port is connected
+        self._running = False
+        self._line_listeners = []   # Functions called by the reader thread with each list of lines, see add_line_listener()
+
+        # Received lines are batched by the reader and delivered to the GUI with a single signal
+        self._pending_lines = deque()
+        self._batch_lock = threading.Lock()
+        self._batch_pending = False     # True while a `_batch_ready` signal has not been delivered yet
+        self.batches_coalesced = 0      # Number of batches merged into a batch that was still pending
+        self.lines_dropped = 0          # Number of lines dropped because the GUI could not keep up
+        self._batch_ready.connect(self._deliver_batch)
+
+        # Acknowledged commands: {sequence number: pending command}, shared by the GUI, writer and reader threads
+        self.acknowledge = acknowledge
+        self._sequence_number = 0
+        self._pending_acks = {}
+        self._ack_lock = threading.Lock()
+        self.ack_latency = LatencyHistogram()   # Round trip of the acknowledged commands, from the write to the ack
+        self.retried_commands = 0   # Number of times a command was sent again because its ack did not arrive
+        self.lost_commands = 0      # Number of commands that were not acknowledged, after the retries
+
 
     @property
     def port(self):
@@ -51,6 +135,17 @@ class SerialHandler(QThread):
         self._serial.baudrate = baudrate   
 
 
+    @property
+    def write_timeout(self):
+        return self._write_timeout
+
+    @write_timeout.setter
+    def write_timeout(self, write_timeout):
+        self._write_timeout = write_timeout
+        if self._serial:
+            self._serial.write_timeout = write_timeout
+
+
     def toggle_serial_connection(self):
         """ Toggle the serial connection """
         if (self._current_connection_status == "Disconnected") or (self._current_connection_status == "Error"):
@@ -62,7 +157,9 @@ class SerialHandler(QThread):
     def connect(self):
         """ Open a serial connection """
         try:
-            self._serial = serial.Serial(self._port, self._baudrate)
+            self._serial = serial.Serial(self._port, self._baudrate, write_timeout=self._write_timeout)
+            self._start_writer()
+            self._start_reader()
             self._current_connection_status = self._connection_status[0]
             self.connection_changed.emit(self._current_connection_status)
         except serial.SerialException:
@@ -73,6 +170,10 @@ class SerialHandler(QThread):
     def disconnect(self):
         """ Close the serial connection """
         try:
+            self._stop_writer()
+            self._stop_reader()
+            with self._ack_lock:
+                self._pending_acks.clear()
             self._serial.close()
             self._serial = None
             self._current_connection_status = self._connection_status[1]
@@ -83,19 +184,95 @@ class SerialHandler(QThread):
         
 
     def send_command(self, command:str):
-        """ Send `command` to the serial port """
+        """ Queue `command` to be written to the serial port, returns immediately.
+            Returns the sequence number of the command if it is acknowledged (see `command_acknowledged`), else None
+        """
 
         # Skip if command is empty or only whitespaces
         if not command.strip():
-            return
+            return None
 
         if self._current_connection_status == "Connected":
+            sequence_number = self._add_pending_ack(command) if self.acknowledge else None
+            try:
+                if sequence_number is None:
+                    code_str = command + "\n"
+                else:
+                    code_str = f"{sequence_number}:{command}\n"
+                # The tracing stamp goes with the command, so the writer can measure the write
+                stamp = tracer.enqueued() if tracer.enabled else None
+                self._command_queue.put_nowait((code_str.encode("UTF-8"), stamp, sequence_number))
+                self.command_sent = True
+                if self.trace:
+                    self.trace.record(SENT, command)
+                return sequence_number
+            except queue.Full:
+                # The port is stalled, drop the command instead of blocking the GUI
+                self.dropped_commands += 1
+                self.command_sent = False
+                if sequence_number is not None:
+                    with self._ack_lock:
+                        self._pending_acks.pop(sequence_number, None)
+        return None
+
+
+    def _start_writer(self):
+        """ Start the thread that writes the queued commands to the serial port """
+        self._command_queue = queue.Queue(maxsize=self._command_queue_size)
+        self._writer_running = True
+        self._writer_thread = threading.Thread(target=self._write_commands, args=(self._serial,), daemon=True)
+        self._writer_thread.start()
+
+
+    def _stop_writer(self):
+        """ Stop the writer thread, waiting at most one write timeout for it to finish """
+        if self._writer_thread is None:
+            return
+
+        self._writer_running = False
+        try:
+            self._command_queue.put_nowait(None)   # Wake up the writer
+        except queue.Full:
+            pass    # The writer checks the flag after its current write
+
+        # A write timeout of None blocks until the write is done (pyserial), so wait for it too
+        self._writer_thread.join(None if self._write_timeout is None else self._write_timeout + 0.1)
+        self._writer_thread = None
+
+
+    def _start_reader(self):
+        """ Start the thread that reads the lines from the serial port, it runs while the port is connected
+        (e.g. the drop delay ends when the ramp reports the drop is complete)
+        """
+        self._running = True    # Set before run(), so a stop() before the thread starts is not lost
+        self.start()
+
+
+    def _stop_reader(self):
+        """ Stop the reader thread, waiting at most one read timeout for it to finish """
+        self.stop()
+        self.wait(int(1000 * (Commands.SERIAL_VARIABLES["read_timeout"] + 0.1)))
+
+
+    def _write_commands(self, port):
+        """ Writer thread loop, owns all writes to `port` """
+        while self._writer_running:
+            item = self._command_queue.get()
+            if item is None or not self._writer_running:
+                break
+
+            data, stamp, sequence_number = item
             try:
-                code_str = command + "\n"
-                self._serial.write(code_str.encode("UTF-8"))
-                #print(f"Sent serial: {code_str}")
+                if sequence_number is not None:
+                    # Before the write, so a fast ack cannot arrive before its command is marked as written
+                    self._ack_written(sequence_number)
+                port.write(data)
+                #print(f"Sent serial: {data}")
                 self.command_sent = True
+                if stamp:
+                    tracer.written(stamp)
             except Exception as e:
+                # Includes serial.SerialTimeoutException when the adapter stalls
                 #print(f"Error sending data to serial: {str(e)}")
                 self.command_sent = False
 
@@ -107,23 +284,240 @@ class SerialHandler(QThread):
         if not self._serial:
             return
         
-        self._serial.timeout = 0.1  # Non-blocking timeout
-        self._running = True
+        line_splitter = SerialLineSplitter()
+        batch_size = 0          # Number of lines read since the last batch was emitted
+        batch_deadline = None   # Time at which the current batch has to be emitted
         
         while self._running and self._serial.is_open:
             try:
-                line = self._serial.readline()
+                # Reads block until data arrives. The timeout bounds how long `stop()` takes,
+                # or how long the current batch can wait if there is one
+                # (or until the next ack is due, if commands are acknowledged)
+                if batch_deadline is None:
+                    timeout = Commands.SERIAL_VARIABLES["read_timeout"]
+                else:
+                    timeout = max(0, batch_deadline - time.monotonic())
+                if self.acknowledge:
+                    ack_deadline = self._next_ack_deadline()
+                    if ack_deadline is not None:
+                        timeout = min(timeout, max(0, ack_deadline - time.monotonic()))
+                self._set_read_timeout(timeout)
+
+                # Wait for the first byte, then drain everything already received in one call
+                data = self._serial.read(1)
                 
                 # Only process if there is data
-                if line:
-                    decoded_line = line.decode("UTF-8").strip()
-                    if decoded_line:
-                        self.new_data.emit(decoded_line)
+                if data:
+                    bytes_waiting = self._serial.in_waiting
+                    if bytes_waiting:
+                        data += self._serial.read(bytes_waiting)
+
+                    lines = line_splitter.feed(data)
+                    if lines and self.acknowledge:
+                        lines = self._handle_acks(lines)
+                    if lines:
+                        if self.trace:
+                            for line in lines:
+                                self.trace.record(RECEIVED, line)
+                        for listener in self._line_listeners:
+                            listener(lines)
+                        self._add_pending_lines(lines)
+                        batch_size += len(lines)
+                        if batch_deadline is None:
+                            batch_deadline = time.monotonic() + Commands.SERIAL_VARIABLES["batch_interval"]
+
+                if self.acknowledge:
+                    self._check_ack_timeouts()
+
+                # Emit the batch when it is full or when it is due, whichever comes first
+                if batch_deadline is not None:
+                    if (batch_size >= Commands.SERIAL_VARIABLES["batch_max_lines"]) or (time.monotonic() >= batch_deadline):
+                        self._flush_batch()
+                        batch_size = 0
+                        batch_deadline = None
                         
             except Exception as e:
-                self.new_data.emit(f"Error reading serial data: {str(e)}")
+                self._add_pending_lines([f"Error reading serial data: {str(e)}"])
                 break
 
+        # Make sure the last lines are not left behind
+        self._flush_batch()
+
+
+    def _set_read_timeout(self, timeout:float):
+        """ Change the read timeout only if needed, changing it reconfigures the port """
+        if self._serial.timeout != timeout:
+            self._serial.timeout = timeout
+
+
+    def _add_pending_lines(self, lines:list):
+        """ Add `lines` to the lines waiting for the GUI, dropping the oldest ones on overload """
+        with self._batch_lock:
+            self._pending_lines.extend(lines)
+            overflow = len(self._pending_lines) - Commands.SERIAL_VARIABLES["max_pending_lines"]
+            for _ in range(overflow):
+                self._pending_lines.popleft()
+                self.lines_dropped += 1
+
+
+    def _flush_batch(self):
+        """ Notify the GUI thread that a batch is ready, unless a notification is still pending """
+        with self._batch_lock:
+            if not self._pending_lines:
+                return
+            
+            # The pending notification will deliver these lines as well
+            if self._batch_pending:
+                self.batches_coalesced += 1
+                return
+            
+            self._batch_pending = True
+
+        self._batch_ready.emit()
+
+
+    def _deliver_batch(self):
+        """ Emit all pending lines, runs in the GUI thread """
+        with self._batch_lock:
+            lines = list(self._pending_lines)
+            self._pending_lines.clear()
+            self._batch_pending = False
+
+        if not lines:
+            return
+        
+        self.new_data_batch.emit(lines)
+
+        # The per-line signal is only emitted for consumers that still use it
+        if self.receivers(self.new_data) > 0:
+            for line in lines:
+                self.new_data.emit(line)
+
+
+    def _add_pending_ack(self, command:str):
+        """ Return the next sequence number, with `command` waiting for its ack """
+        with self._ack_lock:
+            self._sequence_number = (self._sequence_number % Commands.ACK_VARIABLES["max_sequence_number"]) + 1
+            self._pending_acks[self._sequence_number] = {
+                "command": command,
+                "attempts": 1,
+                "write_time": None,     # Time of the last write
+                "deadline": None,       # Time the ack is due, None while the command waits to be written
+                }
+            return self._sequence_number
+
+
+    def _ack_written(self, sequence_number:int):
+        """ Start waiting for the ack of a command that was just written, runs in the writer thread """
+        with self._ack_lock:
+            pending = self._pending_acks.get(sequence_number)
+            if pending:
+                pending["write_time"] = time.monotonic()
+                pending["deadline"] = pending["write_time"] + Commands.ACK_VARIABLES["timeout"]
+
+
+    def _next_ack_deadline(self):
+        """ Return the time (`time.monotonic()` clock) the next ack is due, None if none is """
+        with self._ack_lock:
+            deadlines = [pending["deadline"] for pending in self._pending_acks.values() if pending["deadline"] is not None]
+        return min(deadlines) if deadlines else None
+
+
+    def _handle_acks(self, lines:list):
+        """ Resolve the commands acknowledged by `lines`, return the other lines. Runs in the reader thread """
+        prefix = Commands.ACK_VARIABLES["ack_prefix"]
+        other_lines = []
+        for line in lines:
+            sequence_text = line[len(prefix):].strip()
+            if not (line.startswith(prefix) and sequence_text.isdigit()):
+                other_lines.append(line)
+                continue
+
+            receive_time = time.monotonic()
+            with self._ack_lock:
+                # Duplicate acks (e.g. of a command that was sent again) are ignored
+                pending = self._pending_acks.pop(int(sequence_text), None)
+            if pending is None:
+                continue
+
+            round_trip = receive_time - pending["write_time"]
+            self.ack_latency.record(int(round_trip * 1e9))
+            self.command_acknowledged.emit(pending["command"], int(sequence_text), round_trip)
+        return other_lines
+
+
+    def _check_ack_timeouts(self):
+        """ Send again the idempotent commands whose ack is late, report the others as lost. Runs in the reader thread """
+        now = time.monotonic()
+        retries = []
+        lost = []
+        with self._ack_lock:
+            for sequence_number, pending in list(self._pending_acks.items()):
+                if (pending["deadline"] is None) or (now < pending["deadline"]):
+                    continue
+
+                if self._is_idempotent(pending["command"]) and (pending["attempts"] <= Commands.ACK_VARIABLES["max_retries"]):
+                    pending["attempts"] += 1
+                    pending["deadline"] = None    # Not due until it is written again
+                    retries.append((sequence_number, pending))
+                else:
+                    del self._pending_acks[sequence_number]
+                    lost.append((sequence_number, pending))
+
+        for sequence_number, pending in retries:
+            data = f"{sequence_number}:{pending['command']}\n".encode("UTF-8")
+            try:
+                self._command_queue.put_nowait((data, None, sequence_number))
+                self.retried_commands += 1
+            except queue.Full:
+                # The port is stalled, try again after another timeout
+                with self._ack_lock:
+                    pending["deadline"] = now + Commands.ACK_VARIABLES["timeout"]
+
+        for sequence_number, pending in lost:
+            self.lost_commands += 1
+            self.command_lost.emit(pending["command"], sequence_number)
+
+
+    @staticmethod
+    def _is_idempotent(command:str):
+        """ Return True if sending `command` twice has the same effect as once (e.g. setting a speed) """
+        return command.startswith(Commands.ACK_VARIABLES["idempotent_commands"])
+
+
+    def get_ack_stats(self):
+        """ Return the round trip statistics of the acknowledged commands [sec], and the number of retried and lost commands """
+        stats = self.ack_latency.get_stats()
+        stats["retried"] = self.retried_commands
+        stats["lost"] = self.lost_commands
+        with self._ack_lock:
+            stats["pending"] = len(self._pending_acks)
+        return stats
+
+
+    def add_line_listener(self, listener):
+        """ Call `listener` with each list of lines as soon as they are read, in the reader thread
+            (e.g. the macro runner, which should not wait for the batches delivered to the GUI)
+        """
+        self._line_listeners = self._line_listeners + [listener]
+
+
+    def remove_line_listener(self, listener):
+        self._line_listeners = [item for item in self._line_listeners if item is not listener]
+
+
+    def get_pending_commands(self):
+        """ Return the number of commands waiting to be written to the port """
+        return self._command_queue.qsize()
+
+
+    def get_batch_stats(self):
+        """ Return the number of coalesced batches and dropped lines """
+        return {
+            "batches_coalesced": self.batches_coalesced,
+            "lines_dropped": self.lines_dropped,
+            }
+
 
     def stop(self):
         """ Stop the thread to read from the serial port """
@@ -0,0 +1,162 @@
+import select
+import socket
+import sys
+import time
+import serial.tools.list_ports
+from PyQt5.QtCore import QThread, pyqtSignal
+
+# Custom libraries
+from commands import Commands
+
+# Netlink protocol of the kernel device events (linux/netlink.h), not exported by the socket module
+NETLINK_KOBJECT_UEVENT = 15
+
+
+class SerialPortWatcher(QThread):
+    """ Keeps the list of serial ports current in the background, and signals the ports that were added or removed.
+
+        On Linux it waits for the kernel hotplug events of tty devices (netlink), and polls as a fallback
+        on other platforms or if the netlink socket cannot be opened.
+    """
+    # Events
+    ports_changed = pyqtSignal(list, list)  # Signal with the ports added and removed since the last scan
+
+    def __init__(
+            self,
+            poll_interval:float = Commands.SERIAL_VARIABLES["port_poll_interval"],
+            settle_delay:float = Commands.SERIAL_VARIABLES["port_settle_delay"],
+            rescan_interval:float = Commands.SERIAL_VARIABLES["port_rescan_interval"]):
+        """
+            Initialize the SerialPortWatcher object
+
+            Attributes
+            ----------
+                - `poll_interval`: float\n
+                    Time [sec] between scans when hotplug events are not available
+                - `settle_delay`: float\n
+                    Time [sec] between a hotplug event and the scan, so the device node is created first
+                - `rescan_interval`: float\n
+                    Time [sec] between scans when hotplug events are available, in case an event was missed
+        """
+        super().__init__()
+        self._poll_interval = poll_interval
+        self._settle_delay = settle_delay
+        self._rescan_interval = rescan_interval
+
+        self._ports = []    # Ports found by the last scan
+        self._initial_scan = True   # False if the ports were found before the thread started (start_watching())
+        self._running = True    # Set before run(), so a stop() before the thread starts is not lost
+
+        # stop() writes to this pair of sockets to wake up the thread
+        self._wakeup_sockets = socket.socketpair()
+        self._wakeup_sockets[0].setblocking(False)
+
+
+    @property
+    def ports(self):
+        """ Ports found by the last scan """
+        return list(self._ports)
+
+
+    @staticmethod
+    def list_ports():
+        """ Return the names of the serial ports, e.g. ['COM3'] or ['/dev/ttyUSB0'] """
+        return [port.device for port in serial.tools.list_ports.comports()]
+
+
+    def start_watching(self, ports:list = None):
+        """ Start the thread. `ports` are the ports already found (e.g. by the startup preflight),
+        they are not emitted again and the first scan waits for a hotplug event or the poll interval
+        """
+        if ports is not None:
+            self._ports = list(ports)
+            self._initial_scan = False
+        self.start()
+
+
+    def run(self):
+        """ Scan the ports, then scan again on every hotplug event or poll interval until stopped """
+        uevent_socket = self._open_uevent_socket()
+        interval = self._rescan_interval if uevent_socket else self._poll_interval
+
+        if self._initial_scan:
+            self._scan()
+            next_scan = time.monotonic() + interval
+        else:
+            # Check soon for a port plugged in between the first listing and the hotplug socket
+            next_scan = time.monotonic() + min(interval, self._poll_interval)
+        try:
+            while self._running:
+                sockets = [self._wakeup_sockets[0]] + ([uevent_socket] if uevent_socket else [])
+                ready, _, _ = select.select(sockets, [], [], max(0, next_scan - time.monotonic()))
+
+                if uevent_socket in ready and self._is_tty_event(uevent_socket):
+                    # Scan once the device has settled, several events can arrive for one device
+                    next_scan = min(next_scan, time.monotonic() + self._settle_delay)
+
+                if self._wakeup_sockets[0] in ready:
+                    self._wakeup_sockets[0].recv(1024)
+
+                if self._running and time.monotonic() >= next_scan:
+                    self._scan()
+                    next_scan = time.monotonic() + interval
+        finally:
+            if uevent_socket:
+                uevent_socket.close()
+
+
+    def stop(self):
+        """ Stop the thread, can be called from any thread """
+        self._running = False
+        try:
+            self._wakeup_sockets[1].send(b"\0")
+        except OSError:
+            pass
+
+
+    def _scan(self):
+        """ List the serial ports and emit the ports added or removed since the last scan """
+        try:
+            ports = self.list_ports()
+        except Exception as e:
+            # print(f"Error listing serial ports: {e}")  # For debugging purposes
+            return
+
+        added = [port for port in ports if port not in self._ports]
+        removed = [port for port in self._ports if port not in ports]
+        self._ports = ports
+
+        if added or removed:
+            self.ports_changed.emit(added, removed)
+
+
+    def _open_uevent_socket(self):
+        """ Return a socket that receives the kernel hotplug events, or None if they are not available """
+        if not sys.platform.startswith("linux"):
+            return None
+
+        try:
+            uevent_socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            # Port id 0 lets the kernel assign one, group 1 is the kernel events (group 2 is udev)
+            uevent_socket.bind((0, 1))
+            uevent_socket.setblocking(False)
+            return uevent_socket
+        except (AttributeError, OSError):
+            return None
+
+
+    def _is_tty_event(self, uevent_socket):
+        """ Read the pending hotplug events, return True if any of them is about a tty device """
+        is_tty = False
+        while True:
+            try:
+                event = uevent_socket.recv(8192)
+            except (BlockingIOError, InterruptedError):
+                return is_tty
+            except OSError:
+                # Events were lost (e.g. the buffer overflowed), scan to be safe
+                return True
+
+            # e.g. b"add@/devices/.../ttyUSB0\0ACTION=add\0DEVPATH=...\0SUBSYSTEM=tty\0DEVNAME=ttyUSB0\0..."
+            if b"\0SUBSYSTEM=tty\0" in event:
+                is_tty = True
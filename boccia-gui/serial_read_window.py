@@ -2,48 +2,60 @@
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import (
     QDialog,
-    QScrollArea,
-    QLabel,
+    QPlainTextEdit,
     QVBoxLayout
     )
 
+# Custom libraries
+from commands import Commands
+
 class SerialReadWindow(QDialog):
-    def __init__(self, parent):
+    def __init__(self, parent, max_lines:int = Commands.SERIAL_VARIABLES["max_log_lines"]):
         super().__init__()
         self.parent = parent
+
+        # Only the last `max_lines` lines are shown, older lines are discarded
+        self.max_lines = max_lines
+
         self.init_ui()
         self.show()
         self.exec_()
 
     def init_ui(self):
-        self.scroll = QScrollArea()
-        self.scroll.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
-        self.scroll.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-
         self.setWindowTitle('Serial Port Reader')
         self.setGeometry(100, 100, 400, 300)
 
         layout = QVBoxLayout()
 
-        self.output_label = QLabel('Reading data from serial port\n')
-        self.output_label.setWordWrap(True)  # Ensure text wraps within the label
-        self.scroll.setWidget(self.output_label)
-        self.scroll.setWidgetResizable(True)  # Ensure the scroll area resizes with the content
+        # Append-only text view, the block count limit drops the oldest lines
+        self.output_text = QPlainTextEdit()
+        self.output_text.setReadOnly(True)
+        self.output_text.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.output_text.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
+        self.output_text.setMaximumBlockCount(self.max_lines)
+        self.output_text.setUndoRedoEnabled(False)
+        self.output_text.appendPlainText('Reading data from serial port')
 
-        layout.addWidget(self.scroll)
+        layout.addWidget(self.output_text)
         self.setLayout(layout)
 
-        self.parent.serial_handler.new_data.connect(self.update_output)
-        self.parent.serial_handler.start()
+        # The serial handler reads the port while it is connected, the window only shows the lines
+        self.parent.serial_handler.new_data_batch.connect(self.update_output)
         self.parent.serial_controls_widget.toggle_read_serial()
 
 
-    def update_output(self, data):
-        #print(data)  # Print to terminal
-        self.output_label.setText(self.output_label.text() + data + '\n')
+    def update_output(self, lines):
+        #print(lines)  # Print to terminal
+
+        # Only the lines that fit in the view need to be rendered
+        if len(lines) > self.max_lines:
+            lines = lines[-self.max_lines:]
+
+        # Add the whole batch as a single block of text
+        self.output_text.appendPlainText('\n'.join(lines))
 
 
     def closeEvent(self, event):
+        self.parent.serial_handler.new_data_batch.disconnect(self.update_output)
         self.parent.serial_controls_widget.toggle_read_serial()
-        self.parent.serial_handler.stop()
         event.accept()
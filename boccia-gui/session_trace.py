@@ -0,0 +1,529 @@
+# Import libraries
+import os
+import re
+import json
+import time
+import struct
+import datetime
+import threading
+from collections import deque
+
+# NumPy is only needed to read the traces, the app records them without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from commands import Commands
+
+# File layout:
+#   header: magic, format version, record size, reserved
+#   records: monotonic time [nsec], command id, source, player, 2 bytes of padding
+# The command ids index the strings in the sidecar file `<trace>.strings` (one JSON string per line)
+# The serial lines are recorded with their numbers replaced by "#" (e.g. "Rotation stopped at # deg"), so the
+# strings are the commands and the types of lines, and the strings above max_strings are recorded as OTHER_STRING
+HEADER = struct.Struct("<8sHHI")
+MAGIC = b"BOCTRACE"
+VERSION = 1
+RECORD = struct.Struct("<qIBBxx")
+NUMBER_PATTERN = re.compile(r"[-+]?\d+(?:\.\d+)?")
+OTHER_STRING = "<other>"
+
+# Sources of the records
+SESSION = 0     # Start of a session, the command is the wall-clock start time (ISO 8601)
+SENT = 1        # Command written by SerialHandler.send_command
+RECEIVED = 2    # Line read from the serial port
+DEVICE = 3      # Command received from a multiplayer device (BluetoothServer.command_received)
+KEY = 4         # Hold or toggle key pressed on the main device (KeyPressHandler)
+KEY_RELEASE = 5 # Hold key released on the main device (KeyPressHandler)
+BUTTON = 6      # Button clicked on the main device, the command is the text of the button
+SOURCE_NAMES = ("session", "sent", "received", "device", "key", "key_release", "button")
+
+# NumPy view of a record, same layout as RECORD
+if np is not None:
+    RECORD_DTYPE = np.dtype({
+        "names": ["time", "command", "source", "player"],
+        "formats": ["<i8", "<u4", "u1", "u1"],
+        "offsets": [0, 8, 12, 13],
+        "itemsize": RECORD.size,
+    })
+
+
+def get_trace_path(date: datetime.date = None, directory: str = None):
+    """ Returns the path of the trace file of `date` (one file per day).
+
+    Parameters
+    ----------
+    date : datetime.date
+        Day of the trace. Defaults to today.
+    directory : str
+        Directory of the traces. Defaults to the directory set in Commands.TRACE_VARIABLES.
+
+    Returns
+    -------
+    path : str
+        Path of the trace file (e.g. "~/.boccia-gui/sessions/2024-05-14.trace", expanded).
+    """
+    date = date if date else datetime.date.today()
+    directory = directory if directory else Commands.TRACE_VARIABLES["directory"]
+    return os.path.join(os.path.expanduser(directory), f"{date.isoformat()}.trace")
+
+
+def remove_old_traces(retention_days: int = None, directory: str = None, today: datetime.date = None):
+    """ Deletes the trace files (and their strings files) of the days before the retention period.
+
+    Parameters
+    ----------
+    retention_days : int
+        [days] Number of days kept, including today. Defaults to the retention set in Commands.TRACE_VARIABLES.
+        0 keeps all the traces.
+    directory : str
+        Directory of the traces. Defaults to the directory set in Commands.TRACE_VARIABLES.
+    today : datetime.date
+        Day the retention period ends. Defaults to today.
+
+    Returns
+    -------
+    list
+        Paths of the deleted files.
+    """
+    retention_days = Commands.TRACE_VARIABLES["retention_days"] if retention_days is None else retention_days
+    if retention_days <= 0:
+        return []
+    directory = os.path.expanduser(directory if directory else Commands.TRACE_VARIABLES["directory"])
+    oldest = (today if today else datetime.date.today()) - datetime.timedelta(days=retention_days - 1)
+
+    try:
+        entries = os.listdir(directory)
+    except OSError:
+        return []
+
+    removed = []
+    for entry in entries:
+        # Only the files named by get_trace_path(), e.g. "2024-05-14.trace" and "2024-05-14.trace.strings"
+        day = entry.split(".", 1)[0]
+        if entry not in (f"{day}.trace", f"{day}.trace.strings"):
+            continue
+        try:
+            if datetime.date.fromisoformat(day) >= oldest:
+                continue
+            os.remove(os.path.join(directory, entry))
+        except (ValueError, OSError):
+            continue
+        removed.append(os.path.join(directory, entry))
+    return removed
+
+
+def player_number(player: str):
+    """ Returns the number of `player` (e.g. 2 for "Player 2"), 0 if it is not a player (e.g. the operator). """
+    digits = "".join(character for character in str(player) if character.isdigit())
+    return int(digits) if digits else 0
+
+
+class SessionTraceRecorder():
+    """ Appends a fixed-size record for every command and serial line of a session to a binary trace file.
+
+    Several sessions can be appended to the same file (e.g. one file per day), each one starts with a
+    SESSION record. `record()` can be called from any thread. It only packs the record into a buffer in memory,
+    the new strings and the records are written to disk by a background thread, so it does not add latency to the
+    send path or the serial reader.
+    """
+
+    def __init__(
+            self,
+            path: str = None,
+            buffer_size: int = Commands.TRACE_VARIABLES["buffer_size"],
+            flush_interval: float = Commands.TRACE_VARIABLES["flush_interval"],
+            max_strings: int = Commands.TRACE_VARIABLES["max_strings"]):
+        """ Opens the trace file for appending and starts a new session.
+
+        Parameters
+        ----------
+        path : str
+            Path of the trace file, created if it does not exist. Defaults to today's file (see get_trace_path).
+        buffer_size : int
+            [bytes] Size of the buffer, the background thread writes it to disk when it is full.
+        flush_interval : float
+            [sec] Max time a record waits in the buffer before it is written to disk.
+        max_strings : int
+            Max number of distinct strings in the trace file, the strings after it are recorded as OTHER_STRING.
+            The session start times are always kept.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        OSError
+            If the trace file cannot be created or opened.
+        ValueError
+            If the file exists and is not a trace file.
+
+        Attributes
+        ----------
+        path : str
+            Path of the trace file.
+        records_written : int
+            Number of records written in this session.
+        _strings : dict
+            Id of each string of the trace {string: command id}.
+        _new_strings : list
+            Strings added since the last flush, written to the sidecar file before the records that use them.
+        _records : collections.deque
+            Records packed since the last flush, appended and popped without a lock.
+        _strings_file : file
+            Sidecar file with the strings.
+        _file : io.BufferedWriter
+            Trace file, opened for appending.
+        """
+        self.path = path if path else get_trace_path()
+        self.records_written = 0
+        self._buffer_records = max(1, buffer_size // RECORD.size)
+        self._flush_interval = flush_interval
+        self._max_strings = max_strings
+        self._lock = threading.Lock()       # Protects the strings
+        self._write_lock = threading.Lock() # Keeps the strings and records of each flush in order
+        self._closed = threading.Event()
+        self._wake = threading.Event()      # Set when the buffer is full or the recorder is closed
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._prepare_file()
+        self._strings = {string: command_id for command_id, string in enumerate(read_strings(self.path, repair=True))}
+        self._new_strings = []
+        self._records = deque()
+        self._strings_file = open(self.path + ".strings", "a", encoding="utf-8", newline="\n")
+        self._file = open(self.path, "ab")
+        self._players = {}  # Cache of player_number()
+
+        # Mark the start of the session with its wall-clock time
+        self.record(SESSION, datetime.datetime.now().isoformat(timespec="seconds"))
+
+        self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flush_thread.start()
+
+    def record(self, source: int, text: str, player: str = ""):
+        """ Appends a record of `text` (a command or a serial line) from `source`.
+
+        Parameters
+        ----------
+        source : int
+            Source of the record (e.g. SENT or DEVICE).
+        text : str
+            Command or serial line (recorded with its numbers replaced by "#").
+        player : str
+            Player that sent the command (e.g. "Player 2"), empty if it is not a player.
+
+        Returns
+        -------
+        None
+        """
+        timestamp = time.monotonic_ns()
+        if self._closed.is_set():
+            return
+
+        command_id = self._strings.get(text)
+        if command_id is None:
+            command_id = self._add_string(source, text)
+
+        number = self._players.get(player)
+        if number is None:
+            number = self._players[player] = player_number(player)
+
+        self._records.append(RECORD.pack(timestamp, command_id, source, number))
+        self.records_written += 1
+        if len(self._records) >= self._buffer_records:
+            self._wake.set()
+
+    def flush(self):
+        """ Writes the new strings, then the buffered records, to disk. """
+        with self._write_lock:
+            # Records are counted before the strings are taken, so the strings of all of them are written
+            count = len(self._records)
+            with self._lock:
+                strings, self._new_strings = self._new_strings, []
+            records = b"".join([self._records.popleft() for _ in range(count)])
+            try:
+                if strings:
+                    self._strings_file.write("".join(json.dumps(string) + "\n" for string in strings))
+                    self._strings_file.flush()
+                if records:
+                    self._file.write(records)
+                    self._file.flush()
+            except ValueError:
+                pass    # Already closed
+
+    def close(self):
+        """ Stops the recorder and writes the remaining records. Records after this are ignored. """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._wake.set()
+        self._flush_thread.join()
+        self._file.close()
+        self._strings_file.close()
+
+    def _add_string(self, source: int, text: str):
+        """ Returns the id of `text`, assigns the next id to it if it is new (written by the next flush).
+        The numbers of the serial lines are replaced by "#", and the strings after max_strings share the id of OTHER_STRING.
+        """
+        if source == RECEIVED:
+            text = NUMBER_PATTERN.sub("#", text)
+        with self._lock:
+            command_id = self._strings.get(text)
+            if (command_id is None) and (source != SESSION) and (len(self._strings) >= self._max_strings):
+                text = OTHER_STRING
+                command_id = self._strings.get(text)
+            if command_id is None:
+                command_id = len(self._strings)
+                self._strings[text] = command_id
+                self._new_strings.append(text)
+        return command_id
+
+    def _prepare_file(self):
+        """ Writes the header of a new trace file, or checks the header of an existing one.
+        A record cut short (e.g. the app was closed by a power cut) is removed, so new records stay aligned.
+        """
+        with open(self.path, "a+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0))
+                return
+
+            f.seek(0)
+            check_header(f.read(HEADER.size), self.path)
+            extra = (size - HEADER.size) % RECORD.size
+            if extra:
+                f.truncate(size - extra)
+
+    def _flush_loop(self):
+        """ Background thread, writes the buffer to disk every flush interval, or when it is full, until closed. """
+        while not self._closed.is_set():
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+
+class SessionTraceReader():
+    """ Reads a trace file written by SessionTraceRecorder, without loading it.
+
+    The records are a NumPy structured array (fields "time", "command", "source" and "player") mapped to
+    the file, so a full day of sessions opens instantly. Requires NumPy.
+    """
+
+    def __init__(self, path: str = None):
+        """ Opens the trace file.
+
+        Parameters
+        ----------
+        path : str
+            Path of the trace file. Defaults to today's file (see get_trace_path).
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        ImportError
+            If NumPy is not installed.
+        ValueError
+            If the file is not a trace file.
+
+        Attributes
+        ----------
+        path : str
+            Path of the trace file.
+        records : numpy.ndarray
+            Records written when the file was opened, read-only memory map.
+        strings : list
+            Strings of the trace, indexed by the command ids.
+        """
+        if np is None:
+            raise ImportError("NumPy is required to read session traces (pip install numpy)")
+
+        self.path = path if path else get_trace_path()
+        with open(self.path, "rb") as f:
+            check_header(f.read(HEADER.size), self.path)
+            size = f.seek(0, os.SEEK_END)
+
+        count = (size - HEADER.size) // RECORD.size
+        if count > 0:
+            self.records = np.memmap(self.path, dtype=RECORD_DTYPE, mode="r", offset=HEADER.size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)  # Memory maps cannot be empty
+
+        self.strings = read_strings(self.path)
+        self._string_ids = {string: command_id for command_id, string in enumerate(self.strings)}
+
+    def __len__(self):
+        return len(self.records)
+
+    def command_id(self, text: str):
+        """ Returns the id of `text` in this trace, -1 if it was never recorded. """
+        return self._string_ids.get(text, -1)
+
+    def command_text(self, command_id: int):
+        """ Returns the command or serial line with `command_id`. """
+        return self.strings[command_id]
+
+    def sessions(self):
+        """ Returns the sessions of the trace.
+
+        Returns
+        -------
+        sessions : list
+            A dictionary for each session, with the wall-clock "start" time (str), the "first" and "last"
+            record indices and the "duration" [sec] from the start to the last record.
+        """
+        starts = np.flatnonzero(self.records["source"] == SESSION)
+        ends = np.append(starts[1:], len(self.records)) - 1
+        times = self.records["time"]
+        return [{
+            "start": self.strings[self.records["command"][first]],
+            "first": int(first),
+            "last": int(last),
+            "duration": (int(times[last]) - int(times[first])) / 1e9,
+            } for first, last in zip(starts, ends)]
+
+    def session_ids(self):
+        """ Returns the index of the session of each record (0 for the first session). """
+        return np.cumsum(self.records["source"] == SESSION) - 1
+
+    def throws(self, drop_command: str = Commands.CALIBRATION_COMMANDS["Drop"]):
+        """ Returns the indices of the drops requested by players and sent to the ramp.
+
+        A key, button or device command counts as a throw if the next command sent is the drop, before
+        another key, button or device command (e.g. a drop key pressed during the drop delay is not sent).
+
+        Parameters
+        ----------
+        drop_command : str
+            Command of the drop.
+
+        Returns
+        -------
+        indices : numpy.ndarray
+            Indices of the key, button and device records of the throws.
+        """
+        drop_id = self.command_id(drop_command)
+        source = self.records["source"]
+        inputs = np.flatnonzero(self._is_input())
+        sent = np.flatnonzero(source == SENT)
+        if drop_id < 0 or len(inputs) == 0 or len(sent) == 0:
+            return np.zeros(0, dtype=np.intp)
+
+        # First command sent after each input, and the input after it
+        next_sent = np.searchsorted(sent, inputs)
+        has_sent = next_sent < len(sent)
+        inputs, next_sent = inputs[has_sent], sent[next_sent[has_sent]]
+        next_input = np.append(inputs[1:], len(source))
+        session = self.session_ids()
+
+        is_throw = (
+            (self.records["command"][next_sent] == drop_id)
+            & (next_sent < next_input)
+            & (session[inputs] == session[next_sent])
+            )
+        return inputs[is_throw]
+
+    def throws_per_hour(self, drop_command: str = Commands.CALIBRATION_COMMANDS["Drop"]):
+        """ Returns the number of throws per hour of each player, over the duration of all the sessions.
+
+        Returns
+        -------
+        throws_per_hour : dict
+            {player number: throws per hour}, 0 is the operator.
+        """
+        hours = sum(session["duration"] for session in self.sessions()) / 3600
+        if hours <= 0:
+            return {}
+
+        players, counts = np.unique(self.records["player"][self.throws(drop_command)], return_counts=True)
+        return {int(player): int(count) / hours for player, count in zip(players, counts)}
+
+    def reaction_times(self, ready_line: str = "Ready"):
+        """ Returns the reaction times of each player.
+
+        The reaction time is the time from the ramp reporting it is ready (`ready_line` read from the
+        serial port) to the first key, button or device command after it, from the player who sent that command.
+
+        Parameters
+        ----------
+        ready_line : str
+            Line the ramp sends when it is ready for the next command. Its numbers match any number, as recorded.
+
+        Returns
+        -------
+        reaction_times : dict
+            {player number: numpy.ndarray of reaction times [sec]}, 0 is the operator.
+        """
+        ready_id = self.command_id(NUMBER_PATTERN.sub("#", ready_line))
+        source = self.records["source"]
+        readies = np.flatnonzero((source == RECEIVED) & (self.records["command"] == ready_id))
+        inputs = np.flatnonzero(self._is_input())
+        if ready_id < 0 or len(readies) == 0 or len(inputs) == 0:
+            return {}
+
+        # First input after each ready, counted once even if the ramp sent several readies before it
+        first_input = np.searchsorted(inputs, readies)
+        has_input = first_input < len(inputs)
+        readies, first_input = readies[has_input], inputs[first_input[has_input]]
+        is_last_ready = np.append(first_input[1:] != first_input[:-1], True)
+        readies, first_input = readies[is_last_ready], first_input[is_last_ready]
+
+        session = self.session_ids()
+        same_session = session[readies] == session[first_input]
+        readies, first_input = readies[same_session], first_input[same_session]
+
+        times = (self.records["time"][first_input] - self.records["time"][readies]) / 1e9
+        players = self.records["player"][first_input]
+        return {int(player): times[players == player] for player in np.unique(players)}
+
+    def _is_input(self):
+        """ Returns a boolean array, True for the commands of the players and the operator (keys, buttons and devices). """
+        source = self.records["source"]
+        return (source == KEY) | (source == BUTTON) | (source == DEVICE)
+
+
+def check_header(header: bytes, path: str):
+    """ Raises ValueError if `header` is not the header of a trace file this version can read. """
+    if len(header) < HEADER.size:
+        raise ValueError(f"{path} is not a session trace (file too short)")
+
+    magic, version, record_size, _ = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a session trace")
+    if (version != VERSION) or (record_size != RECORD.size):
+        raise ValueError(f"{path} has an unsupported trace version ({version}, {record_size} byte records)")
+
+
+def read_strings(path: str, repair: bool = False):
+    """ Returns the strings of the trace at `path` (from its `.strings` sidecar), indexed by command id.
+    A line cut short (e.g. by a power cut) is ignored, and removed from the file if `repair` is True
+    (no record was written with its id).
+    """
+    strings_path = path + ".strings"
+    if not os.path.exists(strings_path):
+        return []
+
+    strings = []
+    valid_size = 0
+    with open(strings_path, "rb") as f:
+        for line in f:
+            try:
+                if not line.endswith(b"\n"):
+                    break
+                strings.append(json.loads(line))
+            except ValueError:
+                break
+            valid_size += len(line)
+
+    if repair and (valid_size != os.path.getsize(strings_path)):
+        with open(strings_path, "r+b") as f:
+            f.truncate(valid_size)
+    return strings
@@ -1,3 +1,6 @@
+# Standard libraries
+from PyQt5.QtWidgets import QApplication
+
 class Styles:
     # Backgrounds
     WINDOW_BACKGROUND = "background-color: #2d2d2d; color: #ffffff;"
@@ -23,17 +26,6 @@ class Styles:
         }}
     """
     
-    DISABLED_BUTTON = f"""
-        QPushButton {{
-            font-size: {16 * SCALE_FACTOR}px;
-            color: #a9a9a9;
-            padding: {5 * SCALE_FACTOR}px;
-            border-radius: {5 * SCALE_FACTOR}px;
-            border: {1 * SCALE_FACTOR}px solid #a9a9a9;
-            background-color: #3c3c3c;
-        }}
-    """
-
     HOVER_BUTTON = f"""
         {BUTTON_BASE}
         QPushButton:hover {{background-color: #555555}}        
@@ -73,12 +65,50 @@ class Styles:
         }}
 """
 
-    
+
+    # Application stylesheet, parsed once by Qt (see apply_app_stylesheet())
+    # State changes only flip the state of the widgets, instead of setting a new stylesheet on each of them:
+        # Disabled buttons use the :disabled pseudo-state, so setEnabled() is enough
+        # Buttons with a "state" property ("connect", "disconnect" or "error") use its color, see set_property()
+        # Operator buttons (object name "operatorButton") are square
+        # Latency labels with a "degraded" property set to True are highlighted (object name "latencyLabel")
+        # The Bluetooth adapter label is highlighted if its "missing" property is True (object name "adapterLabel")
+    # The :disabled rule is last, so it wins over the state colors
+    APP_STYLESHEET = f"""
+        QWidget {{ {WINDOW_BACKGROUND} }}
+        {HOVER_BUTTON}
+        QPushButton[state="connect"] {{ background-color: green; }}
+        QPushButton[state="disconnect"] {{ background-color: red; }}
+        QPushButton[state="error"] {{ background-color: orange; }}
+        QPushButton#operatorButton {{
+            width: {50 * SCALE_FACTOR}px;
+            height: {50 * SCALE_FACTOR}px;
+        }}
+        QPushButton:disabled {{
+            color: #a9a9a9;
+            border: {1 * SCALE_FACTOR}px solid #a9a9a9;
+            background-color: #3c3c3c;
+        }}
+        QLabel#latencyLabel, QLabel#adapterLabel {{ {LABEL_TEXT} }}
+        QLabel#latencyLabel[degraded="true"], QLabel#adapterLabel[missing="true"] {{ color: orange; }}
+    """
+
+
     @staticmethod
-    def create_button_style(brackground_color:str):
-        return f"""
-            {Styles.BUTTON_BASE}
-            QPushButton {{
-            background-color: {brackground_color};
-            }}
-        """
+    def apply_app_stylesheet():
+        """ Set APP_STYLESHEET on the application, if it is not set yet (called by each window) """
+        app = QApplication.instance()
+        if app.styleSheet() != Styles.APP_STYLESHEET:
+            app.setStyleSheet(Styles.APP_STYLESHEET)
+
+
+    @staticmethod
+    def set_property(widget, name:str, value):
+        """ Set a dynamic property used by APP_STYLESHEET, and update the style of `widget` only if it changed """
+        if widget.property(name) == value:
+            return
+
+        widget.setProperty(name, value)
+        # Qt does not update the style when a property changes, the widget has to be polished again
+        widget.style().unpolish(widget)
+        widget.style().polish(widget)
@@ -0,0 +1,247 @@
+# Import libraries
+import os
+import socket
+
+from bt_devices import BluetoothDevices
+from commands import Commands
+
+class Transport():
+    """ Base class for the socket types used by the BluetoothServer and BluetoothClient classes.
+    Each transport creates the sockets and knows how to address the server device.
+    """
+    # Name used to select the transport in Commands.TRANSPORT_VARIABLES
+    name = ""
+
+    def create_server_socket(self, backlog: int):
+        """ Creates the server socket, bound and listening for connections.
+
+        Parameters
+        ----------
+        backlog : int
+            Max number of connections that can be queued.
+
+        Returns
+        -------
+        socket.socket
+            The server socket.
+        """
+        raise NotImplementedError
+
+    def close_server_socket(self, server):
+        """ Closes the server socket.
+
+        Parameters
+        ----------
+        server : socket.socket
+            The server socket.
+
+        Returns
+        -------
+        None
+        """
+        server.close()
+
+    def configure_connection(self, connection):
+        """ Sets the options of a connected socket (accepted by the server or created by the client).
+
+        Parameters
+        ----------
+        connection : socket.socket
+            The connected socket.
+
+        Returns
+        -------
+        None
+        """
+        pass
+
+    def create_client_socket(self):
+        """ Creates a client socket, not connected yet.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        socket.socket
+            The client socket.
+        """
+        raise NotImplementedError
+
+    def get_server_devices(self):
+        """ Retrieves the devices a client can connect to.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list
+            A list of tuples containing the name, address, and description of each device.
+        """
+        raise NotImplementedError
+
+    def invalidate_devices(self):
+        """ Discards any cached device information, so it is retrieved again on the next call.
+        Called after the server could not start or the client could not connect.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        pass
+
+    def get_connect_address(self, address: str):
+        """ Returns the socket address used to connect to a server device.
+
+        Parameters
+        ----------
+        address : str
+            The address of the device, as returned by get_server_devices().
+
+        Returns
+        -------
+        tuple or str
+            The address to pass to socket.connect().
+        """
+        raise NotImplementedError
+
+
+class RFCOMMTransport(Transport):
+    """ Bluetooth RFCOMM sockets, using the channel defined in the Commands class. """
+    name = "rfcomm"
+
+    def __init__(self):
+        """ Initializes the RFCOMMTransport class.
+
+        Attributes
+        ----------
+        bluetooth_devices : BluetoothDevices
+            Instance of BluetoothDevices class.
+        """
+        self.bluetooth_devices = BluetoothDevices()
+
+        # Start looking for the adapter and paired devices in the background
+        # (Each lookup takes seconds, the results are cached for the server and the clients)
+        self.bluetooth_devices.prefetch()
+
+    def create_server_socket(self, backlog: int):
+        # Get the address of the Bluetooth adapter of the local machine
+        # This is the server address since this device is the server
+        local_bluetooth_adapter = self.bluetooth_devices.get_local_bluetooth_adapter()
+
+        # Raise an error if no adapters are found
+        if not local_bluetooth_adapter:
+            raise OSError("No Bluetooth adapter found")
+
+        # Use the first adapter in the list
+        # (There should only be one item in the list if get_local_bluetooth_adapter() worked correctly)
+        _, address, _ = local_bluetooth_adapter[0]
+
+        # If the address of the adapter is not known (BlueZ), listen on any adapter
+        server = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+        server.bind((address or socket.BDADDR_ANY, Commands.BLUETOOTH_VARIABLES["RFCOMM_channel"]))
+        server.listen(backlog)
+        return server
+
+    def create_client_socket(self):
+        return socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+
+    def get_server_devices(self):
+        # The main device has to be paired via Bluetooth to this device
+        return self.bluetooth_devices.get_paired_bluetooth_devices()
+
+    def invalidate_devices(self):
+        self.bluetooth_devices.invalidate_cache()
+
+    def get_connect_address(self, address: str):
+        return (address, Commands.BLUETOOTH_VARIABLES["RFCOMM_channel"])
+
+
+class TCPTransport(Transport):
+    """ TCP sockets with TCP_NODELAY, to play over a local network. """
+    name = "tcp"
+
+    def create_server_socket(self, backlog: int):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((Commands.TRANSPORT_VARIABLES["tcp_bind_host"], Commands.TRANSPORT_VARIABLES["tcp_port"]))
+        server.listen(backlog)
+        return server
+
+    def configure_connection(self, connection):
+        # Send each command right away instead of waiting to merge it with the next one
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def create_client_socket(self):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.configure_connection(client)
+        return client
+
+    def get_server_devices(self):
+        host = Commands.TRANSPORT_VARIABLES["tcp_server_host"]
+        port = Commands.TRANSPORT_VARIABLES["tcp_port"]
+        return [(f"{host}:{port}", host, "TCP")]
+
+    def get_connect_address(self, address: str):
+        return (address, Commands.TRANSPORT_VARIABLES["tcp_port"])
+
+
+class UnixSocketTransport(Transport):
+    """ Unix domain sockets, to run the server and the clients on the same machine. """
+    name = "unix"
+
+    def create_server_socket(self, backlog: int):
+        path = Commands.TRANSPORT_VARIABLES["unix_socket_path"]
+
+        # Remove the socket file left by a previous server
+        if os.path.exists(path):
+            os.remove(path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(backlog)
+        return server
+
+    def close_server_socket(self, server):
+        path = server.getsockname()
+        server.close()
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def create_client_socket(self):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    def get_server_devices(self):
+        path = Commands.TRANSPORT_VARIABLES["unix_socket_path"]
+        return [(path, path, "Unix socket")]
+
+    def get_connect_address(self, address: str):
+        return address
+
+
+TRANSPORTS = {transport.name: transport for transport in (RFCOMMTransport, TCPTransport, UnixSocketTransport)}
+
+def get_transport(name: str = None):
+    """ Creates the transport selected by `name`.
+
+    Parameters
+    ----------
+    name : str
+        Name of the transport ("rfcomm", "tcp" or "unix").
+        Defaults to the transport set in Commands.TRANSPORT_VARIABLES.
+
+    Returns
+    -------
+    Transport
+        Instance of the selected transport.
+    """
+    if name is None:
+        name = Commands.TRANSPORT_VARIABLES["transport"]
+    return TRANSPORTS[name]()
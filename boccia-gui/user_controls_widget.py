@@ -1,5 +1,4 @@
 # Standard libraries
-from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtWidgets import (
     QWidget,
     QHBoxLayout,    
@@ -11,16 +10,17 @@ from PyQt5.QtWidgets import (
 # Custom libraries
 from styles import Styles
 from commands import Commands
+from session_trace import BUTTON
 
 
 class UserControlsWidget(QWidget):
-    button_service_flag_changed = pyqtSignal(bool)
-
-    def __init__(self, serial_handler = None, commands = None):
+    def __init__(self, control_state = None, trace = None):
         super().__init__()
 
-        self.serial_handler = serial_handler
-        self.commands = commands
+        self.control_state = control_state  # Sends the commands and keeps the service state
+        self.trace = trace  # SessionTraceRecorder for the button clicks, or None
+
+        self.command_buttons = []
 
         # Main label section
         self.controls_label = QLabel('USER CONTROLS')
@@ -34,7 +34,7 @@ class UserControlsWidget(QWidget):
         self.main_layout.addWidget(self.controls_label)
         self.main_layout.addLayout(self.commands_section_layout)
 
-        self.service_flag = False
+        self.control_state.subscribe(self._handle_control_state_change)
 
     def _create_commands_section(self):
         # Create commands labels
@@ -61,10 +61,10 @@ class UserControlsWidget(QWidget):
     
     
     def _create_command_button(self, button_text:str = ""):
-        """ Create a QPushButton for the command and sets the default style """
+        """ Create a QPushButton for the command, styled by the application stylesheet """
         button = QPushButton(button_text)
-        button.setStyleSheet(Styles.HOVER_BUTTON)
         button.clicked.connect(self._handle_command_click)
+        self.command_buttons.append(button)
 
         return button
     
@@ -74,54 +74,21 @@ class UserControlsWidget(QWidget):
         sender = self.sender()
         command = Commands.BUTTON_COMMANDS.get(sender.text())
         # print(f"\nUser button clicked: {sender.text()}")
+        if self.trace:
+            self.trace.record(BUTTON, sender.text(), "Player 1")
 
-        # If the command is in the list, send it
-        if command:
-            self.serial_handler.send_command(command)
-
-        # If the command is "Drop", disable all buttons
+        # If the command is "Drop", drop and start the drop delay
         if sender.text() == "Drop":
-            # Update service flag
-            self._update_service_flag(True)
-
-            self.commands.drop_delay_timer() # Start the drop delay timer
-            self._toggle_all_buttons(False)
-
-        # If elevation or rotation, toggle the service flag and the other buttons
-        else:
-            self._update_service_flag(not self.service_flag)
-
-            command_action = "Start" if self.service_flag else "Stop"
-            #print(f"{command_action} {command} command")
-            
-            for button in self.findChildren(QPushButton):
-                if button != sender:
-                    button.setEnabled(not button.isEnabled())
-
-                self._update_button_style(button)
+            self.control_state.start_drop(command, "Player 1", button=sender.text())
 
-    def _update_button_style(self, button):
-        """ Update the button style based on its enabled state """
-        if button.isEnabled():
-            button.setStyleSheet(Styles.HOVER_BUTTON)
+        # If elevation or rotation, stop the command if this button started it, otherwise start it
+        elif self.control_state.is_button_active(sender.text()):
+            self.control_state.stop_toggle("Player 1", button=sender.text())
         else:
-            button.setStyleSheet(Styles.DISABLED_BUTTON)
+            self.control_state.start_toggle(command, "Player 1", button=sender.text())
     
-    def _toggle_all_buttons(self, value):
-        for button in self.findChildren(QPushButton):
-            button.setEnabled(value)
-            self._update_button_style(button)
-
-    def _receive_service_flag(self, flag: bool):
-        self.service_flag = flag # toggle the service flag
-        self._toggle_all_buttons(not flag) # toggle the buttons
-        # print(f"User controls service flag: {self.service_flag}")
-
-    def _reset_buttons_and_flags(self):
-        self._toggle_all_buttons(True) # Re-enable the buttons
-        self.service_flag = False # Reset the service flag
-
-    def _update_service_flag(self, flag: bool):
-        self.service_flag = flag
-        self.button_service_flag_changed.emit(flag)
-        # print(f"User controls service flag: {self.service_flag}")
\ No newline at end of file
+    def _handle_control_state_change(self, state):
+        """ Enable the buttons when no command is running, otherwise only the button that can stop it """
+        # The disabled style comes from the application stylesheet (Styles.APP_STYLESHEET)
+        for button in self.command_buttons:
+            button.setEnabled(not state.service_active or state.is_button_active(button.text()))
\ No newline at end of file
@@ -0,0 +1,121 @@
+""" Unit tests of the Bluetooth discovery backends, on the recorded fixtures of `benchmarks/fixtures`.
+
+PowerShell: each `powershell/<case>.txt` is parsed and compared with `<case>.expected.json`.
+BlueZ: each `bluez/<case>.json` tree is written to a temporary directory and read by the backend,
+with the D-Bus addresses of its optional "bus" dict.
+
+Usage:
+    python -m pytest tests
+"""
+# Standard libraries
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "boccia-gui"))
+
+# Custom libraries
+from bt_devices import PowerShellBackend, BlueZBackend, DiscoveryBackend
+
+FIXTURES_DIR = os.path.join(TESTS_DIR, "..", "benchmarks", "fixtures")
+
+
+def list_cases(directory:str, extension:str):
+    """ Return the names of the cases in `directory`, without `extension` """
+    return sorted(name[:-len(extension)] for name in os.listdir(directory)
+                  if name.endswith(extension) and not name.endswith(".expected.json"))
+
+
+def as_lists(result):
+    """ Return the adapters and devices of a DiscoveryResult as in the expected JSON files """
+    return {field: [list(record) for record in getattr(result, field)] for field in ("adapters", "devices")}
+
+
+class PowerShellBackendTest(unittest.TestCase):
+
+    def test_fixtures(self):
+        fixtures_dir = os.path.join(FIXTURES_DIR, "powershell")
+        cases = list_cases(fixtures_dir, ".txt")
+        self.assertTrue(cases)
+        for case in cases:
+            with self.subTest(case=case):
+                with open(os.path.join(fixtures_dir, case + ".txt"), encoding="utf-8") as f:
+                    output = f.read()
+                with open(os.path.join(fixtures_dir, case + ".expected.json"), encoding="utf-8") as f:
+                    expected = json.load(f)
+                self.assertEqual(as_lists(PowerShellBackend.parse_discovery_output(output)), expected)
+
+    def test_invalid_output(self):
+        for output in ("", "WARNING: no JSON", "{not json"):
+            with self.subTest(output=output):
+                self.assertEqual(as_lists(PowerShellBackend.parse_discovery_output(output)), {"adapters": [], "devices": []})
+
+
+class BlueZBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+
+    def load_fixture(self, case:str):
+        """ Write the tree of `case` under the temporary directory, return (backend, expected result) """
+        with open(os.path.join(FIXTURES_DIR, "bluez", case + ".json"), encoding="utf-8") as f:
+            fixture = json.load(f)
+
+        case_root = os.path.join(self.root.name, case)
+        for directory in fixture["directories"]:
+            os.makedirs(os.path.join(case_root, directory), exist_ok=True)
+        for path, content in fixture["files"].items():
+            path = os.path.join(case_root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+
+        bus = fixture.get("bus", {})
+        backend = BlueZBackend(os.path.join(case_root, "sys", "class", "bluetooth"), os.path.join(case_root, "var", "lib", "bluetooth"),
+                               lambda hci_device: bus.get(hci_device, ""))
+        return backend, fixture["expected"]
+
+    def test_fixtures(self):
+        cases = list_cases(os.path.join(FIXTURES_DIR, "bluez"), ".json")
+        self.assertTrue(cases)
+        for case in cases:
+            with self.subTest(case=case):
+                backend, expected = self.load_fixture(case)
+                self.assertEqual(as_lists(backend.discover()), expected)
+
+    def test_missing_directories(self):
+        backend = BlueZBackend(os.path.join(self.root.name, "sys"), os.path.join(self.root.name, "storage"), lambda hci_device: "")
+        self.assertEqual(as_lists(backend.discover()), {"adapters": [], "devices": []})
+
+    def test_bus_address_is_kept(self):
+        calls = []
+        def query(hci_device):
+            calls.append(hci_device)
+            return "b8:27:eb:00:11:22"
+
+        backend, _ = self.load_fixture("no_address_attribute")
+        backend.query_bus_address = query
+        for _ in range(3):
+            self.assertEqual(backend.discover().adapters[0].address, "B8:27:EB:00:11:22")
+        self.assertEqual(calls, ["hci0"])
+
+
+class FormatMacAddressTest(unittest.TestCase):
+
+    def test_formats(self):
+        for mac in ("aa-bb-cc-dd-ee-ff", "AABBCCDDEEFF", " aa:bb:cc:dd:ee:ff\n"):
+            with self.subTest(mac=mac):
+                self.assertEqual(DiscoveryBackend.format_mac_address(mac), "AA:BB:CC:DD:EE:FF")
+
+    def test_not_an_address(self):
+        for mac in ("", "hci0", "AABBCCDDEE", "GGBBCCDDEEFF"):
+            with self.subTest(mac=mac):
+                self.assertEqual(DiscoveryBackend.format_mac_address(mac), "")
+
+
+if __name__ == '__main__':
+    unittest.main()
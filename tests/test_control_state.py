@@ -0,0 +1,142 @@
+""" Unit tests of the ControlState transitions (no GUI needed).
+
+Usage:
+    python -m pytest tests
+"""
+# Standard libraries
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "boccia-gui"))
+
+# Custom libraries
+from control_state import ControlState
+
+KEY_1 = 0x31
+KEY_2 = 0x32
+
+
+class ControlStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.notified = []
+        self.state = ControlState(self.sent.append)
+        self.state.subscribe(lambda state: self.notified.append(state.mode))
+
+    def test_starts_idle(self):
+        self.assertEqual(self.state.mode, ControlState.IDLE)
+        self.assertFalse(self.state.service_active)
+        self.assertEqual(self.state.transitions, 0)
+
+    def test_hold_from_key(self):
+        self.assertTrue(self.state.start_hold("rr", key=KEY_1))
+        self.assertEqual(self.state.mode, ControlState.HOLD)
+        self.assertEqual(self.state.active_command, "rr")
+        self.assertTrue(self.state.stop_hold(key=KEY_1))
+        self.assertEqual(self.state.mode, ControlState.IDLE)
+        self.assertIsNone(self.state.active_command)
+
+        # The stop sends the running command again, and each transition notifies once
+        self.assertEqual(self.sent, ["rr", "rr"])
+        self.assertEqual(self.notified, [ControlState.HOLD, ControlState.IDLE])
+
+    def test_hold_only_stopped_by_the_same_key_or_button(self):
+        self.state.start_hold("rr", key=KEY_1)
+        self.assertFalse(self.state.stop_hold(key=KEY_2))
+        self.assertFalse(self.state.stop_hold(button="Rotate right"))
+        self.assertEqual(self.state.mode, ControlState.HOLD)
+        self.assertEqual(self.sent, ["rr"])
+
+        self.state.stop_hold(key=KEY_1)
+        self.state.start_hold("rl", button="Rotate left")
+        self.assertFalse(self.state.stop_hold(key=KEY_1))
+        self.assertTrue(self.state.stop_hold(button="Rotate left"))
+
+    def test_hold_blocks_everything_else(self):
+        self.state.start_hold("rr", key=KEY_1)
+        self.assertFalse(self.state.start_hold("rl", key=KEY_2))
+        self.assertFalse(self.state.start_toggle("rs1", "Player 1", key=KEY_2))
+        self.assertFalse(self.state.start_drop("dd-70", "Player 1", key=KEY_2))
+        self.assertFalse(self.state.stop_toggle("Player 1", key=KEY_1))
+        self.assertEqual(self.sent, ["rr"])
+        self.assertEqual(self.state.active_command, "rr")
+
+    def test_toggle_blocks_everything_else(self):
+        self.state.start_toggle("rs1", "Player 1", key=KEY_1)
+        self.assertEqual(self.state.mode, ControlState.TOGGLE)
+        self.assertFalse(self.state.start_toggle("es1", "Player 2", key=KEY_2))
+        self.assertFalse(self.state.start_hold("rr", key=KEY_2))
+        self.assertFalse(self.state.start_drop("dd-70", "Player 2"))
+        self.assertFalse(self.state.stop_hold(key=KEY_1))
+        self.assertEqual(self.sent, ["rs1"])
+
+    def test_toggle_only_stopped_by_the_same_player_and_key(self):
+        self.state.start_toggle("rs1", "Player 1", key=KEY_1)
+        self.assertFalse(self.state.stop_toggle("Player 2", key=KEY_1))
+        self.assertFalse(self.state.stop_toggle("Player 1", key=KEY_2))
+        self.assertFalse(self.state.stop_toggle("Player 1", button="Rotate"))
+        self.assertEqual(self.state.mode, ControlState.TOGGLE)
+
+        self.assertTrue(self.state.stop_toggle("Player 1", key=KEY_1))
+        self.assertEqual(self.state.mode, ControlState.IDLE)
+        self.assertEqual(self.sent, ["rs1", "rs1"])
+        # The player is kept after the command stops
+        self.assertEqual(self.state.current_player, "Player 1")
+
+    def test_toggle_from_button(self):
+        self.state.start_toggle("rs1", "Player 1", button="Rotate")
+        self.assertTrue(self.state.is_button_active("Rotate"))
+        self.assertFalse(self.state.is_button_active("Elevate"))
+        self.assertTrue(self.state.stop_toggle("Player 1", button="Rotate"))
+        self.assertFalse(self.state.is_button_active("Rotate"))
+
+    def test_drop_locks_the_controls_until_the_delay_ends(self):
+        self.assertTrue(self.state.start_drop("dd-70", "Player 1", key=KEY_1))
+        self.assertEqual(self.state.mode, ControlState.DROP)
+        self.assertTrue(self.state.drop_delay_active)
+
+        # Nothing starts or stops during the drop delay, not even from the key that dropped
+        self.assertFalse(self.state.start_drop("dd-70", "Player 1", key=KEY_1))
+        self.assertFalse(self.state.start_toggle("rs1", "Player 1", key=KEY_1))
+        self.assertFalse(self.state.start_hold("rr", key=KEY_1))
+        self.assertFalse(self.state.stop_toggle("Player 1", key=KEY_1))
+        self.assertFalse(self.state.stop_hold(key=KEY_1))
+        self.assertEqual(self.sent, ["dd-70"])
+
+    def test_end_drop_delay(self):
+        self.state.start_drop("dd-70", "Player 1", key=KEY_1)
+        self.assertTrue(self.state.end_drop_delay())
+        self.assertEqual(self.state.mode, ControlState.IDLE)
+        self.assertFalse(self.state.drop_delay_active)
+        self.assertIsNone(self.state.active_key)
+
+        # No command is sent when the delay ends, and it only ends once
+        self.assertEqual(self.sent, ["dd-70"])
+        self.assertFalse(self.state.end_drop_delay())
+        self.assertEqual(self.notified, [ControlState.DROP, ControlState.IDLE])
+
+        self.assertTrue(self.state.start_toggle("rs1", "Player 2", key=KEY_2))
+
+    def test_end_drop_delay_without_drop(self):
+        self.assertFalse(self.state.end_drop_delay())
+        self.state.start_toggle("rs1", "Player 1", key=KEY_1)
+        self.assertFalse(self.state.end_drop_delay())
+        self.assertEqual(self.state.mode, ControlState.TOGGLE)
+
+    def test_rejected_transitions_do_not_notify(self):
+        self.state.start_hold("rr", key=KEY_1)
+        self.state.start_toggle("rs1", "Player 1", key=KEY_2)
+        self.state.stop_hold(key=KEY_2)
+        self.assertEqual(self.notified, [ControlState.HOLD])
+        self.assertEqual(self.state.transitions, 1)
+
+    def test_without_send_command(self):
+        state = ControlState()
+        self.assertTrue(state.start_toggle("rs1", "Player 1", key=KEY_1))
+        self.assertTrue(state.stop_toggle("Player 1", key=KEY_1))
+
+
+if __name__ == '__main__':
+    unittest.main()
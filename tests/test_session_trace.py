@@ -0,0 +1,153 @@
+""" Unit tests of the session traces: recording, reading back (needs NumPy) and retention.
+
+Usage:
+    python -m pytest tests
+"""
+# Standard libraries
+import os
+import sys
+import datetime
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "boccia-gui"))
+
+# Custom libraries
+from session_trace import (SessionTraceRecorder, SessionTraceReader, read_strings, remove_old_traces, np,
+                           OTHER_STRING, SESSION, SENT, RECEIVED, DEVICE, KEY)
+
+TODAY = datetime.date(2024, 5, 21)
+
+
+def record_match(trace):
+    """ Record two throws, after the ramp is ready: a device drop from player 2 and a key toggle from player 1 """
+    trace.record(RECEIVED, "Ready")
+    trace.record(DEVICE, "dd-70", "Player 2")
+    trace.record(SENT, "dd-70")
+    trace.record(RECEIVED, "Rotation stopped at 37.5 deg")
+    trace.record(RECEIVED, "Rotation stopped at -12.0 deg")
+    trace.record(RECEIVED, "Drop complete")
+    trace.record(RECEIVED, "Ready")
+    trace.record(KEY, "rs1", "Player 1")
+    trace.record(SENT, "rs1")
+
+
+class SessionTraceRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "match.trace")
+
+    def test_strings_are_written_by_flush(self):
+        trace = SessionTraceRecorder(self.path, flush_interval=60)
+        self.addCleanup(trace.close)
+        record_match(trace)
+        self.assertEqual(read_strings(self.path), [])
+
+        trace.flush()
+        strings = read_strings(self.path)
+        self.assertEqual(strings[1:], ["Ready", "dd-70", "Rotation stopped at # deg", "Drop complete", "rs1"])
+        self.assertEqual(os.path.getsize(self.path), 16 + 10 * 16)  # Header, session and 9 records
+
+    def test_max_strings(self):
+        trace = SessionTraceRecorder(self.path, max_strings=3)
+        for command in ("rr", "rl", "rs1", "es1", "rr"):
+            trace.record(SENT, command)
+        trace.close()
+        self.assertEqual(read_strings(self.path)[1:], ["rr", "rl", OTHER_STRING])
+
+        # The ids are kept when the file is opened again, and the session start is always added
+        trace = SessionTraceRecorder(self.path, max_strings=3)
+        trace.record(SENT, "dd-70")
+        trace.close()
+        strings = read_strings(self.path)
+        self.assertEqual(strings[1:4], ["rr", "rl", OTHER_STRING])
+        self.assertNotIn("dd-70", strings)
+
+    def test_records_after_close_are_ignored(self):
+        trace = SessionTraceRecorder(self.path)
+        trace.close()
+        trace.record(SENT, "rr")
+        trace.flush()
+        self.assertEqual(read_strings(self.path)[1:], [])
+        self.assertEqual(os.path.getsize(self.path), 16 + 16)
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class SessionTraceReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "match.trace")
+        trace = SessionTraceRecorder(self.path)
+        record_match(trace)
+        trace.close()
+        self.reader = SessionTraceReader(self.path)
+
+    def test_records(self):
+        self.assertEqual(len(self.reader), 10)
+        self.assertEqual(list(self.reader.records["source"]), [SESSION, RECEIVED, DEVICE, SENT, RECEIVED, RECEIVED,
+                                                               RECEIVED, RECEIVED, KEY, SENT])
+        self.assertTrue((self.reader.records["time"][1:] >= self.reader.records["time"][:-1]).all())
+        self.assertEqual(self.reader.command_text(int(self.reader.records["command"][4])), "Rotation stopped at # deg")
+        self.assertEqual(self.reader.records["command"][4], self.reader.records["command"][5])
+        self.assertEqual(self.reader.command_id("Rotation stopped at 37.5 deg"), -1)
+
+    def test_sessions(self):
+        sessions = self.reader.sessions()
+        self.assertEqual(len(sessions), 1)
+        self.assertEqual((sessions[0]["first"], sessions[0]["last"]), (0, 9))
+        self.assertEqual(sessions[0]["start"], self.reader.strings[0])
+
+    def test_throws(self):
+        # Only the device drop is a throw, the key toggle is followed by its own command
+        self.assertEqual(list(self.reader.throws()), [2])
+        self.assertEqual(list(self.reader.throws(drop_command="rs1")), [8])
+
+    def test_reaction_times(self):
+        reaction_times = self.reader.reaction_times()
+        self.assertEqual(sorted(reaction_times), [1, 2])
+        times = self.reader.records["time"]
+        self.assertEqual(list(reaction_times[2]), [(times[2] - times[1]) / 1e9])
+        self.assertEqual(list(reaction_times[1]), [(times[8] - times[7]) / 1e9])
+
+        # The numbers of the ready line match any number, the last line before the key press counts
+        reaction_times = self.reader.reaction_times(ready_line="Rotation stopped at 0.0 deg")
+        self.assertEqual(sorted(reaction_times), [1])
+        self.assertEqual(list(reaction_times[1]), [(times[8] - times[5]) / 1e9])
+
+
+class RemoveOldTracesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        for name in ("2024-05-01.trace", "2024-05-01.trace.strings", "2024-05-15.trace", "2024-05-15.trace.strings",
+                     "2024-05-21.trace", "2024-05-21.trace.strings", "notes.txt", "match.trace"):
+            open(os.path.join(self.directory.name, name), "w").close()
+
+    def remaining(self):
+        return sorted(os.listdir(self.directory.name))
+
+    def test_removes_the_days_before_the_retention_period(self):
+        removed = remove_old_traces(7, self.directory.name, TODAY)
+        self.assertEqual(sorted(map(os.path.basename, removed)), ["2024-05-01.trace", "2024-05-01.trace.strings"])
+        self.assertEqual(self.remaining(), ["2024-05-15.trace", "2024-05-15.trace.strings",
+                                            "2024-05-21.trace", "2024-05-21.trace.strings", "match.trace", "notes.txt"])
+
+    def test_keeps_today(self):
+        remove_old_traces(1, self.directory.name, TODAY)
+        self.assertEqual(self.remaining(), ["2024-05-21.trace", "2024-05-21.trace.strings", "match.trace", "notes.txt"])
+
+    def test_zero_keeps_everything(self):
+        self.assertEqual(remove_old_traces(0, self.directory.name, TODAY), [])
+        self.assertEqual(len(self.remaining()), 8)
+
+    def test_missing_directory(self):
+        self.assertEqual(remove_old_traces(7, os.path.join(self.directory.name, "missing"), TODAY), [])
+
+
+if __name__ == '__main__':
+    unittest.main()